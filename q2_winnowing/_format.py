@@ -1,4 +1,7 @@
 
+import json
+import zipfile
+import numpy as np
 import qiime2.plugin.model as model
 
 # <><><> DEFINE STATIC HEADERS <><><>
@@ -9,6 +12,32 @@ _EXPECTED_AUC_HEADERS_ = ["auc", "otu.num"]
 _EXPECTED_PERMANOVA_HEADERS_ = ["test", "order", "auc", "SumsOfSqs", "MeanSqs", "F.model", "R2", "Pval",
                                 "N.taxa", "F.model.scale"]
     # Placed here since is used in multiple places
+_AUC_LINES_ = 101 # header and 1% of AUC to 100%
+_SNIFF_ROWS_ = 5 # rows validated after the header
+_SNIFF_CHUNK_ = 1 << 16 # bytes read at a time when counting lines
+_TABLE_SCHEMA_ = "schema" # member of a binary table holding its JSON schema
+_TABLE_VERSION_ = 1
+
+
+def _count_lines( path, limit ):
+    """
+    Count the lines of a file with a buffered scan of its bytes, stops once there are more than limit
+    :param path: file to count the lines of
+    :param limit: largest count needed, bounds the time of the scan on large files
+    :return: number of lines, limit + 1 if there are more than limit
+    """
+    lines = 0
+    last = b"\n"
+    with open( str( path ), "rb" ) as file:
+        chunk = file.read( _SNIFF_CHUNK_ )
+        while( chunk and lines <= limit ):
+            lines += chunk.count( b"\n" )
+            last = chunk[-1:]
+            chunk = file.read( _SNIFF_CHUNK_ )
+    if( last != b"\n" ):
+        lines += 1 # last line has no line break
+    return min( lines, limit + 1 )
+
 
 # Multiple file formats will need to be used to account for different output
 # Final output will be stored in the form of a directory format
@@ -41,11 +70,11 @@ class WinnowedAucOrderingFormat( model.TextFileFormat ):
 
     # this will just make sure that the file is in a expected format
     def sniff(self):
+        if( _count_lines( self.path, _AUC_LINES_ ) != _AUC_LINES_ ):
+            return False # 1% of AUC to 100%
         with self.open() as file:
-            if( len(list(file)) != 101 ):
-                return False # 1% of AUC to 100%
             file.readline() # ignore header
-            for line, _ in zip( file, range(5) ):
+            for line, _ in zip( file, range(_SNIFF_ROWS_) ):
                 delimited_line = line.rstrip('\n').split('\t')
                 if len(delimited_line) != 3:
                     return False # file must be 3 columns
@@ -61,18 +90,19 @@ class WinnowedPermanovaOrderingFormat(model.TextFileFormat):
 
     # this will just make sure that the file is in a expected format
     def sniff(self):
+        if( _count_lines( self.path, _AUC_LINES_ ) != _AUC_LINES_ ):
+            return False  # AUC output was used {1% of AUC to 100%}
         with self.open() as file:
-            if( len(list(file)) != 101 ):
-                return False  # AUC output was used {1% of AUC to 100%}
-            for line, idx in zip(file, range(3)):
+            for line, idx in zip(file, range(_SNIFF_ROWS_ + 1)):
                 delimited_line = list(line.rstrip("\n").split("\t"))
                 if (idx == 0):
                     # first line, verify headers
                     for header in _EXPECTED_PERMANOVA_HEADERS_:
                         if (not delimited_line.__contains__(header)):
                             return False
-                # make sure following rows aren't empty
-                if (len(delimited_line) <= 0):  # row must contain data
+                    num_columns = len(delimited_line)
+                # make sure following rows have a value for every header
+                if (len(delimited_line) != num_columns):  # row must contain data
                     return False
 
             return True  # Test passed
@@ -80,6 +110,24 @@ class WinnowedPermanovaOrderingFormat(model.TextFileFormat):
     # <><> END OF CLASS <><>
 
 
+# Define a file format representing any of the tables as typed columns
+# every column is its own array of a .npz file, described by a JSON schema stored with them
+class WinnowedTableFormat( model.BinaryFileFormat ):
+
+    # this will just make sure that the file is in a expected format, only the schema is read
+    def sniff(self):
+        if( not zipfile.is_zipfile( str( self.path ) ) ):
+            return False # npz files are zip archives
+        try:
+            with np.load( str( self.path ), allow_pickle=False ) as table:
+                schema = json.loads( str( table[_TABLE_SCHEMA_] ) )
+        except ( KeyError, ValueError ):
+            return False # not written by the binary transformers
+        return schema.get( "version" ) == _TABLE_VERSION_ and "columns" in schema
+
+    # <><> END OF CLASS <><>
+
+
 # Define a directory format to be used
 # this is necessary since multpile files will be stored in the directory
 class WinnowedDirectoryFormat( model.DirectoryFormat ):
@@ -88,15 +136,39 @@ class WinnowedDirectoryFormat( model.DirectoryFormat ):
     featureOrdering = model.File( r"feature_ordered.tsv", format=WinnowedFeatureOrderingFormat ) # Feature ordering w/ Jaccard
     auc = model.File( r"auc_ordered.tsv", format=WinnowedAucOrderingFormat ) # AUC values with ordering
     permanova = model.File( r"permanova_ordered.tsv", format=WinnowedPermanovaOrderingFormat ) # PERMANOVA values with ordering
+    # AUC and PERMANOVA of every iteration selection, only written when process() is ran with keep_all
+    aucIterations = model.FileCollection( r"auc_ordered_\d+\.tsv", format=WinnowedAucOrderingFormat, optional=True )
+    permanovaIterations = model.FileCollection( r"permanova_ordered_\d+\.tsv", format=WinnowedPermanovaOrderingFormat,
+                                                optional=True )
 
-    # <><> END OF CLASS <><>
-
-
-
+    @aucIterations.set_path_maker
+    def aucIterations_path_maker( self, iteration_selected ):
+        return f"auc_ordered_{iteration_selected}.tsv"
 
+    @permanovaIterations.set_path_maker
+    def permanovaIterations_path_maker( self, iteration_selected ):
+        return f"permanova_ordered_{iteration_selected}.tsv"
 
+    # <><> END OF CLASS <><>
 
 
+# Define an alternative directory format, the same tables as WinnowedDirectoryFormat stored as typed columns
+# so they are read back without parsing text. Artifacts stay in the tsv layout, this one is opt-in on import or export.
+class WinnowedBinaryDirectoryFormat( model.DirectoryFormat ):
+    featureOrdering = model.File( r"feature_ordered.npz", format=WinnowedTableFormat ) # Feature ordering w/ Jaccard
+    auc = model.File( r"auc_ordered.npz", format=WinnowedTableFormat ) # AUC values with ordering
+    permanova = model.File( r"permanova_ordered.npz", format=WinnowedTableFormat ) # PERMANOVA values with ordering
+    # AUC and PERMANOVA of every iteration selection, only written when process() is ran with keep_all
+    aucIterations = model.FileCollection( r"auc_ordered_\d+\.npz", format=WinnowedTableFormat, optional=True )
+    permanovaIterations = model.FileCollection( r"permanova_ordered_\d+\.npz", format=WinnowedTableFormat,
+                                                optional=True )
 
+    @aucIterations.set_path_maker
+    def aucIterations_path_maker( self, iteration_selected ):
+        return f"auc_ordered_{iteration_selected}.npz"
 
+    @permanovaIterations.set_path_maker
+    def permanovaIterations_path_maker( self, iteration_selected ):
+        return f"permanova_ordered_{iteration_selected}.npz"
 
+    # <><> END OF CLASS <><>
@@ -0,0 +1,70 @@
+
+# <><><> LAZY BRIDGE TO R <><><>
+# rpy2 starts an embedded R as soon as rpy2.robjects is imported, so it is only imported here and only once an
+# R backed calculation runs. Importing the plugin ( ex. qiime --help ) never starts R.
+# Packages are never installed from here, a missing one raises with how to install it instead of going online.
+
+_started = False
+_packages = {} # importr handles by package name
+_functions = {} # R functions by name
+
+
+def _start():
+    """
+    Start R and convert pandas objects passed to R functions, the first time R is needed
+    """
+    global _started
+    if( not _started ):
+        from rpy2.robjects import pandas2ri
+        pandas2ri.activate()
+        _started = True
+
+
+def package( name ):
+    """
+    The importr handle of an installed R package
+    :param name: name of the R package ( ex. vegan )
+    :return: rpy2 package, the same one on every call
+    """
+    if( name not in _packages ):
+        _start()
+        import rpy2.robjects.packages as rpackages
+        if( not rpackages.isinstalled( name ) ):
+            raise ImportError( f"Error: the R package {name} is not installed. "
+                               f"It can be installed in R with install.packages(\"{name}\")." )
+        _packages[name] = rpackages.importr( name )
+    return _packages[name]
+
+
+def function( name, package_name=None ):
+    """
+    An R function by its R name, for names that are not valid python ( ex. pk.calc.auc )
+    :param name: name of the function in R
+    :param package_name: package to attach first if the function comes from one
+    :return: rpy2 function, the same one on every call
+    """
+    if( name not in _functions ):
+        if( package_name is not None ):
+            package( package_name )
+        _start()
+        from rpy2.robjects import r
+        _functions[name] = r[name]
+    return _functions[name]
+
+
+def py2rpy( data ):
+    """
+    Convert a pandas object to R
+    """
+    _start()
+    from rpy2.robjects import pandas2ri
+    return pandas2ri.py2rpy( data )
+
+
+def formula( text ):
+    """
+    An R formula ( ex. x ~ y ) with its own environment
+    """
+    _start()
+    from rpy2.robjects import Formula
+    return Formula( text )
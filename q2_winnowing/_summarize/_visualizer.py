@@ -5,6 +5,8 @@ import os
 import pkg_resources
 import qiime2
 
+from q2_winnowing.step7_9.jaccard import feature_orderings, jaccard_matrix
+
 
 TEMPLATES = pkg_resources.resource_filename("q2_winnowing", "_summarize")
 
@@ -13,12 +15,13 @@ def summarize( output_dir: str, data: list ) -> None:
     Visualizer of Winnowed artifact for Qiime2
     :param output_dir: This is standard for all visualizers in Qiime2, first parameter must be output_dir
     :param data: Winnowed Artifact in form [ ( feature, auc, permanova ) ]
+    The Jaccard matrix of the features selected by each iteration selection is added from the feature ordering
     :return: Standard to have no return in Qiime2 visualizers.
     """
 
     print( "Separating data.")
 
-    feature_ordering, auc_ordering, permanova_ordering = data[0] # Split directory into its parts
+    feature_ordering, auc_ordering, permanova_ordering = data[0][:3] # Split directory into its parts
 
     # <><><> Allow user to download data <><><>
     # save out feature ordering data for download
@@ -30,6 +33,12 @@ def summarize( output_dir: str, data: list ) -> None:
     # save out PERMANOVA ordering data for download
     permanova_ordering_new = os.path.join( output_dir, 'permanova_ordered.tsv')
     permanova_ordering.to_csv( permanova_ordering_new, sep="\t" )
+    # save out Jaccard coefficient between the features selected by every iteration selection for download
+    jaccard_ordering = pd.DataFrame( jaccard_matrix( feature_orderings( feature_ordering ).values ),
+                                     index=feature_ordering["iteration select"].values,
+                                     columns=feature_ordering["iteration select"].values )
+    jaccard_ordering_new = os.path.join( output_dir, 'jaccard_matrix.tsv')
+    jaccard_ordering.to_csv( jaccard_ordering_new, sep="\t" )
 
     print( "Retrieving templates.")
 
@@ -38,6 +47,7 @@ def summarize( output_dir: str, data: list ) -> None:
     feature_ordering_html = os.path.join( TEMPLATES, "assets", "feature_ordered.html" )
     auc_html = os.path.join( TEMPLATES, "assets", "auc.html" )
     permanova_html = os.path.join( TEMPLATES, "assets", "permanova.html" )
+    jaccard_html = os.path.join( TEMPLATES, "assets", "jaccard.html" )
 
     print( "Writing to templates.")
 
@@ -50,6 +60,8 @@ def summarize( output_dir: str, data: list ) -> None:
     shutil.copyfile( auc_html, auc_html_new )
     permanova_html_new = os.path.join( output_dir, "permanova.html" )
     shutil.copyfile( permanova_html, permanova_html_new )
+    jaccard_html_new = os.path.join( output_dir, "jaccard.html" )
+    shutil.copyfile( jaccard_html, jaccard_html_new )
 
     print( "Formatting templates.")
 
@@ -74,6 +86,8 @@ def summarize( output_dir: str, data: list ) -> None:
         f.write( dataframe_format_string.format( table=auc_ordering.to_html(classes="style_df")) )
     with open( permanova_html_new, "w" ) as f:
         f.write( dataframe_format_string.format( table=permanova_ordering.to_html(classes="style_df")) )
+    with open( jaccard_html_new, "w" ) as f:
+        f.write( dataframe_format_string.format( table=jaccard_ordering.to_html(classes="style_df")) )
 
     print( "Finished.")
 
@@ -1,10 +1,15 @@
 
+import io
+import re
+import json
 import shutil
+import numpy as np
 import pandas as pd
 
 from .plugin_setup import plugin
 from ._format import ( WinnowedDirectoryFormat, WinnowedFeatureOrderingFormat,
-                       WinnowedAucOrderingFormat, WinnowedPermanovaOrderingFormat )
+                       WinnowedAucOrderingFormat, WinnowedPermanovaOrderingFormat,
+                       WinnowedTableFormat, WinnowedBinaryDirectoryFormat, _TABLE_SCHEMA_, _TABLE_VERSION_ )
 
 
 # <><><> DEFINE STATIC HEADERS FOR SNIFFING <><><>
@@ -20,6 +25,131 @@ _EXPECTED_PERMANOVA_HEADERS_ = ["test", "order", "auc", "SumsOfSqs", "MeanSqs",
     # Placed here since is used in multiple places
 
 
+# <><><> Define readers shared by the transformers <><><>
+def _read_rows( wf ):
+    """
+    Parse the rest of a tsv in a single pass, rows shorter than the widest one are padded with NaN
+    :param wf: open file with the read cursor past the headers
+    :return: dataframe of the cells as strings, columns 0 to the width of the widest row
+    """
+    text = wf.read()
+    widths = np.array( [ line.count("\t") + 1 for line in text.splitlines() ], dtype=np.int64 )
+    if( len( widths ) == 0 ):
+        return pd.DataFrame()
+    rows_df = pd.read_csv( io.StringIO( text ), sep="\t", header=None, names=range( widths.max() ), dtype=str,
+                           keep_default_na=False, skip_blank_lines=False )
+    # keep empty cells as read but cells past the end of a row missing
+    return rows_df.mask( np.arange( widths.max() ) >= widths[:, None] )
+
+
+def _set_columns( rows_df, expected_col, name ):
+    """
+    Drop the index column of the rows if they have one and name their columns
+    :param rows_df: dataframe from _read_rows()
+    :param expected_col: columns the rows should fit in
+    :param name: name of the table for errors ( ex. AUC )
+    :return: dataframe with the expected columns, rows without a value for every column are padded with NaN
+    """
+    if( rows_df.empty ):
+        return pd.DataFrame( columns=expected_col )
+    if( rows_df[0].str.isdigit().all() ):
+        rows_df = rows_df.iloc[:, 1:] # index column can be removed
+    rows_df.columns = range( rows_df.shape[1] )
+    too_long = rows_df.iloc[:, len( expected_col ):].notna().any( axis=1 )
+    if( too_long.any() ):
+        row = rows_df[too_long].iloc[0].dropna().tolist()
+        raise ValueError( f"{name}: header does not have enough columns for row:\n\t{row}" )
+
+    # Make sure dataframe has proper index and column values
+    rows_df = rows_df.reindex( columns=range( len( expected_col ) ) )
+    rows_df.columns = expected_col
+    rows_df.reset_index( drop=True, inplace=True )
+    return rows_df
+
+
+# <><><> Define columnar tables shared by the binary transformers <><><>
+def _label( label ):
+    # column and index names as JSON values, numpy integers become ints so OTU columns keep their numbers
+    return label.item() if isinstance( label, np.generic ) else label
+
+
+def _encode_column( values, key, arrays ):
+    """
+    Store a column as an array of the table, without pickling python objects
+    :param values: series to store
+    :param key: name of the array in the table
+    :param arrays: arrays of the table by name, the column is added to it
+    :return: schema of the column
+    """
+    if( values.dtype.kind in "biufcmM" ):
+        arrays[key] = values.to_numpy()
+        return { "key": key, "kind": "typed" }
+    # object columns are stored as the type of their values, missing values are kept in a mask
+    missing = values.isna().to_numpy()
+    inferred = pd.api.types.infer_dtype( values, skipna=True )
+    if( inferred in ( "boolean", "integer", "floating", "mixed-integer-float" ) ):
+        fill = False if( inferred == "boolean" ) else 0
+        arrays[key] = np.asarray( values.mask( missing, fill ).tolist() )
+        kind = "object"
+    else: # strings, anything else is stored as its text
+        arrays[key] = values.mask( missing, "" ).astype( str ).to_numpy( dtype=str )
+        kind = "string"
+    if( missing.any() ):
+        arrays[f"{key}_missing"] = missing
+    return { "key": key, "kind": kind, "missing": bool( missing.any() ) }
+
+
+def _decode_column( table, column ):
+    # values of a column stored by _encode_column(), object and string columns are read back as objects
+    values = table[column["key"]]
+    if( column["kind"] == "typed" ):
+        return values
+    values = values.astype( object )
+    if( column["missing"] ):
+        values[table[f"{column['key']}_missing"]] = np.nan
+    return values
+
+
+def _write_table( data, path, compress=True ):
+    """
+    Write a dataframe as a .npz of its columns with a JSON schema of their names and types
+    :param data: dataframe to write
+    :param path: file to write to
+    :param compress: deflate the arrays, set to False to trade size for write speed
+    """
+    arrays = {}
+    columns = [ dict( _encode_column( data.iloc[:, i], f"column_{i}", arrays ), name=_label( label ) )
+                for i, label in enumerate( data.columns ) ]
+    if( isinstance( data.index, pd.RangeIndex ) ):
+        index = { "name": _label( data.index.name ),
+                  "range": [ int( data.index.start ), int( data.index.stop ), int( data.index.step ) ] }
+    else:
+        index = dict( _encode_column( data.index.to_series(), "index", arrays ), name=_label( data.index.name ) )
+    arrays[_TABLE_SCHEMA_] = np.array( json.dumps( { "version": _TABLE_VERSION_, "columns": columns, "index": index } ) )
+
+    save = np.savez_compressed if( compress ) else np.savez
+    with open( path, "wb" ) as f: # file object so numpy does not add a .npz extension
+        save( f, **arrays )
+
+
+def _read_table( path ):
+    """
+    Read a dataframe written by _write_table()
+    :param path: file to read
+    :return: dataframe with the same columns, types and index that were written
+    """
+    with np.load( path, allow_pickle=False ) as table:
+        schema = json.loads( str( table[_TABLE_SCHEMA_] ) )
+        data = pd.DataFrame( { i: _decode_column( table, column ) for i, column in enumerate( schema["columns"] ) } )
+        index = schema["index"]
+        if( "range" in index ):
+            data.index = pd.RangeIndex( *index["range"], name=index["name"] )
+        else:
+            data.index = pd.Index( _decode_column( table, index ), name=index["name"] )
+    data.columns = [ column["name"] for column in schema["columns"] ]
+    return data
+
+
 # <><><> Define transformers for reading in and writing out format information <><><>
 # Define transformer to convert featureOrdering file format into dataframe
     # Standard to use a non-meaningful name for plugin transformer
@@ -27,47 +157,17 @@ _EXPECTED_PERMANOVA_HEADERS_ = ["test", "order", "auc", "SumsOfSqs", "MeanSqs",
 def _1( WinnowedFile: WinnowedFeatureOrderingFormat ) -> pd.DataFrame:
     # No Doc String since annotation describes functionality
     with WinnowedFile.open() as wf:
-        wf.seek(0)
         wf.readline() # Move past headers
-        is_ab_comp = wf.readline().split("\t")[1] # read ab_bool from ab_comp column
-        wf.seek(0)  # Reset read cursor to start of data
-        if( is_ab_comp == False or is_ab_comp == "False" ):
-            expected_col = _EXPECTED_FEATURE_HEADERS_FALSE_ + \
-                           list( range(1, abs( len(_EXPECTED_FEATURE_HEADERS_FALSE_) - max([ len(lwf.rstrip("\n").split("\t")) for lwf in wf ]) )) )
-            wf.seek( 0 ) # Reset read cursor to start of data
-            wf.readline() # skip headers
-            orderedFeatures_df = pd.DataFrame()
-            for line in wf:
-                row = line.rstrip("\n").split("\t")
-                if( str(row[0]).isdigit() ):
-                    row = row[1:] # index column can be removed
-                if( len(row) > len( expected_col ) ):
-                    raise ValueError( f"FeatureOrdering: header does not have enough columns for row:\n\t{row}" )
-                orderedFeatures_df = orderedFeatures_df.append( [row], ignore_index=True )
-
-            # Make sure dataframe has proper index and column values
-            orderedFeatures_df.columns = expected_col # Append changes columns so got to reset
-            orderedFeatures_df.reset_index( drop=True, inplace=True )
-            return orderedFeatures_df
-        else:
-            expected_col = _EXPECTED_FEATURE_HEADERS_TRUE_ + \
-                           list(range(1, abs(len(_EXPECTED_FEATURE_HEADERS_TRUE_) - max(
-                               [len(lwf.rstrip("\n").split("\t")) for lwf in wf]))))
-            wf.seek(0)  # Reset read cursor to start of data
-            wf.readline()  # skip headers
-            orderedFeatures_df = pd.DataFrame()
-            for line in wf:
-                row = line.rstrip("\n").split("\t")
-                if (str(row[0]).isdigit()):
-                    row = row[1:]  # index column can be removed
-                if (len(row) > len(expected_col)):
-                    raise ValueError(f"FeatureOrdering: header does not have enough columns for row:\n\t{row}")
-                orderedFeatures_df = orderedFeatures_df.append([row], ignore_index=True)
-
-            # Make sure dataframe has proper index and column values
-            orderedFeatures_df.columns = expected_col  # Append changes columns so got to reset
-            orderedFeatures_df.reset_index(drop=True, inplace=True)
-            return orderedFeatures_df
+        rows_df = _read_rows( wf )
+
+    is_ab_comp = rows_df.iloc[0, 1] if( not rows_df.empty ) else False # read ab_bool from ab_comp column
+    if( is_ab_comp == False or is_ab_comp == "False" ):
+        expected_headers = _EXPECTED_FEATURE_HEADERS_FALSE_
+    else:
+        expected_headers = _EXPECTED_FEATURE_HEADERS_TRUE_
+    # the ordered features follow the headers, as many as there are in the widest row
+    expected_col = expected_headers + list( range( 1, abs( len( expected_headers ) - rows_df.shape[1] ) ) )
+    return _set_columns( rows_df, expected_col, "FeatureOrdering" )
 
 
 
@@ -89,21 +189,8 @@ def _2( data: pd.DataFrame ) -> WinnowedFeatureOrderingFormat:
 def _3( AucFile: WinnowedAucOrderingFormat ) -> pd.DataFrame:
     # No Doc String since annotation describes functionality
     with AucFile.open() as wf:
-        expected_col = _EXPECTED_AUC_HEADERS_
-        auc_df = pd.DataFrame()
         wf.readline() # skip headers
-        for line in wf:
-            row = line.rstrip("\n").split("\t")
-            if( str(row[0]).isdigit() ):
-                row = row[1:] # index column can be removed
-            if( len(row) > len( expected_col ) ):
-                raise ValueError( f"AUC: header does not have enough columns for row:\n\t{row}" )
-            auc_df = auc_df.append( [row], ignore_index=True )
-
-        # Make sure dataframe has proper index values
-        auc_df.columns = expected_col # Append changes columns so got to reset
-        auc_df.reset_index( drop=True, inplace=True )
-        return auc_df
+        return _set_columns( _read_rows( wf ), _EXPECTED_AUC_HEADERS_, "AUC" )
 
 
 # Define transformer to convert auc dataframe to file format
@@ -124,21 +211,14 @@ def _4( data: pd.DataFrame ) -> WinnowedAucOrderingFormat:
 def _5( PermanovaFile: WinnowedPermanovaOrderingFormat ) -> pd.DataFrame:
     # No Doc String since annotation describes functionality
     with PermanovaFile.open() as wf:
-        expected_col = _EXPECTED_PERMANOVA_HEADERS_
-        permanova_df = pd.DataFrame()
-        wf.readline() # skip headers
-        for line in wf:
-            row = line.rstrip("\n").split("\t")
-            if( str(row[0]).isdigit() ):
-                row = row[1:] # index column can be removed
-            if( len(row) > len( expected_col ) ):
-                raise ValueError( f"PERMANOVA: header does not have enough columns for row:\n\t{row}" )
-            permanova_df = permanova_df.append( [row], ignore_index=True )
-
-        # Make sure dataframe has proper index values
-        permanova_df.columns = expected_col # Append changes columns so got to reset
-        permanova_df.reset_index( drop=True, inplace=True )
-        return permanova_df
+        # columns come from the header, a knee search adds a knee column to the expected ones
+        expected_col = wf.readline().rstrip("\n").split("\t")
+        if( expected_col[0] == "" ):
+            expected_col = expected_col[1:] # index column can be removed
+        for header in _EXPECTED_PERMANOVA_HEADERS_:
+            if( header not in expected_col ):
+                raise ValueError( f"PERMANOVA: header is missing the {header} column:\n\t{expected_col}" )
+        return _set_columns( _read_rows( wf ), expected_col, "PERMANOVA" )
 
 
 # Define transformer to convert permanova dataframe to file format
@@ -153,6 +233,44 @@ def _6( data: pd.DataFrame ) -> WinnowedPermanovaOrderingFormat:
     return wf
 
 
+# Define transformer to convert binary table format into dataframe
+    # Standard to use a non-meaningful name for plugin transformer
+@plugin.register_transformer
+def _9( TableFile: WinnowedTableFormat ) -> pd.DataFrame:
+    # No Doc String since annotation describes functionality
+    return _read_table( str( TableFile.path ) )
+
+
+# Define transformer to convert dataframe to binary table format
+    # Standard to use a non-meaningful name for plugin transformer
+@plugin.register_transformer
+def _10( data: pd.DataFrame ) -> WinnowedTableFormat:
+    # No Doc String since annotation describes functionality
+    tf = WinnowedTableFormat()
+    _write_table( data, str( tf.path ) )
+
+    return tf
+
+
+def _iteration_of( relpath ):
+    # iteration selection from the name of a file written with keep_all ( ex. auc_ordered_16.tsv )
+    return int( re.search( r"_(\d+)\.\w+$", str( relpath ) ).group(1) )
+
+
+def _pair_iterations( iteration_auc, iteration_permanova ):
+    """
+    Pair the AUC and PERMANOVA tables of each iteration selection kept with keep_all
+    :param iteration_auc: AUC dataframe by iteration selection
+    :param iteration_permanova: PERMANOVA dataframe by iteration selection
+    :return: dictionary of ( AUC, PERMANOVA ) by iteration selection
+    """
+    for iteration_selected in sorted( set( iteration_auc ) ^ set( iteration_permanova ) ):
+        missing = "PERMANOVA" if( iteration_selected in iteration_auc ) else "AUC"
+        raise ValueError( f"Winnowed: iteration selection {iteration_selected} has no {missing} table" )
+    return { iteration_selected: ( iteration_auc[iteration_selected], iteration_permanova[iteration_selected] )
+             for iteration_selected in sorted( iteration_auc ) }
+
+
 # <><><> Define directory transformers for reading in and writing out format information <><><>
 # Define transformer to convert permanova file format into dataframe
     # Standard to use a non-meaningful name for plugin transformer
@@ -173,6 +291,15 @@ def _7( dirfmt: WinnowedDirectoryFormat ) -> list:
         artifact_permanova.view(pd.DataFrame)
     ) ]
 
+        # AUC and PERMANOVA of every iteration selection if they were kept
+    iteration_auc = { _iteration_of( relpath ): view.view(pd.DataFrame)
+                      for relpath, view in dirfmt.aucIterations.iter_views( WinnowedAucOrderingFormat ) }
+    iteration_permanova = { _iteration_of( relpath ): view.view(pd.DataFrame)
+                            for relpath, view in dirfmt.permanovaIterations.iter_views( WinnowedPermanovaOrderingFormat ) }
+    iteration_outputs = _pair_iterations( iteration_auc, iteration_permanova )
+    if( iteration_outputs ):
+        dirTuple = [ dirTuple[0] + ( iteration_outputs, ) ]
+
     return dirTuple
 
 
@@ -193,8 +320,68 @@ def _8( data: list ) -> WinnowedDirectoryFormat:
     shutil.copyfile( _4( oa ).path, auc_fp ) # AUC
     shutil.copyfile( _6( op ).path, permanova_fp ) # PERMANOVA
 
+    if( len( data[0] ) > 3 ): # AUC and PERMANOVA of every iteration selection with keep_all
+        for iteration_selected, ( auc_df, permanova_df ) in data[0][3].items():
+            shutil.copyfile( _4( auc_df ).path, str( path / f"auc_ordered_{iteration_selected}.tsv" ) )
+            shutil.copyfile( _6( permanova_df ).path, str( path / f"permanova_ordered_{iteration_selected}.tsv" ) )
+
+    return result
+
+
+# <><><> Define binary directory transformers for reading in and writing out format information <><><>
+# Define transformer to convert binary directory format into the list of tables
+    # Standard to use a non-meaningful name for plugin transformer
+@plugin.register_transformer
+def _11( dirfmt: WinnowedBinaryDirectoryFormat ) -> list:
+    # No Doc String since annotation describes functionality
+    dirTuple = ( dirfmt.featureOrdering.view( pd.DataFrame ),
+                 dirfmt.auc.view( pd.DataFrame ),
+                 dirfmt.permanova.view( pd.DataFrame ) )
+
+        # AUC and PERMANOVA of every iteration selection if they were kept
+    iteration_auc = { _iteration_of( relpath ): view
+                      for relpath, view in dirfmt.aucIterations.iter_views( pd.DataFrame ) }
+    iteration_permanova = { _iteration_of( relpath ): view
+                            for relpath, view in dirfmt.permanovaIterations.iter_views( pd.DataFrame ) }
+    iteration_outputs = _pair_iterations( iteration_auc, iteration_permanova )
+    if( iteration_outputs ):
+        dirTuple = dirTuple + ( iteration_outputs, )
+
+    return [ dirTuple ]
+
+
+# Define transformer to convert the list of tables to binary directory format
+    # Standard to use a non-meaningful name for plugin transformer
+@plugin.register_transformer
+def _12( data: list ) -> WinnowedBinaryDirectoryFormat:
+    # No Doc String since annotation describes functionality
+    result = WinnowedBinaryDirectoryFormat()
+    path = result.path
+    of, oa, op = data[0][:3]
+
+    _write_table( of, str( path / "feature_ordered.npz" ) ) # feature ordering
+    _write_table( oa, str( path / "auc_ordered.npz" ) ) # AUC
+    _write_table( op, str( path / "permanova_ordered.npz" ) ) # PERMANOVA
+
+    if( len( data[0] ) > 3 ): # AUC and PERMANOVA of every iteration selection with keep_all
+        for iteration_selected, ( auc_df, permanova_df ) in data[0][3].items():
+            _write_table( auc_df, str( path / f"auc_ordered_{iteration_selected}.npz" ) )
+            _write_table( permanova_df, str( path / f"permanova_ordered_{iteration_selected}.npz" ) )
+
     return result
 
 
+# Define transformer to upgrade a tsv directory to binary directory format, used when exporting as binary tables
+    # Standard to use a non-meaningful name for plugin transformer
+@plugin.register_transformer
+def _13( dirfmt: WinnowedDirectoryFormat ) -> WinnowedBinaryDirectoryFormat:
+    # No Doc String since annotation describes functionality
+    return _12( _7( dirfmt ) )
 
 
+# Define transformer to convert binary directory format to a tsv directory, used when importing binary tables
+    # Standard to use a non-meaningful name for plugin transformer
+@plugin.register_transformer
+def _14( dirfmt: WinnowedBinaryDirectoryFormat ) -> WinnowedDirectoryFormat:
+    # No Doc String since annotation describes functionality
+    return _8( _11( dirfmt ) )
@@ -8,7 +8,8 @@ from q2_types.feature_table import FeatureTable, Frequency
 import q2_winnowing
 from ._type import Winnowed
 from ._format import ( WinnowedDirectoryFormat, WinnowedFeatureOrderingFormat,
-                       WinnowedAucOrderingFormat, WinnowedPermanovaOrderingFormat )
+                       WinnowedAucOrderingFormat, WinnowedPermanovaOrderingFormat,
+                       WinnowedTableFormat, WinnowedBinaryDirectoryFormat )
 from q2_winnowing.winnow import process
 from q2_winnowing._summarize._visualizer import summarize
 
@@ -21,6 +22,13 @@ _CENTRALITY_TYPES_ = ["betweenness", "closeness", "degree", "eigenvector"]
 _SMOOTHING_TYPES_ = ["sliding_window"]
 _CORRELATION_TYPES_ = ["spearman", "pearson", "kendall", "MIC"]
 _CORRELATION_PROPERTIES_ = ["negative", "positive", "both"]
+_CORRELATION_ENGINES_ = ["pandas", "numpy", "numpy_float32"]
+_CENTRALITY_ENGINES_ = ["networkx", "sparse"]
+# <><><> NOTE: THESE ARE FOR STEPS 4-5 <><><>
+_AUC_ENGINES_ = ["PKNCA", "numpy"]
+# <><><> NOTE: THESE ARE FOR STEP 6 <><><>
+_PERMANOVA_ENGINES_ = ["vegan", "numpy"]
+_PERMANOVA_SEARCHES_ = ["all", "knee"]
 _ALL_OR_INT_ = ["all", "0,1,2,3,..."]
 _BOOLEAN_ = ["True", "False"]
 
@@ -43,9 +51,11 @@ plugin.register_semantic_types(Winnowed)
 
 # Register the formats defined
 plugin.register_formats( WinnowedFeatureOrderingFormat, WinnowedAucOrderingFormat,
-                         WinnowedPermanovaOrderingFormat, WinnowedDirectoryFormat )
+                         WinnowedPermanovaOrderingFormat, WinnowedDirectoryFormat,
+                         WinnowedTableFormat, WinnowedBinaryDirectoryFormat )
 
 # Register directory format with semantic type
+    # WinnowedBinaryDirectoryFormat is opt-in, artifacts are converted to and from it by the transformers
 plugin.register_semantic_type_to_format(
     Winnowed,
     artifact_format=WinnowedDirectoryFormat
@@ -89,7 +99,22 @@ plugin.methods.register_function(
         "weighted": qiime2.plugin.Bool,
         "correlation_prop": qiime2.plugin.Str % qiime2.plugin.Choices(_CORRELATION_PROPERTIES_),
         "min_connected": qiime2.plugin.Float,
-        "detailed": qiime2.plugin.Bool
+        "detailed": qiime2.plugin.Bool,
+        "correlation_engine": qiime2.plugin.Str % qiime2.plugin.Choices(_CORRELATION_ENGINES_),
+        "correlation_jobs": qiime2.plugin.Int,
+        "centrality_engine": qiime2.plugin.Str % qiime2.plugin.Choices(_CENTRALITY_ENGINES_),
+        "centrality_pivots": qiime2.plugin.Int % qiime2.plugin.Range(0, None),
+        "centrality_epsilon": qiime2.plugin.Float % qiime2.plugin.Range(0, None),
+        "centrality_confidence": qiime2.plugin.Float % qiime2.plugin.Range(0, 1, inclusive_start=False,
+                                                                           inclusive_end=False),
+        "incremental_graph": qiime2.plugin.Bool,
+        "n_jobs": qiime2.plugin.Int % qiime2.plugin.Range(1, None),
+        "keep_all": qiime2.plugin.Bool,
+        "auc_engine": qiime2.plugin.Str % qiime2.plugin.Choices(_AUC_ENGINES_),
+        "permanova_engine": qiime2.plugin.Str % qiime2.plugin.Choices(_PERMANOVA_ENGINES_),
+        "permanova_search": qiime2.plugin.Str % qiime2.plugin.Choices(_PERMANOVA_SEARCHES_),
+        "permanova_alpha": qiime2.plugin.Float % qiime2.plugin.Range(0, 1),
+        "permanova_jobs": qiime2.plugin.Int % qiime2.plugin.Range(1, None)
     },
     parameter_descriptions={
         "name": ("This is the string that will be attached to output files. This is used especially in "
@@ -122,7 +147,53 @@ plugin.methods.register_function(
         "min_connected": (
             "The minimum percentage of connectedness of the graph that should be considered before the winnowing process is aborted. "),
         "detailed": ("Notifies plugin to output diagrams and csv files to each steps respective output folder throughout "
-                     "computation. If not enabled files will not be generated. ")
+                     "computation. If not enabled files will not be generated. "),
+        "correlation_engine": (
+            "If graph_centrality is the metric, this is the engine used to build spearman and pearson correlations. "
+            "numpy computes the whole matrix with matrix products, numpy_float32 does the same in single precision "
+            "to halve memory use on large tables. "),
+        "correlation_jobs": (
+            "If graph_centrality is the metric and kendall or MIC is the correlation, this is the number of processes "
+            "used to build the correlation matrix. "),
+        "centrality_engine": (
+            "If graph_centrality is the metric, this is the library used to find the centrality. "
+            "sparse works on a scipy.sparse adjacency matrix and is much faster on large graphs. "),
+        "centrality_pivots": (
+            "If centrality is betweenness or closeness, estimate it from this many sampled source nodes instead of "
+            "all of them. The share of selected features that are sure to rank in the top is reported as the "
+            "rank stability. 0 finds the exact centrality. "),
+        "centrality_epsilon": (
+            "If centrality_pivots is 0, sample enough source nodes for the estimated betweenness or closeness to be "
+            "within this error. 0 finds the exact centrality. "),
+        "centrality_confidence": (
+            "The chance that every estimated centrality is within the error bound. -------default: 0.95------- "),
+        "incremental_graph": (
+            "If graph_centrality is the metric, keep the correlation graph between iterations and only remove the "
+            "selected features from it instead of building it again. Makes small iteration_select values faster. "),
+        "n_jobs": (
+            "Number of processes used to run the feature selection of the different iteration_select values at the "
+            "same time. -------default: 1------- "),
+        "keep_all": (
+            "Calculate the AUC and PERMANOVA of every iteration_select value and add them to the output, by default "
+            "only those of the highest successful iteration_select are calculated. "),
+        "auc_engine": (
+            "Engine used to find the percentiles of the AUC of the feature ordering. PKNCA calls R for every candidate "
+            "end point, numpy finds them all from a single cumulative sum of the areas. "),
+        "permanova_engine": (
+            "Engine used to calculate the PERMANOVA of each AUC percentile. vegan calls adonis in R, numpy calculates "
+            "the same table from the hellinger distances and tests all 999 permutations as matrix products. "),
+        "permanova_search": (
+            "AUC percentiles to calculate the PERMANOVA of. all calculates every one, knee tests every 10% and then "
+            "halves the steepest step of the scaled F-model until the knee is found, about 15 PERMANOVAs instead of "
+            "100. Only the tested rows of the PERMANOVA table are filled and the knee is marked in its knee column. "),
+        "permanova_alpha": (
+            "If permanova_engine is numpy, stop the permutations of each PERMANOVA as soon as its p value is known to "
+            "be above or below this significance level. The permutations used are in the N.perm column. "
+            "0 runs all 999 permutations. -------default: 0.0------- "),
+        "permanova_jobs": (
+            "Number of processes to run the PERMANOVAs of the AUC percentiles in. Each subset draws its permutations "
+            "from a seed of its own so the results do not depend on it, with vegan every process runs its own R. "
+            "-------default: 1------- ")
     },
     output_descriptions={
         "result": ("This is a directory containing an feature ordering based off influential taxom. "
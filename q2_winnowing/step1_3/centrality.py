@@ -0,0 +1,257 @@
+# Loading packages here
+import math
+
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
+import scipy.sparse.linalg as sparse_linalg
+
+_BATCH_SIZE_ = 256  # number of source nodes searched at a time for closeness and betweenness
+_DENSE_NODES_ = 64  # graphs up to this size use a dense eigen solver, eigsh needs more nodes than eigenvectors
+_PIVOT_SEED_ = 0  # pivots are drawn from a fixed seed so runs can be repeated
+
+
+def node_order(first, second):
+    """
+    Function node_order: The positions of the nodes with an edge, in the order networkx adds them
+    :param first: @type numpy array: position of one end of each edge
+    :param second: @type numpy array: position of the other end of each edge
+    :return: @type numpy array: the correlation matrix position of each node
+    """
+    # networkx.Graph.add_edge( second, first ) adds second before first if either is new
+    appearance = np.column_stack((second, first)).ravel()
+    positions, first_seen = np.unique(appearance, return_index=True)
+    return appearance[np.sort(first_seen)]
+
+
+def edge_structure(first, second):
+    """
+    Function edge_structure: The nodes and unweighted adjacency of the graph with the edges from threshold_edges().
+        Nodes are ordered the way networkx adds them, so results line up with the networkx graph of the same edges.
+    :param first: @type numpy array: position of one end of each edge
+    :param second: @type numpy array: position of the other end of each edge
+    :return: @type tuple: ( nodes, adjacency ) the correlation matrix position of each node and the
+        nodes x nodes scipy csr_matrix, with a 1 on the diagonal for a self loop
+    """
+    nodes = node_order(first, second)
+
+    node_of = np.empty(nodes.max(initial=-1) + 1, dtype=np.intp)
+    node_of[nodes] = np.arange(len(nodes))
+    rows, columns = node_of[first], node_of[second]
+    off_diagonal = rows != columns
+    adjacency = sparse.csr_matrix((np.ones(len(rows) + np.count_nonzero(off_diagonal)),
+                                   (np.concatenate((rows, columns[off_diagonal])),
+                                    np.concatenate((columns, rows[off_diagonal])))),
+                                  shape=(len(nodes), len(nodes)))
+    return nodes, adjacency
+
+
+def largest_component(adjacency):
+    """
+    Function largest_component: The nodes of the largest connected component, the first one found on ties as
+        with max() over networkx.connected_components()
+    :param adjacency: @type scipy csr_matrix: see edge_structure()
+    :return: @type numpy array: the nodes of the component in graph order
+    """
+    if adjacency.shape[0] == 0:
+        return np.empty(0, dtype=np.intp)
+    num_components, labels = csgraph.connected_components(adjacency, directed=False)
+    return np.flatnonzero(labels == np.argmax(np.bincount(labels)))
+
+
+def degree_centrality(adjacency):
+    """
+    Function degree_centrality: degree / ( n - 1 ), a self loop adds 2 to the degree as in networkx
+    :param adjacency: @type scipy csr_matrix: the adjacency of a connected graph
+    :return: @type numpy array: the centrality of each node
+    """
+    num_nodes = adjacency.shape[0]
+    if num_nodes <= 1:
+        return np.ones(num_nodes)
+    degree = np.diff(adjacency.indptr) + (adjacency.diagonal() != 0)
+    return degree * (1.0 / (num_nodes - 1.0))
+
+
+def _source_batches(sources, batch_size):
+    for start in range(0, len(sources), batch_size):
+        yield sources[start:start + batch_size]
+
+
+def closeness_centrality(adjacency, batch_size=_BATCH_SIZE_):
+    """
+    Function closeness_centrality: ( n - 1 ) / the sum of the shortest path lengths from each node
+    :param adjacency: @type scipy csr_matrix: the adjacency of a connected graph
+    :param batch_size: @type int: the number of source nodes searched at a time
+    :return: @type numpy array: the centrality of each node
+    """
+    num_nodes = adjacency.shape[0]
+    closeness = np.zeros(num_nodes)
+    if num_nodes <= 1:
+        return closeness
+    for sources in _source_batches(np.arange(num_nodes), batch_size):
+        total = csgraph.shortest_path(adjacency, directed=False, unweighted=True, indices=sources).sum(axis=1)
+        closeness[sources] = np.divide(num_nodes - 1.0, total, out=np.zeros(len(sources)), where=total > 0)
+    return closeness
+
+
+def betweenness_centrality(adjacency, batch_size=_BATCH_SIZE_, pivots=None):
+    """
+    Function betweenness_centrality: Brandes' algorithm for a batch of sources at a time. The breadth first search
+        comes from csgraph, the path counts and dependencies are then pushed one distance level at a time with
+        the adjacency, for every source of the batch at once. Normalised by 1 / ( ( n - 1 ) * ( n - 2 ) )
+    :param adjacency: @type scipy csr_matrix: the adjacency of a connected graph
+    :param batch_size: @type int: the number of source nodes searched at a time
+    :param pivots: @type numpy array: only count paths from these sources and scale up by n / k, None for all nodes
+    :return: @type numpy array: the centrality of each node
+    """
+    num_nodes = adjacency.shape[0]
+    betweenness = np.zeros(num_nodes)
+    adjacency = adjacency - sparse.diags(adjacency.diagonal())  # self loops are never on a shortest path
+    for sources in _source_batches(np.arange(num_nodes) if pivots is None else pivots, batch_size):
+        columns = np.arange(len(sources))
+        # nodes x sources, the distance of every node from each source of the batch
+        distance = csgraph.shortest_path(adjacency, directed=False, unweighted=True, indices=sources).T
+        distance[np.isinf(distance)] = -1
+        max_distance = int(distance.max())
+
+        paths = np.zeros(distance.shape)  # number of shortest paths from the source
+        paths[sources, columns] = 1
+        for level in range(1, max_distance + 1):
+            previous = np.where(distance == level - 1, paths, 0)
+            paths += np.where(distance == level, adjacency @ previous, 0)
+
+        dependency = np.zeros(distance.shape)
+        for level in range(max_distance, 0, -1):
+            coefficient = np.divide(1 + dependency, paths, out=np.zeros(distance.shape), where=distance == level)
+            dependency += np.where(distance == level - 1, paths * (adjacency @ coefficient), 0)
+
+        dependency[sources, columns] = 0  # a source does not count towards its own betweenness
+        betweenness += dependency.sum(axis=1)
+
+    if num_nodes > 2:
+        scale = 1 / ((num_nodes - 1) * (num_nodes - 2))
+        if pivots is not None:
+            scale = scale * num_nodes / len(pivots)
+        betweenness *= scale
+    return betweenness
+
+
+def _check_confidence(confidence):
+    # Hoeffding's bound needs a chance strictly between 0 and 1
+    if not 0 < confidence < 1:
+        raise Exception(f"Error: centrality confidence must be between 0 and 1 exclusive, got {confidence}.")
+
+
+def pivot_count(num_nodes, epsilon, confidence=0.95):
+    """
+    Function pivot_count: The number of sampled sources after which every node's estimate is within epsilon of
+        its exact value with the given confidence, from Hoeffding's bound over all n nodes: ln( 2n / delta ) / 2e^2
+    :param num_nodes: @type int: the number of nodes in the graph
+    :param epsilon: @type float: the largest error of a normalised centrality
+    :param confidence: @type float: 1 - delta, the chance that no node is further off than epsilon
+    :return: @type int: the number of pivots
+    """
+    _check_confidence(confidence)
+    if epsilon <= 0:
+        raise Exception(f"Error: centrality epsilon must be above 0, got {epsilon}.")
+    return int(math.ceil(math.log(2 * num_nodes / (1 - confidence)) / (2 * epsilon ** 2)))
+
+
+def pivot_error(num_nodes, pivots, confidence=0.95):
+    """
+    Function pivot_error: The epsilon reached with the given number of pivots, the inverse of pivot_count()
+    """
+    _check_confidence(confidence)
+    return math.sqrt(math.log(2 * num_nodes / (1 - confidence)) / (2 * pivots))
+
+
+def approximate_centrality(adjacency, cent_type, pivots, confidence=0.95, batch_size=_BATCH_SIZE_):
+    """
+    Function approximate_centrality: Betweenness or closeness from a sample of source pivots, along with the bounds
+        the exact value lies within at the given confidence.
+        Betweenness adds up the dependencies of the pivots only and scales them by n / k.
+        Closeness estimates the mean distance of each node to all others by its mean distance to the pivots,
+        the error of that mean is at most epsilon times the diameter.
+    :param adjacency: @type scipy csr_matrix: the adjacency of a connected graph
+    :param cent_type: @type string - valid values: betweenness, closeness
+    :param pivots: @type int: the number of sources sampled, the exact centrality is used if this covers every node
+    :param confidence: @type float: the chance that the exact values are within the bounds
+    :param batch_size: @type int: the number of source nodes searched at a time
+    :return: @type tuple: ( centrality, lower, upper ) numpy arrays of each node
+    """
+    num_nodes = adjacency.shape[0]
+    if pivots >= num_nodes:
+        centrality = sparse_centrality(adjacency, cent_type)
+        return centrality, centrality, centrality
+
+    sampled = np.sort(np.random.default_rng(_PIVOT_SEED_).choice(num_nodes, pivots, replace=False))
+    epsilon = pivot_error(num_nodes, pivots, confidence)
+    if cent_type == 'betweenness':
+        centrality = betweenness_centrality(adjacency, batch_size, sampled)
+        error = epsilon * num_nodes / (num_nodes - 1)
+        return centrality, np.maximum(centrality - error, 0), centrality + error
+    elif cent_type == 'closeness':
+        distance = np.vstack([csgraph.shortest_path(adjacency, directed=False, unweighted=True, indices=sources)
+                              for sources in _source_batches(sampled, batch_size)])
+        diameter = min(2 * distance.max(axis=1).min(), num_nodes - 1)  # twice any eccentricity bounds the diameter
+        mean = distance.mean(axis=0)
+        # the total distance to all others is at least n - 1, every other node is at least one step away
+        total = np.maximum(mean * num_nodes, num_nodes - 1)
+        lowest_total = np.maximum((mean - epsilon * diameter) * num_nodes, num_nodes - 1)
+        highest_total = np.maximum((mean + epsilon * diameter) * num_nodes, num_nodes - 1)
+        return (num_nodes - 1) / total, (num_nodes - 1) / highest_total, (num_nodes - 1) / lowest_total
+    raise Exception("Error: Only betweenness and closeness centrality can be approximated.")
+
+
+def selection_stability(centrality_df, select):
+    """
+    Function selection_stability: The share of the top features that are sure to rank above every other feature,
+        their lower bound is above the highest upper bound of the features that were not selected
+    :param centrality_df: @type pandas DataFrame: sorted metric with lower and upper bound columns
+    :param select: @type int: the number of top features selected
+    :return: @type float: between 0 and 1, 1 when the selection is the same as with the exact centrality
+    """
+    top = centrality_df.index[:select]
+    rest = centrality_df.index[select:]
+    if len(top) == 0 or len(rest) == 0:
+        return 1.0
+    highest_rest = centrality_df.loc[rest, 'upper'].max()
+    return float(np.mean(centrality_df.loc[top, 'lower'].to_numpy() > highest_rest))
+
+
+def eigenvector_centrality(adjacency, start=None):
+    """
+    Function eigenvector_centrality: The eigenvector of the largest eigenvalue of the adjacency, positive and with
+        unit length as in networkx
+    :param adjacency: @type scipy csr_matrix: the adjacency of a connected graph
+    :param start: @type numpy array: a guess of the eigenvector to start from ( ex. the last iteration's ), can be None
+    :return: @type numpy array: the centrality of each node
+    """
+    num_nodes = adjacency.shape[0]
+    if num_nodes <= _DENSE_NODES_:
+        values, vectors = np.linalg.eigh(adjacency.toarray())
+        vector = vectors[:, -1]
+    else:
+        values, vectors = sparse_linalg.eigsh(adjacency.astype(np.float64), k=1, which='LA', v0=start)
+        vector = vectors[:, 0]
+    vector = vector / np.linalg.norm(vector)
+    return vector if vector.sum() >= 0 else -vector
+
+
+def sparse_centrality(adjacency, cent_type='betweenness', start=None):
+    """
+    Function sparse_centrality: The centrality of each node of a connected graph
+    :param adjacency: @type scipy csr_matrix: the adjacency of a connected graph
+    :param cent_type: @type string - valid values: betweenness, degree, closeness, eigenvector
+    :param start: @type numpy array: starting vector for eigenvector centrality, can be None
+    :return: @type numpy array: the centrality of each node
+    """
+    if cent_type == 'betweenness':
+        return betweenness_centrality(adjacency)
+    elif cent_type == 'degree':
+        return degree_centrality(adjacency)
+    elif cent_type == 'closeness':
+        return closeness_centrality(adjacency)
+    elif cent_type == 'eigenvector':
+        return eigenvector_centrality(adjacency, start)
+    raise Exception("Error: No centrality type given. Must be either: betweenness, degree, closeness, or eigenvector.")
@@ -0,0 +1,262 @@
+# Loading packages here
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import minepy  # pip install minepy
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+_BLOCK_SIZE_ = 2048  # number of columns multiplied at a time, keeps the intermediates small on large tables
+_KENDALL_BLOCK_SIZE_ = 512  # number of columns in one kendall job
+_PAIR_BLOCK_SIZE_ = 8192  # number of sample pairs turned into signs at a time
+_MIC_BLOCK_SIZE_ = 128  # number of features in one MIC tile, a tile holds at most 128 x 128 pairs
+
+
+def _standardise(values, dtype=np.float64):
+    """
+    Function _standardise: centre each column and scale it to unit length so that the correlation
+        of two columns is their dot product.
+    :param values: @type numpy array: samples x features
+    :param dtype: @type numpy dtype: the precision of the returned columns
+    :return: @type numpy array: the standardised columns, columns with no variance are NaN
+    """
+    centred = values - values.mean(axis=0)
+    norms = np.sqrt((centred * centred).sum(axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        standardised = centred / norms  # constant columns have no correlation, pandas gives NaN as well
+    standardised[:, norms == 0] = np.nan
+    return standardised.astype(dtype, copy=False)
+
+
+def rank_columns(values):
+    """
+    Function rank_columns: rank each column, ties are given the average rank as in pandas
+    :param values: @type numpy array: samples x features
+    :return: @type numpy array: the ranks of each column
+    """
+    return stats.rankdata(values, method='average', axis=0)
+
+
+def correlation_matrix(values, corr_type='spearman', dtype=np.float64, block_size=_BLOCK_SIZE_):
+    """
+    Function correlation_matrix: Correlation of all columns with one matrix product per block of columns.
+        Spearman ranks each column once and then goes through the same path as pearson.
+    :param values: @type numpy array: samples x features, may not contain NaN
+    :param corr_type: @type string: valid values: spearman, pearson
+    :param dtype: @type numpy dtype: float64 or float32, float32 halves the memory of the result
+    :param block_size: @type int: the number of columns multiplied at a time
+    :return: @type numpy array: features x features correlation matrix
+    """
+    if corr_type == 'spearman':
+        values = rank_columns(values)
+    elif corr_type != 'pearson':
+        raise Exception(f"Error: {corr_type} correlation is not supported by the numpy engine.")
+
+    standardised = _standardise(np.asarray(values, dtype=np.float64), dtype)
+    num_features = standardised.shape[1]
+    corr = np.empty((num_features, num_features), dtype=dtype)
+
+    # only the upper blocks are multiplied, the lower ones are their mirror
+    for start_i in range(0, num_features, block_size):
+        end_i = min(start_i + block_size, num_features)
+        for start_j in range(start_i, num_features, block_size):
+            end_j = min(start_j + block_size, num_features)
+            block = standardised[:, start_i:end_i].T @ standardised[:, start_j:end_j]
+            corr[start_i:end_i, start_j:end_j] = block
+            corr[start_j:end_j, start_i:end_i] = block.T
+
+    np.clip(corr, -1.0, 1.0, out=corr)
+    diagonal = np.diag_indices(num_features)
+    corr[diagonal] = np.where(np.isnan(corr[diagonal]), np.nan, 1.0)  # a column always fully agrees with itself
+    return corr
+
+
+def engine_correlation(df, corr_type='spearman', engine='numpy', block_size=_BLOCK_SIZE_):
+    """
+    Function engine_correlation: The correlation matrix of df as computed by the given engine
+    :param df: @type pandas dataframe: The conditioned data
+    :param corr_type: @type string: valid values: spearman, pearson
+    :param engine: @type string: valid values: numpy, numpy_float32
+    :param block_size: @type int: the number of columns multiplied at a time
+    :return: @type pandas dataframe: The untrimmed correlation matrix
+    """
+    values = df.to_numpy(dtype=np.float64)
+    if np.isnan(values).any():
+        # pandas correlates each pair over the samples both have, keep that behaviour for missing data
+        return df.corr(corr_type)
+
+    dtype = np.float32 if engine == 'numpy_float32' else np.float64
+    corr = correlation_matrix(values, corr_type, dtype=dtype, block_size=block_size)
+    return pd.DataFrame(corr, index=df.columns, columns=df.columns)
+
+
+def _upper_blocks(num_features, block_size):
+    """
+    Function _upper_blocks: The blocks of columns on and above the diagonal of a features x features matrix
+    :param num_features: @type int: the number of columns
+    :param block_size: @type int: the number of columns in a block
+    :return: @type list: ( start_i, start_j ) of every block
+    """
+    starts = range(0, num_features, block_size)
+    return [(start_i, start_j) for start_i in starts for start_j in starts if start_j >= start_i]
+
+
+def _compute_blocks(worker, columns, blocks, jobs=1, progress=None, cancel=None):
+    """
+    Function _compute_blocks: Runs worker on every block, either here or over a process pool.
+        Diagonal blocks hand the worker a single set of columns so it can skip the duplicate work.
+    :param worker: @type function: called as worker( columns_i, columns_j ), columns_j is None on the diagonal
+    :param columns: @type function: gives the columns of the block starting at the given column
+    :param blocks: @type list: ( start_i, start_j ) of every block, see _upper_blocks()
+    :param jobs: @type int: the number of processes, 1 runs everything in this process
+    :param progress: @type function: called as progress( done, total ) after each block, can be None
+    :param cancel: @type threading.Event: stops the computation once it is set, can be None
+    :return: @type generator: ( ( start_i, start_j ), result ) of every block as it is done
+    """
+    def arguments(start_i, start_j):
+        return columns(start_i), (None if start_i == start_j else columns(start_j))
+
+    def check_cancel():
+        if( cancel is not None and cancel.is_set() ):
+            raise Exception("Error: correlation computation was cancelled.")
+
+    total = len(blocks)
+    if( jobs > 1 and total > 1 ):
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(worker, *arguments(*block)): block for block in blocks}
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    check_cancel()
+                    yield futures[future], future.result()
+                    if( progress is not None ):
+                        progress(done, total)
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)  # drop the blocks that have not started
+                raise
+    else:
+        for done, block in enumerate(blocks, 1):
+            check_cancel()
+            yield block, worker(*arguments(*block))
+            if( progress is not None ):
+                progress(done, total)
+
+
+def _place_block(matrix, start_i, start_j, block):
+    """
+    Function _place_block: Writes an upper block and its mirror into the symmetric matrix
+    """
+    matrix[start_i:start_i + block.shape[0], start_j:start_j + block.shape[1]] = block
+    matrix[start_j:start_j + block.shape[1], start_i:start_i + block.shape[0]] = block.T
+
+
+def _kendall_block(ranks_i, ranks_j=None, pair_block_size=_PAIR_BLOCK_SIZE_):
+    """
+    Function _kendall_block: Concordant minus discordant pairs for every column of ranks_i against every column
+        of ranks_j. sign(x_a - x_b) * sign(y_a - y_b) is 1 for a concordant pair of samples, -1 for a discordant
+        pair and 0 for a tie, so summing it over all sample pairs is a matrix product of the sign columns.
+    :param ranks_i: @type numpy array: samples x features
+    :param ranks_j: @type numpy array: samples x features, None to pair ranks_i with itself
+    :param pair_block_size: @type int: the number of sample pairs turned into signs at a time
+    :return: @type numpy array: features_i x features_j concordant minus discordant counts
+    """
+    same = ranks_j is None
+    ranks_j = ranks_i if same else ranks_j
+    first, second = np.triu_indices(ranks_i.shape[0], 1)
+    counts = np.zeros((ranks_i.shape[1], ranks_j.shape[1]))
+    for start in range(0, first.size, pair_block_size):
+        pairs = slice(start, start + pair_block_size)
+        signs_i = np.sign(ranks_i[first[pairs]] - ranks_i[second[pairs]])
+        signs_j = signs_i if same else np.sign(ranks_j[first[pairs]] - ranks_j[second[pairs]])
+        counts += signs_i.T @ signs_j  # integer valued, exact in float64
+    return counts
+
+
+def kendall_matrix(values, block_size=_KENDALL_BLOCK_SIZE_, jobs=1, progress=None, cancel=None):
+    """
+    Function kendall_matrix: Kendall tau-b of all columns. Every column is ranked once, the untied pair count of each
+        column is the diagonal of the sign product, and blocks of columns are spread over a process pool.
+        Gives the same values as scipy.stats.kendalltau on each pair.
+    :param values: @type numpy array: samples x features, may not contain NaN
+    :param block_size: @type int: the number of columns in one job
+    :param jobs: @type int: the number of processes, 1 runs everything in this process
+    :param progress: @type function: called as progress( done, total ) after each block, can be None
+    :param cancel: @type threading.Event: stops the computation once it is set, can be None
+    :return: @type numpy array: features x features correlation matrix
+    """
+    ranks = rank_columns(values)
+    num_features = ranks.shape[1]
+
+    counts = np.empty((num_features, num_features))
+    for (start_i, start_j), block in _compute_blocks(_kendall_block, lambda start: ranks[:, start:start + block_size],
+                                                     _upper_blocks(num_features, block_size), jobs, progress, cancel):
+        _place_block(counts, start_i, start_j, block)
+
+    # the pairs a column does not tie with itself, scipy gives no correlation when there are none
+    untied = np.sqrt(np.diag(counts))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = counts / untied[:, None] / untied[None, :]
+    corr[untied == 0, :] = np.nan
+    corr[:, untied == 0] = np.nan
+    lower = np.tril_indices(num_features, -1)
+    corr[lower] = corr.T[lower]  # mirror the upper triangle so both halves are divided in the same order
+    np.clip(corr, -1.0, 1.0, out=corr)
+    np.fill_diagonal(corr, 1.0)  # pandas sets the diagonal to 1 for kendall, even for constant columns
+    return corr
+
+
+def kendall_correlation(df, jobs=1, block_size=_KENDALL_BLOCK_SIZE_, progress=None, cancel=None):
+    """
+    Function kendall_correlation: The kendall tau-b matrix of df, without going through the pairwise pandas loop
+    :param df: @type pandas dataframe: The conditioned data
+    :param jobs: @type int: the number of processes used for the column blocks
+    :param block_size: @type int: the number of columns in one job
+    :param progress: @type function: called as progress( done, total ) after each block, can be None
+    :param cancel: @type threading.Event: stops the computation once it is set, can be None
+    :return: @type pandas dataframe: The untrimmed correlation matrix
+    """
+    values = df.to_numpy(dtype=np.float64)
+    if np.isnan(values).any():
+        return df.corr('kendall')
+
+    corr = kendall_matrix(values, block_size=block_size, jobs=jobs, progress=progress, cancel=cancel)
+    return pd.DataFrame(corr, index=df.columns, columns=df.columns)
+
+
+def _mic_block(features_i, features_j=None):
+    """
+    Function _mic_block: MIC of every feature of features_i against every feature of features_j
+    :param features_i: @type numpy array: features x samples
+    :param features_j: @type numpy array: features x samples, None to pair features_i with itself
+    :return: @type numpy array: features_i x features_j MIC values, the diagonal of a tile with itself is 0
+    """
+    if( features_j is None ):
+        # the pstats output is a condensed 1D array of the upper triangle
+        micp, ticp = minepy.pstats(features_i, alpha=0.6, c=15, est="mic_approx")
+        num_features = features_i.shape[0]
+        tri = np.zeros((num_features, num_features))
+        tri[np.triu_indices(num_features, 1)] = micp
+        return tri + tri.T
+    mic, tic = minepy.cstats(features_i, features_j, alpha=0.6, c=15, est="mic_approx")
+    return mic
+
+
+def mic_correlation(df, jobs=1, block_size=_MIC_BLOCK_SIZE_, progress=None, cancel=None):
+    """
+    Function mic_correlation: The MIC matrix of df built from tiles of feature pairs, each tile is written
+        straight into the symmetric matrix so the condensed vector of every pair is never held at once
+    :param df: @type pandas dataframe: The conditioned data
+    :param jobs: @type int: the number of processes used for the tiles
+    :param block_size: @type int: the number of features on each side of a tile
+    :param progress: @type function: called as progress( done, total ) after each tile, can be None
+    :param cancel: @type threading.Event: stops the computation once it is set, can be None
+    :return: @type pandas dataframe: The untrimmed correlation matrix
+    """
+    features = np.ascontiguousarray(df.to_numpy(dtype=np.float64).T)
+    num_features = features.shape[0]
+
+    full_corr = np.empty((num_features, num_features))
+    for (start_i, start_j), block in _compute_blocks(_mic_block, lambda start: features[start:start + block_size],
+                                                     _upper_blocks(num_features, block_size), jobs, progress, cancel):
+        _place_block(full_corr, start_i, start_j, block)
+
+    return pd.DataFrame(full_corr, index=df.columns.values, columns=df.columns.values)
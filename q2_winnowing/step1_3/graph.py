@@ -0,0 +1,188 @@
+# Loading packages here
+import numpy as np
+import pandas as pd
+import networkx
+import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
+
+from q2_winnowing.step1_3.centrality import node_order
+
+
+def threshold_edges(w_corr_df, keep_thresh=0.5, corr_dir='none', keep_zero=True):
+    """
+    Function threshold_edges: Finds the pairs of features that are strongly enough correlated to share an edge,
+        straight from the correlation matrix. Only the upper triangle is searched since the matrix is symmetric.
+    :param w_corr_df: @type pandas dataframe: The trimmed correlation matrix
+    :param keep_thresh: @type float: edges are kept for pairs with a distance below 1 - keep_thresh
+    :param corr_dir: @type string: valid values: none, positive, negative
+    :param keep_zero: @type boolean: True to keep pairs with a distance of 0 ( ex. a feature with itself )
+    :return: @type tuple: ( first, second, distance ) positions of each pair with first <= second in row order,
+        and the 1 - |r| distance of the pair
+    """
+    corr = w_corr_df.to_numpy()
+    if corr_dir == 'positive':
+        distance = 1 - corr  # only keep strong positive correlations (small positive numbers)
+    elif corr_dir == 'negative':
+        distance = 1 + corr  # only keep strong negative correlations (small negative numbers)
+    else:
+        distance = 1 - np.abs(corr)  # keep both strong positive and negative correlations
+    distance[distance >= 1 - keep_thresh] = 1  # anything past the threshold is set to 1 so it can be removed
+    distance = np.abs(distance)
+
+    keep = np.triu(distance <= 1 - keep_thresh)
+    if keep_zero:
+        keep &= distance >= 0.0
+    else:
+        keep &= distance > 0.0
+    first, second = np.nonzero(keep)  # row major, the order pd.melt gave the edges in
+    return first, second, distance[first, second]
+
+
+def edge_adjacency(num_nodes, first, second, distance):
+    """
+    Function edge_adjacency: The symmetric sparse adjacency matrix of the edges from threshold_edges()
+    :param num_nodes: @type int: the number of features in the correlation matrix
+    :param first: @type numpy array: position of one end of each edge
+    :param second: @type numpy array: position of the other end of each edge
+    :param distance: @type numpy array: the weight of each edge
+    :return: @type scipy csr_matrix: num_nodes x num_nodes, both directions of every edge are stored
+    """
+    off_diagonal = first != second
+    rows = np.concatenate((first, second[off_diagonal]))
+    columns = np.concatenate((second, first[off_diagonal]))
+    weights = np.concatenate((distance, distance[off_diagonal]))
+    return sparse.csr_matrix((weights, (rows, columns)), shape=(num_nodes, num_nodes))
+
+
+def edge_graph(labels, first, second, distance, attr='edge'):
+    """
+    Function edge_graph: Builds the networkx graph of the edges from threshold_edges(). Edges are added in the same
+        order networkx.from_pandas_edgelist() added them from the melted matrix, so nodes keep the same order.
+    :param labels: @type list: the feature names of the correlation matrix
+    :param first: @type numpy array: position of one end of each edge
+    :param second: @type numpy array: position of the other end of each edge
+    :param distance: @type numpy array: the weight of each edge
+    :param attr: @type string: name of the edge attribute holding the weight ( edge or weight )
+    :return: @type networkx Graph
+    """
+    labels = np.asarray(labels, dtype=object)
+    graph = networkx.Graph()
+    graph.add_edges_from(zip(labels[second], labels[first], ({attr: weight} for weight in distance.tolist())))
+    return graph
+
+
+class GraphState:
+    """
+    Class GraphState: The thresholded graph kept between iterations of selection(). selection() removes the features
+        it picked, which drops their edges, the nodes left without edges and splits only the components they were in.
+        The state is only reused while the correlations of the remaining features are a slice of the ones it was
+        built from, it is rebuilt whenever the CorrelationCache has to compute the matrix again.
+    """
+
+    def __init__(self):
+        self.version = None  # CorrelationCache.computed when the edges were found
+        self.labels = None
+        self.eigenvector = {}  # last eigenvector centrality of each feature, used as the next starting vector
+        self._first = None
+        self._second = None
+        self._distance = None
+        self._alive = None
+        self._incidence = None
+        self._component = None
+        self._next_label = 0
+
+    def reset(self, labels, first, second, distance, version):
+        """
+        Function reset: Build the state from the edges of threshold_edges()
+        :param labels: @type list: the feature names of the correlation matrix
+        :param first: @type numpy array: position of one end of each edge
+        :param second: @type numpy array: position of the other end of each edge
+        :param distance: @type numpy array: the weight of each edge
+        :param version: @type int: CorrelationCache.computed of the matrix the edges came from
+        """
+        self.version = version
+        self.labels = pd.Index(labels)
+        self.eigenvector = {}
+        self._first, self._second, self._distance = first, second, distance
+        self._alive = np.ones(len(first), dtype=bool)
+        num_positions = len(self.labels)
+        # a self loop counts on both ends, so only nodes without any edge have no incidence
+        self._incidence = np.bincount(first, minlength=num_positions) + np.bincount(second, minlength=num_positions)
+        self._component = np.full(num_positions, -1)
+        self._next_label = 0
+        self._label_components(np.flatnonzero(self._incidence > 0))
+
+    def is_current(self, corr_cache, df):
+        """
+        Function is_current: True if the state is the graph of df, the correlations were not rebuilt since it was made
+            and nothing besides the removed features has left df
+        :param corr_cache: @type CorrelationCache: the cache graph_centrality() correlates df with
+        :param df: @type pandas dataframe: The unconditioned data left in this iteration
+        """
+        if self.version is None or self.version != corr_cache.computed or not corr_cache.can_slice(df):
+            return False
+        nodes = self.labels[self._incidence > 0]
+        return bool(nodes.isin(df.columns).all())
+
+    def remove(self, features):
+        """
+        Function remove: Delete the features and their edges, then split the components they were in
+        :param features: @type list: the feature names picked by selection()
+        """
+        if self.version is None:
+            return
+        positions = self.labels.get_indexer(features)
+        positions = positions[positions >= 0]
+        if len(positions) == 0:
+            return
+
+        affected = np.unique(self._component[positions])
+        affected = affected[affected >= 0]
+        dropped = self._alive & (np.isin(self._first, positions) | np.isin(self._second, positions))
+        self._alive &= ~dropped
+        num_positions = len(self.labels)
+        self._incidence -= np.bincount(self._first[dropped], minlength=num_positions) + \
+            np.bincount(self._second[dropped], minlength=num_positions)
+
+        in_affected = np.isin(self._component, affected)
+        self._component[in_affected] = -1
+        self._label_components(np.flatnonzero(in_affected & (self._incidence > 0)))
+
+    def _label_components(self, nodes):
+        """
+        Function _label_components: Give the connected components among nodes new labels, the edges of these nodes
+            never reach outside them
+        """
+        if len(nodes) == 0:
+            return
+        local = np.full(len(self.labels), -1)
+        local[nodes] = np.arange(len(nodes))
+        edges = self._alive & (local[self._first] >= 0)
+        adjacency = sparse.csr_matrix((np.ones(np.count_nonzero(edges)),
+                                       (local[self._first[edges]], local[self._second[edges]])),
+                                      shape=(len(nodes), len(nodes)))
+        num_components, labels = csgraph.connected_components(adjacency, directed=False)
+        self._component[nodes] = labels + self._next_label
+        self._next_label += num_components
+
+    def largest_component(self):
+        """
+        Function largest_component: The edges of the largest connected component, the first one in networkx node
+            order on ties as with max() over networkx.connected_components()
+        :return: @type tuple: (total_nodes, labels, first, second, distance) the number of nodes in the graph,
+            the component's features in networkx order, and its edges as positions in labels in edge order
+        """
+        first, second = self._first[self._alive], self._second[self._alive]
+        nodes = node_order(first, second)
+        if len(nodes) == 0:
+            return 0, pd.Index([]), first, second, self._distance[self._alive]
+
+        components, first_seen, sizes = np.unique(self._component[nodes], return_index=True, return_counts=True)
+        largest = components[np.lexsort((first_seen, -sizes))[0]]
+        in_largest = self._component[nodes] == largest
+        order = np.full(len(self.labels), -1)
+        order[nodes[in_largest]] = np.arange(np.count_nonzero(in_largest))
+
+        edges = self._component[first] == largest
+        return (len(nodes), self.labels[nodes[in_largest]], order[first[edges]], order[second[edges]],
+                self._distance[self._alive][edges])
@@ -6,7 +6,9 @@ import numpy as np
 import pandas as pd  # Use this for working with dataframes
 import os
 import networkx
+import scipy.sparse
 import scipy.stats as stats
+from scipy.sparse.linalg import ArpackNoConvergence
 # import scipy.spatial.distance as distance # conda install scipy
 # from skbio.diversity import beta_diversity # for bray curtis conditioning
 from sklearn.decomposition import PCA  # Use for PCA
@@ -14,15 +16,20 @@ import matplotlib.pyplot as plt  # Use this for plotting
 # from skbio.stats.distance import anosim
 import math
 import csv
-import minepy  # pip install minepy
 import time
 import seaborn as sb
 
+from q2_winnowing.step1_3.correlation import engine_correlation, kendall_correlation, mic_correlation
+from q2_winnowing.step1_3.graph import GraphState, edge_adjacency, edge_graph, threshold_edges
+from q2_winnowing.step1_3.centrality import approximate_centrality, edge_structure, largest_component, pivot_count, \
+    selection_stability, sparse_centrality
+
 global min_count
 global window_size
 global outdir
 global disjoint
 global connectedness
+global rank_stability
 
 global detailed_
 
@@ -220,25 +227,43 @@ def abundance(df):
     return sorted_abundances
 
 
-def find_correlation(df, corr_type='spearman'):
+def find_correlation(df, corr_type='spearman', engine='pandas', jobs=1):
+    return _trim_correlation(_correlation_matrix(df, corr_type, engine, jobs))
+
+
+def _correlation_matrix(df, corr_type='spearman', engine='pandas', jobs=1):
+    """
+    Function _correlation_matrix: Builds the full correlation matrix of the columns of df before any
+        zero rows and columns are trimmed away. Each value only depends on the two columns it pairs, so a
+        slice of this matrix is the correlation of the sliced columns.
+    :param df: @type pandas dataframe: The conditioned data
+    :param corr_type: @type string: valid values: spearman, kendall, pearson, MIC
+    :param engine: @type string: valid values: pandas, numpy, numpy_float32 ( numpy engines cover spearman and pearson )
+    :param jobs: @type int: number of processes used for kendall and MIC
+    :return: @type pandas dataframe: The untrimmed correlation matrix
+    """
     df_r = 0
     data = df.copy()
     if corr_type == 'MIC':
-        # the pstats output for the mic and tic are condensed 1D arrays
-        # we need to turn the output into a 2D upper triangular matrix and then mirror it to get the
-        # full correlation matrix
-        micp, ticp = minepy.pstats(data.T, alpha=0.6, c=15, est="mic_approx")
-        num_features = data.shape[1]
-        tri = np.zeros((num_features, num_features))
-        tri[np.triu_indices(num_features, 1)] = micp
-        full_corr = tri + tri.T
-
-        df_r = pd.DataFrame(full_corr)
-        df_r.columns = data.columns.values
-        df_r.index = data.columns.values
+        # tiles of feature pairs are spread over the jobs and assembled into the symmetric matrix
+        df_r = mic_correlation(data, jobs)
+    elif corr_type == 'kendall':
+        # pandas loops over every pair in python, the block engine gives the same values
+        df_r = kendall_correlation(data, jobs)
+    elif engine != 'pandas' and corr_type in ['spearman', 'pearson']:
+        df_r = engine_correlation(data, corr_type, engine)
     else:
         df_r = data.corr(corr_type)
 
+    return df_r
+
+
+def _trim_correlation(df_r):
+    """
+    Function _trim_correlation: Replace missing correlations with 0 and remove the features with no correlation
+    :param df_r: @type pandas dataframe: The untrimmed correlation matrix
+    :return: @type pandas dataframe: The trimmed correlation matrix
+    """
     if isinstance(df_r, pd.DataFrame):
         df_r.fillna(0, inplace=True)  # ugly hack to make the NAs go away, should work for sampling but not advisable
         df_r = df_r[(df_r != 0).any(axis=1)]
@@ -246,11 +271,74 @@ def find_correlation(df, corr_type='spearman'):
     return df_r
 
 
+class CorrelationCache:
+    """
+    Class CorrelationCache: Holds the correlation matrix of the data handed to the first iteration of selection()
+        so each following iteration only slices out the columns that are left instead of rebuilding it.
+        add_one conditions each column on its own so the slice is exact. Hellinger divides by the row sums
+        of the remaining columns, so the cache is recomputed for it every time columns are removed.
+    """
+
+    _ROW_CONDITIONING_ = ["hellinger", "bray_curtis"]  # conditioning types that depend on the other columns
+
+    def __init__(self, cond_type='add_one', corr_type='spearman', engine='pandas', jobs=1):
+        """
+        :param cond_type: @type string - valid values: add_one, hellinger, bray_curtis
+        :param corr_type: @type string - valid values: spearman, kendall, pearson, MIC
+        :param engine: @type string - valid values: pandas, numpy, numpy_float32
+        :param jobs: @type int - number of processes used to build the matrix
+        """
+        self.cond_type = cond_type
+        self.corr_type = corr_type
+        self.engine = engine
+        self.jobs = jobs
+        self.computed = 0  # number of times the full matrix was built, useful for checking the cache is used
+        self._columns = None
+        self._rows = None
+        self._matrix = None
+
+    def _can_slice(self, df, rows):
+        if( self._matrix is None or self.cond_type in self._ROW_CONDITIONING_ ):
+            return False
+        # condition() drops samples that are all zero, if that changes the conditioned columns change with it
+        if( not rows.equals( self._rows ) ):
+            return False
+        return bool( self._columns.get_indexer( df.columns ).min( initial=0 ) >= 0 )
+
+    def can_slice(self, df):
+        """
+        Function can_slice: True if correlation( df ) would slice the cached matrix instead of building a new one
+        :param df: @type pandas dataframe: The unconditioned data left in this iteration
+        """
+        return self._can_slice( df, (df != 0).any(axis=1) )
+
+    def correlation(self, df):
+        """
+        Function correlation: The trimmed correlation matrix of df, the same as find_correlation(condition(df))
+        :param df: @type pandas dataframe: The unconditioned data left in this iteration
+        :return: @type pandas dataframe: The trimmed correlation matrix
+        """
+        rows = (df != 0).any(axis=1)
+        if( self._can_slice( df, rows ) ):
+            positions = self._columns.get_indexer( df.columns )
+            df_r = pd.DataFrame( self._matrix[np.ix_(positions, positions)], index=df.columns, columns=df.columns )
+        else:
+            df_r = _correlation_matrix( condition(df, self.cond_type), self.corr_type, self.engine, self.jobs )
+            self._columns = df_r.columns
+            self._rows = rows
+            self._matrix = df_r.to_numpy()
+            self._matrix.flags.writeable = False  # slices are copied out, the cache itself is never changed
+            self.computed += 1
+            df_r = df_r.copy()
+        return _trim_correlation( df_r )
+
+
 # this function returns the sorted centrality for a given centrality
 # given a dataframe organized as an adjacency matrix, build a graph and compute the centrality
 # return sorted centrality and the graph in networkx format
 def graph_centrality(df, cent_type='betweenness', keep_thresh=0.5, cond_type='add_one', corr_type='spearman',
-                     weighted=False, corr_dir='none', min_connected=0):
+                     weighted=False, corr_dir='none', min_connected=0, corr_cache=None, cent_engine='networkx',
+                     cent_pivots=0, cent_epsilon=0.0, cent_confidence=0.95, graph_state=None):
     """
     :param df: @type pandas DataFrame
     :param cent_type: @type string - valid values: betweenness, degree, closeness, eigenvector
@@ -259,36 +347,43 @@ def graph_centrality(df, cent_type='betweenness', keep_thresh=0.5, cond_type='ad
     :param corr_type: @type: string - valid values: spearman, kendall, pearson, MIC
     :param weighted: @type: boolean - True if you want to produce a graph with weighted edges, False otherwise
     :param corr_dir: @type: string - valid values: none, positive, negative
+    :param corr_cache: @type: CorrelationCache - reused between iterations of selection(), built here if not given
+    :param cent_engine: @type: string - valid values: networkx, sparse ( scipy.sparse and csgraph )
+    :param cent_pivots: @type: int - sample this many sources for betweenness and closeness, 0 for exact centrality
+    :param cent_epsilon: @type: float - if cent_pivots is 0, sample enough sources to be within this of the exact value
+    :param cent_confidence: @type: float - the chance that the sampled centrality is within the error bound
+    :param graph_state: @type: GraphState - the graph left by the last iteration of selection(), None to rebuild it
     :return:
     """
 
     print('In Graph Centrality Function')
 
     data = df.copy()
-    conditioned_df = condition(data, cond_type)  # condition data
-    w_corr_df = find_correlation(conditioned_df, corr_type)
-    if corr_dir == 'positive':
-        w_corr_df_b = 1 - w_corr_df.copy()  # only keep strong positive correlations (small positive numbers)
-    elif corr_dir == 'negative':
-        w_corr_df_b = 1 + w_corr_df.copy()  # only keep strong negative correlations (small negative numbers)
-    else:
-        w_corr_df_b = 1 - abs(w_corr_df.copy())  # keep both strong positive and negative correlations
-    w_corr_df_b[
-        (w_corr_df_b >= 1 - keep_thresh)] = 1  # set anything greater than the threshold value to 1 so we can remove it.
-    labels = list(w_corr_df_b.index)
-    temp = abs(w_corr_df_b.copy())
-    temp.insert(0, 'var1', labels)
+    if corr_cache is None:
+        corr_cache = CorrelationCache(cond_type, corr_type)
 
     if weighted == True:
         attr = 'weight'
     else:
         attr = 'edge'
 
-    df_b = pd.melt(temp, 'var1', var_name='var2', value_name=attr)
+    if graph_state is not None and graph_state.is_current(corr_cache, data):
+        # only the selected features left since the last iteration, their nodes are already gone from the graph
+        return _incremental_graph_centrality(graph_state, cent_type, min_connected, cent_engine, attr,
+                                             cent_pivots, cent_epsilon, cent_confidence)
 
-    df_b = df_b.loc[((df_b[attr] <= 1 - keep_thresh) & (df_b[attr] >= 0.0)),
-           :]  # take only those edge pairs that are at or above the threshold
-    df_g = networkx.from_pandas_edgelist(df_b, 'var1', 'var2', attr)  # takes a list of valid edges
+    w_corr_df = corr_cache.correlation(data)  # condition data and correlate
+
+    # take only those edge pairs that are at or above the threshold
+    first, second, distance = threshold_edges(w_corr_df, keep_thresh, corr_dir)
+    if graph_state is not None:
+        graph_state.reset(w_corr_df.index, first, second, distance, corr_cache.computed)
+        return _incremental_graph_centrality(graph_state, cent_type, min_connected, cent_engine, attr,
+                                             cent_pivots, cent_epsilon, cent_confidence)
+    if cent_engine == 'sparse':
+        return _sparse_graph_centrality(w_corr_df.index, first, second, cent_type, min_connected,
+                                        cent_pivots, cent_epsilon, cent_confidence)
+    df_g = edge_graph(w_corr_df.index, first, second, distance, attr)
 
     # create a graphml file
     # graph_filename = "graph-{}.graphml".format(process_id)
@@ -317,23 +412,15 @@ def graph_centrality(df, cent_type='betweenness', keep_thresh=0.5, cond_type='ad
     except ValueError:
         largest_subgraph = networkx.empty_graph()
     nodes_sg = networkx.number_of_nodes(largest_subgraph)
-    print(f"total, {total_nodes}, largest, {nodes_sg}")
-
-    if( nodes_sg <= 0 ):
-        percent_connected = 0
-    else:
-        percent_connected = nodes_sg/total_nodes*100
-
-    print(f"percent connected, {percent_connected}")
-    global connectedness
-    connectedness.append((nodes_sg, total_nodes, float(str(round(percent_connected, 2)))))
-    print(f"connectedness, {connectedness}")
-
-    if percent_connected == 0 or percent_connected < float(min_connected):
-        print('graph under min connectedness... returning')
+    if not _check_connected(nodes_sg, total_nodes, min_connected):
         disjoint = True
         return pd.DataFrame()
     else:
+        pivots = _num_pivots(nodes_sg, cent_type, cent_pivots, cent_epsilon, cent_confidence)
+        if pivots is not None:
+            adjacency = scipy.sparse.csr_matrix(networkx.to_scipy_sparse_array(largest_subgraph, weight=None))
+            return _approximate_centrality_df(adjacency, list(largest_subgraph), cent_type, pivots, cent_confidence)
+
         if cent_type == 'betweenness':
             centrality = networkx.betweenness_centrality(largest_subgraph)
         elif cent_type == 'degree':
@@ -350,14 +437,7 @@ def graph_centrality(df, cent_type='betweenness', keep_thresh=0.5, cond_type='ad
         else:
             raise Exception("Error: No centrality type given. Must be either: betweenness, degree, closeness, or eigenvector.")
 
-        centrality_df = pd.DataFrame.from_dict(centrality, orient='index')
-        centrality_df.columns = ['metric']
-
-        if not centrality_df.empty:
-            centrality_df = centrality_df[centrality_df.iloc[:, 0] > 0]
-
-        if not centrality_df.empty:
-            centrality_df.sort_values('metric', axis=0, ascending=False, inplace=True)
+        centrality_df = _centrality_frame(list(centrality.values()), list(centrality))
 
         '''fig = plt.figure()
         plt.hist(centrality_df, bins=20)
@@ -371,15 +451,178 @@ def graph_centrality(df, cent_type='betweenness', keep_thresh=0.5, cond_type='ad
     return centrality_df
 
 
-def selection(func, s_total, s_per_iter, df, *args):
+def _check_connected(nodes_sg, total_nodes, min_connected):
+    """
+    Function _check_connected: Record how connected the graph is and check it against min_connected
+    :param nodes_sg: @type int: the number of nodes in the largest component
+    :param total_nodes: @type int: the number of nodes in the graph
+    :param min_connected: @type float - the minimum percent of nodes in the largest component
+    :return: @type boolean: True if the largest component is connected enough to find the centrality of
+    """
+    print(f"total, {total_nodes}, largest, {nodes_sg}")
+
+    if( nodes_sg <= 0 ):
+        percent_connected = 0
+    else:
+        percent_connected = nodes_sg/total_nodes*100
+
+    print(f"percent connected, {percent_connected}")
+    global connectedness
+    connectedness.append((nodes_sg, total_nodes, float(str(round(percent_connected, 2)))))
+    print(f"connectedness, {connectedness}")
+
+    if percent_connected == 0 or percent_connected < float(min_connected):
+        print('graph under min connectedness... returning')
+        return False
+    return True
+
+
+def _centrality_frame(centrality, labels, **bounds):
+    """
+    Function _centrality_frame: The centrality of each feature sorted from highest, features without any are left out
+    :param centrality: @type list: the centrality of each node
+    :param labels: @type list: the feature name of each node
+    :param bounds: @type dict: other columns to keep with the centrality ( ex. lower and upper bounds )
+    :return: @type pandas DataFrame: the sorted centrality in the metric column
+    """
+    centrality_df = pd.DataFrame(dict(metric=centrality, **bounds), index=np.asarray(labels, dtype=object))
+    centrality_df = centrality_df[centrality_df.iloc[:, 0] > 0]
+    if not centrality_df.empty:
+        centrality_df.sort_values('metric', axis=0, ascending=False, inplace=True)
+    return centrality_df
+
+
+def _num_pivots(num_nodes, cent_type, cent_pivots, cent_epsilon, cent_confidence):
+    """
+    Function _num_pivots: The number of sources to sample for the centrality, None when it should be exact
+    """
+    if cent_epsilon < 0:
+        raise Exception(f"Error: centrality epsilon can not be negative, got {cent_epsilon}.")
+    if cent_pivots < 0:
+        raise Exception(f"Error: centrality pivots can not be negative, got {cent_pivots}.")
+    if cent_type not in ['betweenness', 'closeness']:
+        return None
+    if cent_pivots > 0:
+        return cent_pivots
+    if cent_epsilon > 0:
+        return pivot_count(num_nodes, cent_epsilon, cent_confidence)
+    return None
+
+
+def _approximate_centrality_df(adjacency, labels, cent_type, pivots, cent_confidence):
+    """
+    Function _approximate_centrality_df: The sorted centrality from sampled sources, the bounds of each feature are
+        kept in the lower and upper columns so selection() can tell how sure the chosen features are
+    :param adjacency: @type scipy csr_matrix: the adjacency of the largest component
+    :param labels: @type list: the feature name of each node
+    :param cent_type: @type string - valid values: betweenness, closeness
+    :param pivots: @type int: the number of sources sampled
+    :param cent_confidence: @type float: the chance that the exact values are within the bounds
+    :return: @type pandas DataFrame: the sorted centrality
+    """
+    centrality, lower, upper = approximate_centrality(adjacency, cent_type, pivots, cent_confidence)
+    return _centrality_frame(centrality, labels, lower=lower, upper=upper)
+
+
+def _incremental_graph_centrality(graph_state, cent_type, min_connected, cent_engine, attr,
+                                  cent_pivots=0, cent_epsilon=0.0, cent_confidence=0.95):
+    """
+    Function _incremental_graph_centrality: graph_centrality() on the largest component kept by the GraphState,
+        eigenvector centrality starts from the vector of the last iteration
+    :param graph_state: @type GraphState: the graph of the features left in this iteration
+    :param cent_type: @type string - valid values: betweenness, degree, closeness, eigenvector
+    :param min_connected: @type float - the minimum percent of nodes in the largest component
+    :param cent_engine: @type string - valid values: networkx, sparse
+    :param attr: @type string - name of the edge attribute for networkx ( edge or weight )
+    :param cent_pivots: @type int - see graph_centrality()
+    :param cent_epsilon: @type float - see graph_centrality()
+    :param cent_confidence: @type float - see graph_centrality()
+    :return: @type pandas DataFrame: the sorted centrality of the largest component
+    """
+    total_nodes, labels, first, second, distance = graph_state.largest_component()
+    nodes_sg = len(labels)
+    if not _check_connected(nodes_sg, total_nodes, min_connected):
+        return pd.DataFrame()
+
+    pivots = _num_pivots(nodes_sg, cent_type, cent_pivots, cent_epsilon, cent_confidence)
+    if pivots is not None:
+        return _approximate_centrality_df(edge_structure(first, second)[1], labels, cent_type, pivots, cent_confidence)
+
+    start = np.array([graph_state.eigenvector.get(label, 0.0) for label in labels])
+    start = start if cent_type == 'eigenvector' and start.any() else None
+    try:
+        if cent_engine == 'sparse':
+            centrality = sparse_centrality(edge_structure(first, second)[1], cent_type, start)
+        else:
+            largest_subgraph = edge_graph(labels, first, second, distance, attr)
+            if cent_type == 'betweenness':
+                centrality = networkx.betweenness_centrality(largest_subgraph)
+            elif cent_type == 'degree':
+                centrality = networkx.degree_centrality(largest_subgraph)
+            elif cent_type == 'closeness':
+                centrality = networkx.closeness_centrality(largest_subgraph)
+            elif cent_type == 'eigenvector':
+                nstart = None if start is None else dict(zip(labels, start))
+                centrality = networkx.eigenvector_centrality(largest_subgraph, nstart=nstart)
+            else:
+                raise Exception("Error: No centrality type given. Must be either: betweenness, degree, closeness, or eigenvector.")
+            centrality = [centrality[label] for label in labels]
+    except (ArpackNoConvergence, networkx.PowerIterationFailedConvergence):
+        print('eigenvector failed to converge... returning')
+        return pd.DataFrame()
+
+    if cent_type == 'eigenvector':
+        graph_state.eigenvector = dict(zip(labels, centrality))
+
+    return _centrality_frame(centrality, labels)
+
+
+def _sparse_graph_centrality(labels, first, second, cent_type, min_connected,
+                             cent_pivots=0, cent_epsilon=0.0, cent_confidence=0.95):
+    """
+    Function _sparse_graph_centrality: graph_centrality() on the scipy.sparse adjacency instead of a networkx graph
+    :param labels: @type list: the feature names of the correlation matrix
+    :param first: @type numpy array: position of one end of each edge, see threshold_edges()
+    :param second: @type numpy array: position of the other end of each edge
+    :param cent_type: @type string - valid values: betweenness, degree, closeness, eigenvector
+    :param min_connected: @type float - the minimum percent of nodes in the largest component
+    :param cent_pivots: @type int - see graph_centrality()
+    :param cent_epsilon: @type float - see graph_centrality()
+    :param cent_confidence: @type float - see graph_centrality()
+    :return: @type pandas DataFrame: the sorted centrality of the largest component
+    """
+    nodes, adjacency = edge_structure(first, second)
+    component = largest_component(adjacency)
+    total_nodes = len(nodes)
+    nodes_sg = len(component)
+    if not _check_connected(nodes_sg, total_nodes, min_connected):
+        return pd.DataFrame()
+
+    pivots = _num_pivots(nodes_sg, cent_type, cent_pivots, cent_epsilon, cent_confidence)
+    if pivots is not None:
+        return _approximate_centrality_df(adjacency[component][:, component],
+                                          np.asarray(labels, dtype=object)[nodes[component]], cent_type, pivots,
+                                          cent_confidence)
+
+    try:
+        centrality = sparse_centrality(adjacency[component][:, component], cent_type)
+    except ArpackNoConvergence:
+        print('eigenvector failed to converge... returning')
+        return pd.DataFrame()
+
+    return _centrality_frame(centrality, np.asarray(labels, dtype=object)[nodes[component]])
+
+
+def selection(func, s_total, s_per_iter, df, *args, **kwargs):
     """
     Function selection: does N loops of the metric before going to the evaluation step
     :param type: are we selecting features to remove or to retain
     :param N: the number of features for selection
+    :param kwargs: passed on to the metric each iteration ( ex. the corr_cache of graph_centrality )
     :return: not sure yet
     """
 
-    data = df.copy()
+    data = df  # the input can be shared between runs, drop() below always makes a new frame
     feature_list = []
     selected_df = pd.DataFrame()
     # the metric (func) returns a dataframe of the most important features
@@ -408,13 +651,21 @@ def selection(func, s_total, s_per_iter, df, *args):
     select = select_per_iter
     for i in range(0, math.ceil(select_total / select_per_iter)):
         # call the metric with the current data
-        sorted_df = func(data, *args)
+        sorted_df = func(data, *args, **kwargs)
 
         if not sorted_df.empty:
             if ((i + 1) * select_per_iter > select_total):
                 select = select_total % selected
             # take the top n features returned by the metric
             top_features = sorted_df.iloc[:select].index.values
+            if 'lower' in sorted_df.columns:
+                # the metric was estimated, note how many of the chosen features are sure to be in the top
+                global rank_stability
+                rank_stability.append(round(selection_stability(sorted_df, select), 4))
+                print(f"rank stability, {rank_stability}")
+                sorted_df = sorted_df[['metric']]
+            if kwargs.get('graph_state') is not None:
+                kwargs['graph_state'].remove(top_features)  # the graph of the next iteration is this one without them
 
             selected_df = selected_df.append(sorted_df.iloc[:select])
             selected += select
@@ -433,7 +684,7 @@ def selection(func, s_total, s_per_iter, df, *args):
             # add to the list of features selected
             feature_list.extend(top_features)
             #remove the top features from the data frame
-            data.drop(top_features.tolist(), axis=1, inplace=True)
+            data = data.drop(top_features.tolist(), axis=1)
         else:
             return selected_df
 
@@ -582,45 +833,28 @@ def plot_graph_centrality(features, cond_type, corr_type, corr_dir, keep_thresh,
     conditioned_df = condition(data, cond_type)  # condition data
     w_corr_df = find_correlation(conditioned_df, corr_type)
 
-    if corr_dir == 'positive':
-        w_corr_df_b = 1 - w_corr_df.copy()  # only keep strong positive correlations (small positive numbers)
-    elif corr_dir == 'negative':
-        w_corr_df_b = 1 + w_corr_df.copy()  # only keep strong negative correlations (small negative numbers)
-    else:
-        w_corr_df_b = 1 - abs(w_corr_df.copy())  # keep both strong positive and negative correlations
-    w_corr_df_b[
-        (w_corr_df_b >= 1 - keep_thresh)] = 1  # set anything greater than the threshold value to 1 so we can remove it.
-
-    labels = list(w_corr_df_b.index)
-    temp = abs(w_corr_df_b.copy())
-    temp.insert(0, 'var1', labels)
-
     if weighted == True:
         attr = 'weight'
     else:
         attr = 'edge'
 
-    df_b = pd.melt(temp, 'var1', var_name='var2', value_name=attr)
-    df_b = df_b.loc[((df_b[attr] <= 1 - keep_thresh) & (df_b[attr] > 0.0)),
-           :]  # take only those edge pairs that made the cut
-    df_g = networkx.from_pandas_edgelist(df_b, 'var1', 'var2', attr)  # takes a list of valid edges
+    # take only those edge pairs that made the cut
+    first, second, distance = threshold_edges(w_corr_df, keep_thresh, corr_dir, keep_zero=False)
+    df_g = edge_graph(w_corr_df.index, first, second, distance, attr)
     networkx.write_graphml(df_g, os.path.join(outdir, "graph_network.graphml") )
     networkx.draw(df_g, node_color='dodgerblue', edge_color='dimgrey', with_labels=True)
 
     plt.savefig(os.path.join(outdir, f"graph_network.png"))
-    create_ecological_network(df_b.copy(), data.copy())
+    adjacency = pd.DataFrame(edge_adjacency(len(w_corr_df.index), first, second, distance).toarray(),
+                             index=w_corr_df.index, columns=w_corr_df.index)
+    create_ecological_network(adjacency, data.copy())
     # plt.show()
 
 
-def create_ecological_network(df, data ):
+def create_ecological_network(adjacency, data ):
+    # adjacency holds the weight of every edge in both directions, features without edges are filled with 0
     feature_names = data.columns
-    metric_matrix = pd.DataFrame(columns=feature_names, index=feature_names, dtype='float64')
-    metric_matrix.fillna(value=0.0, inplace=True)
-
-    for i in df.index:
-        row = df.loc[i].tolist()
-        metric_matrix.loc[row[0]][row[1]] = row[2]
-        # print("Rows:0 "+str(row[0])+" Row:1 "+str(row[1])+" Row:2 "+str(row[2])+" Set Value: "+str(metric_matrix[row[0]][row[1]]))
+    metric_matrix = adjacency.reindex(index=feature_names, columns=feature_names, fill_value=0.0)
 
     metric_matrix.to_csv(os.path.join(outdir, "Metric Network.csv"))
 
@@ -680,20 +914,49 @@ def log_transfrom(df, cond_type='add_one'):
     return conditioned
 
 
+def prepare_data(ab_comp, dataframe1, dataframe2, min_count):
+    """
+    Function prepare_data: Builds the data the selection runs on, the samples of both dataframes for ab_comp with
+        missing counts set to 0 and the features at or below min_count removed. The values are made read-only so
+        the result can be shared by every iteration size of a run without being copied.
+    :param ab_comp: @type boolean: True to stack the samples of dataframe2 on top of dataframe1
+    :param dataframe1: @type pandas dataframe: samples x features counts
+    :param dataframe2: @type pandas dataframe: only used with ab_comp
+    :param min_count: @type int: features with no count above this are removed, -1 keeps every feature
+    :return: @type pandas dataframe: the read-only data
+    """
+    data_file = dataframe1.reset_index( drop=True ).fillna(0)
+    if ab_comp:
+        data_file = pd.concat([dataframe2.fillna(0), data_file])
+
+    if min_count != -1:
+        data = remove_min_count(data_file, min_count)
+    else:
+        data = data_file
+
+    values = data.to_numpy( copy=True )
+    values.flags.writeable = False
+    return pd.DataFrame( values, index=data.index, columns=data.columns )
+
+
 def main(ab_comp, dataframe1, dataframe2, metric_name, c_type, min_count,
          total_select, iteration_select, pca_components, smooth_type,
          window_size, centrality_type, keep_threshold, correlation,
          weighted, corr_prop, evaluation_type, min_connected,
-         detailed=False ):
+         detailed=False, corr_engine="pandas", corr_jobs=1, cent_engine="networkx",
+         cent_pivots=0, cent_epsilon=0.0, cent_confidence=0.95, incremental=False,
+         data=None, corr_cache=None ):
 
     t_start = time.perf_counter()
 
     global detailed_ # Using global since this will not change and passing detailed_ to all methods will be confusing
     detailed_ = detailed
 
-    # read the file(s) into a pandas dataframe and condition it
-    dataframe1.reset_index( drop=True, inplace=True )
-    dataframe1.fillna(0, inplace=True)
+    # read the file(s) into a pandas dataframe and condition it, unless it was already done for an earlier run
+    if data is None:
+        data = prepare_data(ab_comp, dataframe1, dataframe2, min_count)
+    if corr_cache is None:
+        corr_cache = CorrelationCache(c_type, correlation, corr_engine, corr_jobs)
 
     global disjoint
     disjoint = False
@@ -707,6 +970,8 @@ def main(ab_comp, dataframe1, dataframe2, metric_name, c_type, min_count,
 
     global connectedness
     connectedness = []
+    global rank_stability
+    rank_stability = []
 
     # set up the metric variables and the file names
     if ab_comp:
@@ -719,10 +984,6 @@ def main(ab_comp, dataframe1, dataframe2, metric_name, c_type, min_count,
                          weighted, corr_prop, min_connected]
         eval_params = [ab_comp, dataframe1.name, dataframe2.name, evaluation, c_type, total_select, iteration_select]
 
-        dataframe2.fillna(0, inplace=True)
-
-        data_file = pd.concat([dataframe2, dataframe1])
-
         if( detailed_ ):
             metric_filename = f"{dataframe1.name}-{dataframe2.name}-results.csv"
             abundance_filename = f"{dataframe1.name}-{dataframe2.name}-abundances.csv"
@@ -737,17 +998,10 @@ def main(ab_comp, dataframe1, dataframe2, metric_name, c_type, min_count,
                          corr_prop]
         eval_params = [ab_comp, dataframe1.name, evaluation, c_type, total_select, iteration_select]
 
-        data_file = dataframe1
-
         if( detailed_ ):
             metric_filename = f"{dataframe1.name}-importantFeatures.csv"
             abundance_filename = f"{dataframe1.name}-abundances.csv"
 
-    if min_count != -1:
-        data = remove_min_count(data_file, min_count)
-    else:
-        data = data_file
-
     # log_transfrom(data)
 
     # run the metric selection step to return the important features
@@ -756,7 +1010,10 @@ def main(ab_comp, dataframe1, dataframe2, metric_name, c_type, min_count,
     if metric_name == 'graph_centrality':
         metric = graph_centrality
         important_features = selection(metric, total_select, iteration_select, data, centrality_type, keep_threshold,
-                                       c_type, correlation, weighted, corr_prop, min_connected)
+                                       c_type, correlation, weighted, corr_prop, min_connected,
+                                       corr_cache=corr_cache,
+                                       cent_engine=cent_engine, cent_pivots=cent_pivots, cent_epsilon=cent_epsilon,
+                                       cent_confidence=cent_confidence, graph_state=GraphState() if incremental else None)
     elif metric_name == 'pca_importance':
         metric = pca_importance
         important_features = selection(metric, total_select, iteration_select, data, pca_components, c_type)
@@ -764,7 +1021,9 @@ def main(ab_comp, dataframe1, dataframe2, metric_name, c_type, min_count,
         metric = graph_centrality
         important_features = selection(metric, total_select, iteration_select, log_transfrom(data, c_type),
                                        centrality_type, keep_threshold, c_type, correlation, weighted, corr_prop,
-                                       min_connected)
+                                       min_connected, corr_cache=corr_cache,
+                                       cent_engine=cent_engine, cent_pivots=cent_pivots, cent_epsilon=cent_epsilon,
+                                       cent_confidence=cent_confidence, graph_state=GraphState() if incremental else None)
 
     # print("Printing Log Transformed Important Features")
     # print(important_features)
@@ -833,7 +1092,10 @@ def main(ab_comp, dataframe1, dataframe2, metric_name, c_type, min_count,
                       'keep_threshold': keep_threshold, 'correlation': correlation,
                       'weighted': weighted, 'corr_prop': corr_prop, 'evaluation_type': evaluation_type,
                       'runtime': runtime, 'min_connected': min_connected,
-                      'connectedness': connectedness}
+                      'connectedness': connectedness, 'corr_engine': corr_engine, 'corr_jobs': corr_jobs,
+                      'cent_engine': cent_engine, 'cent_pivots': cent_pivots, 'cent_epsilon': cent_epsilon,
+                      'cent_confidence': cent_confidence, 'rank_stability': rank_stability,
+                      'incremental': incremental}
     else:
         param_dict = {'ab_comp': ab_comp, 'dataframe1': dataframe1.name, 'dataframe2': "",
                       'metric_name': metric_name, 'c_type': c_type, 'min_count': min_count,
@@ -843,7 +1105,10 @@ def main(ab_comp, dataframe1, dataframe2, metric_name, c_type, min_count,
                       'keep_threshold': keep_threshold, 'correlation': correlation,
                       'weighted': weighted, 'corr_prop': corr_prop, 'evaluation_type': evaluation_type,
                       'runtime': runtime, 'min_connected': min_connected,
-                      'connectedness': connectedness}
+                      'connectedness': connectedness, 'corr_engine': corr_engine, 'corr_jobs': corr_jobs,
+                      'cent_engine': cent_engine, 'cent_pivots': cent_pivots, 'cent_epsilon': cent_epsilon,
+                      'cent_confidence': cent_confidence, 'rank_stability': rank_stability,
+                      'incremental': incremental}
 
     if( detailed_ ):
         parameter_df = pd.DataFrame(list(param_dict.items()),
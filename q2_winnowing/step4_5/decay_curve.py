@@ -5,61 +5,73 @@
 import os
 import pandas as pd
 import numpy as np
-from rpy2.robjects.packages import importr
-import rpy2.robjects.packages as rpackages
-from rpy2.robjects.vectors import StrVector
-from rpy2.robjects import r
-from rpy2.robjects import pandas2ri
 
-pandas2ri.activate()
-
-utils = rpackages.importr('utils')
-utils.chooseCRANmirror(ind=1)
-
-packnames = ['PKNCA', 'colorRamps']
-names_to_install = []
-# names_to_install = [x for packnames if not rpackages.isinstalled(x)]
-
-for x in packnames:
-    if (rpackages.isinstalled(x) == False):
-        names_to_install.append(x)
-
-if len(names_to_install) > 0:
-    utils.install_packages(StrVector(names_to_install))
-
-rpkcna = importr('PKNCA')
-raucx = r['pk.calc.auc']
-rc = r['c']
+from q2_winnowing import _rbridge
 
 
 # <><><> DEFINE FUNCTIONS <><><>
 
 
-def calc_auc_percentile( input_df ):
+def cumulative_auc( metric ):
+    """
+    cumulative area under the decay curve from the first point to each point, the same as pk.calc.auc over
+    the interval c( 1, i ) with PKNCA's default "lin up/log down" method
+    :param metric: metric values ordered by decreasing metric, taken at times 1, 2, ..., n
+    :return: numpy array of the area up to each point, the first being 0
+    """
+    conc = np.asarray( metric, dtype=np.float64 )
+    conc_1, conc_2 = conc[:-1], conc[1:]
+    # a declining curve above 0 decays exponentially, anything else is a linear trapezoid
+    use_log = ( conc_1 > conc_2 ) & ( conc_2 > 0 )
+    with np.errstate( divide="ignore", invalid="ignore" ):
+        log_area = ( conc_1 - conc_2 ) / np.log( conc_1 / conc_2 )
+    segment_area = np.where( use_log, log_area, ( conc_1 + conc_2 ) / 2 )
+    # R sums the segments in extended precision, doing the same keeps the percentile cut points identical
+    area = np.zeros( len( conc ), dtype=np.longdouble )
+    np.cumsum( segment_area.astype( np.longdouble ), out=area[1:] )
+    return area.astype( np.float64 )
+
+
+def calc_auc_percentile( input_df, engine="PKNCA" ):
     """
     calculate each AUC percentile of decay curve
     :param input_df: Important features and OTUs that have been passed on to be ordered
+    :param engine: PKNCA calls pk.calc.auc for each end point, numpy finds every percentile from one cumulative sum
     :return: ordered AUC percentiles of which OTU is most influential for percentile
     """
 
     input_df = input_df.sort_values("metric", axis=0, ascending=False)
     input_df.index = range(1, len(input_df) + 1)
-    input_auc = raucx(input_df["metric"], input_df.index, interval=rc(1, len(input_df["metric"])))
     result_df = pd.DataFrame(columns=['auc', 'otu.num'])
     parameter_df = pd.DataFrame(columns=['x', 'y'])
 
-    for factor in np.arange(0.01, 1.00, 0.01):
-        area = 0.0
-        end_range = 2
-        # 1. calculate the area of each trapezoid
-        while (area <= round(factor, 2) * input_auc):
-            area = raucx(input_df["metric"], input_df.index, interval=rc(1, end_range))
-            end_range += 1
+    factors = np.arange(0.01, 1.00, 0.01)
+    if( engine == "numpy" ):
+        area = cumulative_auc( input_df["metric"] )
+        input_auc = area[-1]
+        # the loop below stops one past the first end point whose area is above the percentile
+        end_ranges = np.searchsorted( area, np.round( factors, 2 ) * input_auc, side="right" ) + 2
+    elif( engine == "PKNCA" ):
+        raucx = _rbridge.function( "pk.calc.auc", "PKNCA" )
+        rc = _rbridge.function( "c" )
+        input_auc = raucx(input_df["metric"], input_df.index, interval=rc(1, len(input_df["metric"])))
+        end_ranges = []
+        for factor in factors:
+            area = 0.0
+            end_range = 2
+            # 1. calculate the area of each trapezoid
+            while (area <= round(factor, 2) * input_auc):
+                area = raucx(input_df["metric"], input_df.index, interval=rc(1, end_range))
+                end_range += 1
+            end_ranges.append( end_range )
+    else:
+        raise Exception( f"Error: {engine} is not a valid AUC engine. Must be either: PKNCA, or numpy." )
 
+    for factor, end_range in zip( factors, end_ranges ):
         print( f"The point at which we reach {str(round(factor * 100, 2))}% of the AUC is = {str(end_range)}" )
 
         #2. sum trapezoid areas to get AUC
-        result_df.loc[int(round(factor * 100, 2))] = ["auc" + str(int(round(factor * 100, 2)))] + [end_range]
+        result_df.loc[int(round(factor * 100, 2))] = ["auc" + str(int(round(factor * 100, 2)))] + [int( end_range )]
 
     result_df.loc[100] = ["auc100"] + [len(input_df["metric"])]
     parameter_df['x'] = input_df.index - 1
@@ -72,12 +84,13 @@ def calc_auc_percentile( input_df ):
 # <><><> DEFINE EXECUTION FUNCTION <><><>
 
 
-def main( input_df, name, detailed=False ):
+def main( input_df, name, detailed=False, engine="PKNCA" ):
     """
     Each OTU is now ordered by centrality and the AUC of each is calculated.
     :param input_df: Important features and OTUs that have been passed on to be ordered
     :param name: name attached to all detailed output
     :param detailed: Output helper tables
+    :param engine: PKNCA to calculate the AUC with R, or numpy
     :return: ordered AUC percentiles of which OTU is most influential for percentile
     """
 
@@ -94,7 +107,7 @@ def main( input_df, name, detailed=False ):
         parameter_file = open( parameter_file, "w+", encoding="utf-8" )
 
         print(f"Processing Input dataFrame: {name}")
-        result, param = calc_auc_percentile(input_df )
+        result, param = calc_auc_percentile( input_df, engine )
         print(f"Output is written in file: {out_file}")
         print(f"Parameters are written in file: {parameter_file}")
 
@@ -108,7 +121,7 @@ def main( input_df, name, detailed=False ):
 
     else:
         print(f"Processing Input dataFrame: {name}")
-        result, param = calc_auc_percentile( input_df )
+        result, param = calc_auc_percentile( input_df, engine )
 
     # Return results dataframe along with the parameters dataframe
     return result, param
@@ -6,35 +6,23 @@ import os
 import pandas as pd
 import numpy as np
 import math
-from rpy2.robjects.packages import importr
-import rpy2.robjects.packages as rpackages
-from rpy2.robjects.vectors import StrVector
-from rpy2.robjects import pandas2ri
-from rpy2.robjects import Formula
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory, util as multiprocessing_util
 import matplotlib.pyplot as plt
 from scipy.interpolate import UnivariateSpline
+from scipy.spatial.distance import pdist, squareform
+from scipy.stats import beta as beta_distribution
 
-# Install packages
-pandas2ri.activate()
+from q2_winnowing import _rbridge
 
-utils = rpackages.importr('utils')
-utils.chooseCRANmirror(ind=1)
-
-packnames = ['vegan','zoo','stats']
-names_to_install = []
-#names_to_install = [x for packnames if not rpackages.isinstalled(x)]
-
-for x in packnames:
-    if (rpackages.isinstalled(x)==False):
-        names_to_install.append(x)
-
-if len(names_to_install) > 0:
-    utils.install_packages(StrVector(names_to_install))
-
-# Setup R packages
-rvegan = importr('vegan')
-rzoo = importr('zoo')
-rstats = importr('stats')
+_PERMUTATION_BATCH_ = 256 # permutations tested with a single matrix product in the numpy engine
+_KNEE_GRID_ = 10 # AUC percentiles between the rows first tested by the knee search
+_TRIANGLE_INDICES_ = {} # pair indices of each matrix length, see _triangle_indices()
+_PERMANOVA_SEED_ = 0 # each subset size draws its permutations from a seed of its own so runs can be repeated
+# Sequential stopping of the permutations once the p value is known to be above or below alpha
+_SEQUENTIAL_BATCH_ = 50 # permutations tested between checks
+_SEQUENTIAL_EXCEEDANCES_ = 10 # Besag-Clifford stops once this many permutations have an F at least as large
+_SEQUENTIAL_RISK_ = 0.001 # chance that a p value found to be below alpha would not be
 
 # <><><> DEFINE FUNCTIONS <><><>
 
@@ -52,13 +40,30 @@ def _generate_figures( permanova_df, cent_type, outdir, name ):
         # cent type was not given don't attempt to graph
         return # Nothing simply termination of function
 
+    if( "knee" in permanova_df.columns ):
+        # <><> PLOTTING KNEE SEARCH <><>
+        # only the tested rows are filled so the knee found is marked instead of the fixed inflection points
+        evaluated_df = permanova_df.dropna( subset=["F.model"] )
+        knee_df = permanova_df[ permanova_df["knee"] ]
+        plt.figure()
+        plt.axis([0, 100, 0.0, 1.1])
+        plt.xlabel('AUC%')
+        plt.ylabel('F-Score(scaled)')
+        plt.plot(evaluated_df["auc"].values.tolist(), evaluated_df["F.model.scale"].values.tolist(), 'ro',
+                 color="black")
+        plt.plot(knee_df["auc"].values.tolist(), knee_df["F.model.scale"].values.tolist(), 'ro', color="blue")
+        plt.text(knee_df["auc"].values[0] + 5, knee_df["F.model.scale"].values[0],
+                 str(knee_df["N.taxa"].values[0]) + " OTUs", color="blue")
+        plt.savefig( os.path.join( outdir, f"{name}_F-Score_AUC_{cent_type}_knee.png") )
+        return
+
     permanova_df_copy = permanova_df.copy( deep=True ) # deep copy to avoid altering original dataframe
 
-    permanova_df_copy.loc[0] = ["auc0"]+[0]+[0]+[0]+[0]+[0]+[0]+[0]+[0]+[0]
+    permanova_df_copy.loc[0] = ["auc0"] + [0] * ( len( permanova_df_copy.columns ) - 1 )
     permanova_df_copy.sort_index(axis=0,inplace=True)
 
-    rf_model_scale = pandas2ri.py2rpy(permanova_df_copy["F.model.scale"])
-    sliding_sd = rzoo.rollapply(rf_model_scale, width=5, FUN=rstats.sd, fill='NA')
+    # standard deviation of a centered window of 5, the same as zoo::rollapply( width=5, FUN=sd, fill=NA )
+    sliding_sd = permanova_df_copy["F.model.scale"].astype(float).rolling(5, center=True).std()
 
     if( cent_type == "degree" ):
         # <><> PLOTTING DEGREE <><>
@@ -160,11 +165,22 @@ def _generate_figures( permanova_df, cent_type, outdir, name ):
 
 
 
-def _convert_to_dist_hel_matrix( array, length ):
+def _triangle_indices( length ):
+    """
+    Row and column of each pair of a length x length matrix in the order of an R dist object, the lower triangle
+    by columns, which is the upper triangle by rows. Kept since every cut point uses the same length.
+    """
+    if( length not in _TRIANGLE_INDICES_ ):
+        _TRIANGLE_INDICES_[length] = np.triu_indices( length, 1 )
+    return _TRIANGLE_INDICES_[length]
+
+
+def _convert_to_dist_hel_matrix( array, length, out=None ):
     """
     Convert array to a distance hellinger matrix
     :param array: the array with all values
     :param length: the length x width of what the new matrix will be
+    :param out: length x length float matrix to write into instead of a new one ( ex. the one of the last cut point )
     :return: output distance hellinger matrix
     """
     # check if array will fit in matrix
@@ -177,31 +193,326 @@ def _convert_to_dist_hel_matrix( array, length ):
                          f"matrix has capacity {needed_size}. A length of < {needed_length_minus} or "
                          f"< {needed_length_plus} is needed to have a capacity {len(array)}." )
 
-    # initialize an empty matrix to fill
-    matrix_new = np.zeros( (length, length), dtype=float )
-    # print( len( array ), array.size, "" , len( matrix_new ), matrix_new.size )
+    matrix_new = np.empty( (length, length), dtype=float ) if out is None else out
+    np.fill_diagonal( matrix_new, 0 )
+
+    # the same value is written to both triangles so the matrix is always symmetric
+    values = np.asarray( array, dtype=float )
+    rows, cols = _triangle_indices( length )
+    matrix_new[rows, cols] = values
+    matrix_new[cols, rows] = values
+
+    return matrix_new
+
+
 
-    col_index = 0
-    row_index = 1
+def hellinger_distance( data ):
+    """
+    Euclidean distance between the hellinger transformed samples, the same as vegdist( decostand( data, "hellinger" ),
+    "euclidean" ) as a square matrix
+    :param data: samples x taxa abundances
+    :return: samples x samples distance matrix
+    """
+    data = np.asarray( data, dtype=np.float64 )
+    # decostand divides by at least the machine epsilon so samples without any abundance stay at 0
+    total = np.maximum( data.sum( axis=1 ), np.finfo( np.float64 ).eps )
+    return squareform( pdist( np.sqrt( data / total[:, None] ), "euclidean" ) )
 
-    # needs to fill by columns instead of by rows so need to do this manually
-    for value in array:
-        matrix_new[row_index][col_index] = value
 
-        if( row_index < length -1 ):
-            row_index += 1
+class HellingerDistance:
+    """
+    Hellinger distances between the samples over a growing number of leading taxa.
+    With r = sqrt( x ) the squared distance of samples i and j is
+        A_ii / S_i + A_jj / S_j - 2 A_ij / sqrt( S_i S_j )
+    where S are the sample totals and A = r r^T. Both are sums over the taxa, so when the next subset only adds
+    taxa to the last one they are updated with the new columns instead of starting over.
+    """
+
+    def __init__( self, data ):
+        """
+        :param data: samples x taxa abundances, ordered so each subset is a prefix of the columns
+        """
+        self._data = np.asarray( data, dtype=np.float64 )
+        self.reset()
+
+    def reset( self ):
+        num_samples = len( self._data )
+        self._columns = 0
+        self._gram = np.zeros( ( num_samples, num_samples ) )
+
+    def distance( self, columns ):
+        """
+        The distance matrix of the first columns taxa, the same as hellinger_distance( data[:, :columns] )
+        :param columns: number of leading taxa
+        :return: samples x samples distance matrix
+        """
+        if( columns < self._columns ):
+            self.reset() # only growing subsets can be updated
+        root = np.sqrt( self._data[:, self._columns:columns] )
+        self._gram += root @ root.T
+        self._columns = columns
+
+        total = np.diag( self._gram ).copy()
+        scale = 1 / np.sqrt( np.maximum( total, np.finfo( np.float64 ).eps ) )
+        self_similarity = total * scale ** 2 # 1, or 0 for a sample without any abundance
+        # scaled by the outer product so the matrix stays exactly symmetric
+        squared = self_similarity[:, None] + self_similarity[None, :] - 2 * ( self._gram * np.outer( scale, scale ) )
+        np.fill_diagonal( squared, 0 )
+        return np.sqrt( np.maximum( squared, 0 ) )
+
+
+def adonis( distance, groups, permutations=999, seed=None, alpha=None ):
+    """
+    PERMANOVA of a single grouping factor, following vegan's adonis.
+    Every permutation only changes which samples are summed for each group, so a batch of permutations is tested
+    with one product of the centred distances and a matrix of permuted group indicators.
+    With alpha the permutations stop as soon as the p value is known to be above or below it. Large p values stop
+    after _SEQUENTIAL_EXCEEDANCES_ permutations with an F at least as large and are h / l ( Besag and Clifford 1991 ).
+    Small ones stop once the upper Clopper-Pearson bound of the p value at 1 - _SEQUENTIAL_RISK_ is below alpha.
+    :param distance: samples x samples distance matrix
+    :param groups: group of each sample ( ex. natural, invaded )
+    :param permutations: number of random permutations, or a permutations x samples array of sample orders
+        ( ex. permute::shuffleSet - 1 ) to test the same permutations as adonis
+    :param seed: seed of the random permutations
+    :param alpha: significance level to stop the permutations at, None tests all of them
+    :return: ( SumsOfSqs, MeanSqs, F.Model, R2, Pr(>F), number of permutations tested ) of the grouping term
+    """
+    distance = np.asarray( distance, dtype=np.float64 )
+    num_samples = len( distance )
+    if( np.ndim( permutations ) == 0 ):
+        rng = np.random.default_rng( seed )
+        permutations = rng.permuted( np.tile( np.arange( num_samples ), ( int( permutations ), 1 ) ), axis=1 )
+    permutations = np.asarray( permutations, dtype=np.intp )
+
+    labels, group = np.unique( np.asarray( groups ).astype( str ), return_inverse=True )
+    if( len( labels ) < 2 ):
+        raise Exception( "Error: PERMANOVA needs samples of at least 2 types." )
+    scale = 1 / np.sqrt( np.bincount( group ) ) # projection onto the group means is the sum of the scaled indicators
+    df_exp = len( labels ) - 1
+    df_res = num_samples - len( labels )
+
+    squared = distance ** 2
+    centred = -( squared - squared.mean( axis=1 )[:, None] ) / 2
+    total_ss = np.trace( centred )
+
+    def explained( orders ):
+        # the indicator of each group for every order in the batch, ( samples, orders x groups )
+        indicator = np.zeros( ( num_samples, len( orders ), len( labels ) ) )
+        indicator[orders, np.arange( len( orders ) )[:, None], group] = scale[group]
+        indicator = indicator.reshape( num_samples, -1 )
+        return ( indicator * ( centred @ indicator ) ).sum( axis=0 ).reshape( len( orders ), -1 ).sum( axis=1 )
+
+    ss_exp = explained( np.arange( num_samples )[None, :] )[0]
+    ss_res = total_ss - ss_exp
+    f_model = ( ss_exp / df_exp ) / ( ss_res / df_res )
+
+    batch_size = _PERMUTATION_BATCH_ if alpha is None else _SEQUENTIAL_BATCH_
+    # adonis counts permutations within the square root of the machine epsilon as at least as large
+    exceeds = np.zeros( len( permutations ), dtype=bool )
+    tested = len( permutations )
+    p_value = None
+    for start in range( 0, len( permutations ), batch_size ):
+        ss_perm = explained( permutations[start:start + batch_size] )
+        f_perm = ( ss_perm / df_exp ) / ( ( total_ss - ss_perm ) / df_res )
+        exceeds[start:start + batch_size] = f_perm >= f_model - np.sqrt( np.finfo( np.float64 ).eps )
+        if( alpha is None ):
+            continue
+
+        num_tested = start + len( ss_perm )
+        num_exceeds = np.count_nonzero( exceeds[:num_tested] )
+        if( num_exceeds >= _SEQUENTIAL_EXCEEDANCES_ ):
+            # Besag-Clifford, stop at the permutation that reached h
+            tested = int( np.flatnonzero( exceeds )[_SEQUENTIAL_EXCEEDANCES_ - 1] ) + 1
+            p_value = _SEQUENTIAL_EXCEEDANCES_ / tested
+            break
+        if( beta_distribution.ppf( 1 - _SEQUENTIAL_RISK_, num_exceeds + 1, num_tested - num_exceeds ) < alpha ):
+            tested = num_tested
+            break
+    if( p_value is None ):
+        p_value = ( np.count_nonzero( exceeds[:tested] ) + 1 ) / ( tested + 1 )
+
+    return ss_exp, ss_exp / df_exp, f_model, ss_exp / total_ss, p_value, tested
+
+
+def knee_grid( num_rows, grid=_KNEE_GRID_ ):
+    """
+    The rows knee_search() tests before halving the steepest step, every grid'th row and the last one
+    """
+    return sorted( set( range( 0, num_rows, grid ) ) | { num_rows - 1 } )
+
+
+def knee_search( f_model_of, num_rows, grid=_KNEE_GRID_ ):
+    """
+    Find the row of the PERMANOVA table where F.model changes the fastest from the one before it.
+    Every grid'th row is tested first, then the steepest step between two of them is halved towards its
+    steeper half until the step is a single row. F.model.scale is a linear map of F.model, so both are
+    steepest in the same place.
+    :param f_model_of: returns the F.model of a row, only called for the rows that are needed
+    :param num_rows: number of rows in the table ( AUC percentiles )
+    :param grid: rows between the first tested rows
+    :return: index of the row at the end of the steepest step
+    """
+    rows = knee_grid( num_rows, grid )
+    if( len( rows ) < 2 ):
+        return rows[0]
+    f_models = { row: f_model_of( row ) for row in rows }
+
+    def steepness( low, high ):
+        return abs( f_models[high] - f_models[low] ) / ( high - low )
+
+    low, high = max( zip( rows[:-1], rows[1:] ), key=lambda step: steepness( *step ) )
+    while( high - low > 1 ):
+        middle = ( low + high ) // 2
+        f_models[middle] = f_model_of( middle )
+        if( steepness( low, middle ) >= steepness( middle, high ) ):
+            high = middle
         else:
-            col_index += 1
-            row_index = col_index + 1
+            low = middle
+    return high
 
-    # it needs the upper triangle to mirror the lower
-    matrix_new[ np.triu_indices(length, 1 )] = array
 
-    return matrix_new
+def subset_seed( range_of_decay ):
+    """
+    Seed of the permutations of a subset, the same whichever process or order it is tested in
+    :param range_of_decay: number of leading taxa in the subset
+    :return: seed that fits R's set.seed
+    """
+    return int( np.random.SeedSequence( [ _PERMANOVA_SEED_, range_of_decay ] ).generate_state( 1 )[0] % 2**31 )
+
+
+class SubsetTester:
+    """
+    Runs the PERMANOVA of the leading taxa of the abundances with either engine, each subset with its own seed.
+    """
+
+    def __init__( self, abundances, sample_df, engine="vegan", alpha=None ):
+        """
+        :param abundances: samples x taxa abundances in AUC order
+        :param sample_df: Sample that provide data on whether taxom were invaded or natural
+        :param engine: vegan calls adonis through R, numpy runs adonis() on the distance matrix directly
+        :param alpha: significance level the numpy engine stops the permutations at, None runs all of them
+        """
+        if( alpha is not None and not 0 < alpha < 1 ):
+            # the stopping rule compares p values with alpha, outside of ( 0, 1 ) it can never or always stop
+            raise Exception( f"Error: PERMANOVA alpha must be between 0 and 1 exclusive, got {alpha}." )
+        self._abundances = abundances
+        self._num_samples = len( sample_df )
+        self._engine = engine
+        self._alpha = alpha
+        if ("type" in sample_df.columns): # check for capitalization in index
+            type_index = int( sample_df.columns.get_loc("type"))  # Since Rpy doesn't allow for string index must get column int index
+        else:
+            type_index = int( sample_df.columns.get_loc("Type"))  # Since Rpy doesn't allow for string index must get column int index
+        if( engine == "numpy" ):
+            # the distances of each subset are built up from those of the last one
+            self._distances = HellingerDistance( abundances.to_numpy() )
+            self._sample_types = sample_df.iloc[:, type_index].to_numpy()
+        elif( engine == "vegan" ):
+            self._distance = np.empty( ( self._num_samples, self._num_samples ) ) # reused by every subset
+            self._sample_rdf = _rbridge.py2rpy(sample_df)[type_index]
+            self._rformula = _rbridge.formula('x ~ y') # Note, y is independent while x is dependant
+        else:
+            raise Exception( f"Error: {engine} is not a valid PERMANOVA engine. Must be either: vegan, or numpy." )
+
+    def test( self, range_of_decay ):
+        """
+        :param range_of_decay: number of leading taxa to test
+        :return: ( SumsOfSqs, MeanSqs, F.Model, R2, Pr(>F), number of permutations tested )
+        """
+        if( self._engine == "numpy" ):
+            # STEP 2 and 3 without R
+            return adonis( self._distances.distance( range_of_decay ), self._sample_types, permutations=999,
+                           seed=subset_seed( range_of_decay ), alpha=self._alpha )
+
+        data_rdf = _rbridge.py2rpy( self._abundances.iloc[:, 0:range_of_decay ] ) # all rows with columns 0 to otu.num
 
+        # This is STEP 2
+        # Convert to Hellinger distance matrix
+        rvegan = _rbridge.package("vegan")
+        data_hel_rdf = rvegan.vegdist( rvegan.decostand( data_rdf, "hellinger"), "euclidean")
+        # this should be reformatted to lower triangular matrix where x rows == y values
+        data_hel_tri_rdf = _convert_to_dist_hel_matrix( data_hel_rdf, self._num_samples, out=self._distance )
+
+        # This is STEP 3
+        # Setup formula for the adonis calculation.
+        renv = self._rformula.environment
+        renv['x'] = data_hel_tri_rdf # LHS
+        renv['y'] = self._sample_rdf # RHS
 
+        _rbridge.package("base").set_seed( subset_seed( range_of_decay ) )
+        radonis = rvegan.adonis( self._rformula, permutations=999 )
+        return ( radonis[0].iloc[0, 1], radonis[0].iloc[0, 2], radonis[0].iloc[0, 3], radonis[0].iloc[0, 4],
+                 radonis[0].iloc[0, 5], 999 )
 
-def perform_permanova( auc_df, auc100_df, sample_df, out_file, detailed=False ):
+
+# tester of the subsets when they run in worker processes, attached by _init_permanova_worker
+_worker_memory = None
+_worker_tester = None
+
+
+def _init_permanova_worker( memory_name, shape, dtype, columns, sample_df, engine, alpha ):
+    """
+    Attach a worker process to the abundances in shared memory, the vegan engine starts an R of its own here.
+    """
+    global _worker_memory, _worker_tester
+    _worker_memory = shared_memory.SharedMemory( name=memory_name )
+    values = np.ndarray( shape, dtype=np.dtype( dtype ), buffer=_worker_memory.buf )
+    values.flags.writeable = False
+    _worker_tester = SubsetTester( pd.DataFrame( values, columns=columns, copy=False ), sample_df, engine, alpha )
+    # workers leave through os._exit so atexit never runs, multiprocessing finalizers do when the pool shuts down
+    multiprocessing_util.Finalize( None, _close_permanova_worker, exitpriority=10 )
+
+
+def _close_permanova_worker():
+    """
+    Detach a worker process from the shared abundances when it exits, the parent unlinks the shared memory.
+    """
+    global _worker_memory, _worker_tester
+    _worker_tester = None # its abundances view the shared buffer, it can not close while they do
+    _worker_memory.close()
+
+
+def _worker_test( range_of_decay ):
+    return _worker_tester.test( range_of_decay )
+
+
+def run_subsets( tester, subset_sizes, abundances, sample_df, engine="vegan", alpha=None, n_jobs=1 ):
+    """
+    Test each subset size, in worker processes if n_jobs is more than 1. The abundances are shared with the
+    workers instead of being copied to each of them. Sizes are handed out in increasing runs so the numpy engine
+    can keep building on the distances of the last one.
+    :param tester: SubsetTester used when running in this process
+    :param subset_sizes: increasing numbers of leading taxa to test
+    :param abundances: samples x taxa abundances in AUC order
+    :param sample_df: Sample that provide data on whether taxom were invaded or natural
+    :param engine: vegan, or numpy
+    :param alpha: significance level the numpy engine stops the permutations at, None runs all of them
+    :param n_jobs: number of processes
+    :return: list of the SubsetTester.test() results of each size
+    """
+    if( n_jobs <= 1 or len( subset_sizes ) <= 1 ):
+        return [ tester.test( range_of_decay ) for range_of_decay in subset_sizes ]
+
+    values = abundances.to_numpy()
+    memory = shared_memory.SharedMemory( create=True, size=max( values.nbytes, 1 ) )
+    np.ndarray( values.shape, dtype=values.dtype, buffer=memory.buf )[:] = values
+    num_workers = min( n_jobs, len( subset_sizes ) )
+    try:
+        # a forked embedded R is not safe to use, every R worker starts its own from _rbridge
+        with ProcessPoolExecutor( max_workers=num_workers,
+                                  mp_context=get_context( "spawn" ) if engine == "vegan" else None,
+                                  initializer=_init_permanova_worker,
+                                  initargs=( memory.name, values.shape, values.dtype.str, abundances.columns,
+                                             sample_df, engine, alpha ) ) as executor:
+            return list( executor.map( _worker_test, subset_sizes,
+                                       chunksize=math.ceil( len( subset_sizes ) / num_workers ) ) )
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def perform_permanova( auc_df, auc100_df, sample_df, out_file, detailed=False, engine="vegan", search="all",
+                       alpha=None, n_jobs=1 ):
     """
     Perform ANOVA calculation with permutations
     :param sample_df: Sample that provide data on whether taxom were invaded or natural
@@ -209,6 +520,12 @@ def perform_permanova( auc_df, auc100_df, sample_df, out_file, detailed=False ):
     :param auc100_df: abundances generated
     :param out_file: this is the result folder where output is written to if detailed
     :param detailed: Output helper tables
+    :param engine: vegan calls adonis through R, numpy runs adonis() on the distance matrix directly
+    :param search: all tests every AUC percentile, knee only tests those knee_search() needs and marks the knee
+        in a knee column, the other rows are left empty
+    :param alpha: with the numpy engine, stop the permutations once the p value is known to be above or below this
+        significance level, None runs all 999
+    :param n_jobs: number of processes the subsets are tested in, each vegan process runs an R of its own
     :return: data frame containing calculations performed
     """
 
@@ -220,58 +537,55 @@ def perform_permanova( auc_df, auc100_df, sample_df, out_file, detailed=False ):
     auc100_df.reset_index(  drop=True, inplace=True )
 
     # This is what our dataframe output should be formatted as, will need to build as each index is iterated
-    premanova_df = pd.DataFrame(columns=['test', 'order', 'auc','SumsOfSqs','MeanSqs','F.model','R2','Pval','N.taxa','F.model.scale'])
+    premanova_df = pd.DataFrame(columns=['test', 'order', 'auc','SumsOfSqs','MeanSqs','F.model','R2','Pval','N.taxa','F.model.scale',
+                                         'N.perm'])
 
     # Setup variables before loop to avoid extra computation
-    if ("type" in sample_df.columns): # check for capitalization in index
-        type_index = int( sample_df.columns.get_loc("type"))  # Since Rpy doesn't allow for string index must get column int index
+    tester = SubsetTester( auc100_df, sample_df, engine, alpha )
+
+    # Many percentiles share the same otu.num, each subset size is only tested once
+    evaluated = {}
+    # This is STEP 1
+    subset_sizes = [ min( int(auc_df.iloc[i, len(auc_df.columns)-1]), len(auc100_df.columns) )
+                     for i in range( 0, len( auc_df ) ) ]
+
+    def evaluate( rows ):
+        # test the subsets of the rows that were not tested yet
+        untested = sorted( set( subset_sizes[i] for i in rows ) - set( evaluated ) )
+        for range_of_decay, result in zip( untested, run_subsets( tester, untested, auc100_df, sample_df, engine,
+                                                                  alpha, n_jobs ) ):
+            evaluated[range_of_decay] = result
+            print( f"{range_of_decay} taxa - F.Model: {result[2]}, R2: {result[3]}, Pr(>F): {result[4]}, "
+                   f"permutations: {result[5]}" )
+        return [ evaluated[subset_sizes[i]] for i in rows ]
+
+    if( search == "knee" ):
+        evaluate( knee_grid( len( auc_df ) ) ) # the first rows of the search can be tested at the same time
+        knee = knee_search( lambda i: evaluate( [i] )[0][2], len( auc_df ) )
+    elif( search == "all" ):
+        evaluate( range( 0, len( auc_df) ) ) # all auc values are used to compute
     else:
-        type_index = int( sample_df.columns.get_loc("Type"))  # Since Rpy doesn't allow for string index must get column int index
-    sample_rdf = pandas2ri.py2rpy(sample_df)[type_index]
-
-    rformula = Formula('x ~ y') # Note, y is independent while x is dependant
-
-    for i in range( 0, len( auc_df) ): # all auc values are used to compute
-
-        # This is STEP 1
-        range_of_decay = int(auc_df.iloc[i, len(auc_df.columns)-1])
-        data_df = auc100_df.iloc[:, 0:range_of_decay ] # get all rows with columns 0 to value at [i,2]
-        data_rdf = pandas2ri.py2rpy(data_df)
-
-        # This is STEP 2
-        # Convert to Hellinger distance matrix
-        data_hel_rdf = rvegan.vegdist( rvegan.decostand( data_rdf, "hellinger"), "euclidean")
-        # this should be reformatted to lower triangular matrix where x rows == y values
-        data_hel_tri_rdf = _convert_to_dist_hel_matrix( data_hel_rdf, len(sample_df) )
-
-        # This is STEP 3
-        # Setup formula for the adonis calculation.
-        renv = rformula.environment
-        renv['x'] = data_hel_tri_rdf # LHS
-        renv['y'] = sample_rdf # RHS
-
-        radonis = rvegan.adonis( rformula, permutations=999 )
+        raise Exception( f"Error: {search} is not a valid PERMANOVA search. Must be either: all, or knee." )
 
+    for i in range( 0, len( auc_df) ):
         # This is STEP 4
-        # Must build the permanova table stated earlier
+        # Must build the permanova table stated earlier, rows that were not tested are left empty
         _pTest = f"auc{str(i+1)}"
         _pOrder = f"{i+1}"
         _pAUC = i+1
-        _pSumOfSquares = radonis[0].iloc[0, 1]
-        _pMeanSquares = radonis[0].iloc[0, 2]
-        _pFModel = radonis[0].iloc[0, 3]
-        _pR2 = radonis[0].iloc[0, 4]
-        _pPVal = radonis[0].iloc[0, 5]
-        _pNTaxa = len(data_df.columns)
+        _pSumOfSquares, _pMeanSquares, _pFModel, _pR2, _pPVal, _pNPerm = evaluated.get( subset_sizes[i], [np.nan] * 6 )
+        _pNTaxa = subset_sizes[i]
         _pFModelScale = -1.0 # this just a place holder
 
-        premanova_df.loc[i] = [_pTest, _pOrder, _pAUC, _pSumOfSquares, _pMeanSquares, _pFModel, _pR2, _pPVal, _pNTaxa, _pFModelScale]
-
-        print( f"{i} - {str( radonis[0] )}")
+        premanova_df.loc[i] = [_pTest, _pOrder, _pAUC, _pSumOfSquares, _pMeanSquares, _pFModel, _pR2, _pPVal, _pNTaxa, _pFModelScale,
+                               _pNPerm]
 
     # This is STEP 4.5
     # Convert F.model to a scaled version of F.model
-    premanova_df["F.model.scale"] = (premanova_df["F.model"] - min(premanova_df["F.model"]))/(max(premanova_df["F.model"]) - min(premanova_df["F.model"]))
+    f_model = premanova_df["F.model"].astype(float)
+    premanova_df["F.model.scale"] = (f_model - f_model.min())/(f_model.max() - f_model.min())
+    if( search == "knee" ):
+        premanova_df["knee"] = premanova_df.index == knee
     premanova_df.index = range(1,len(premanova_df)+1)
 
     if( detailed ):
@@ -283,7 +597,8 @@ def perform_permanova( auc_df, auc100_df, sample_df, out_file, detailed=False ):
 
 
 # <><><> DEFINE EXECUTION FUNCTION <><><>
-def main( auc_ordering, abundances, sample_df, centrality_type, name, detailed=False ):
+def main( auc_ordering, abundances, sample_df, centrality_type, name, detailed=False, engine="vegan", search="all",
+          alpha=None, n_jobs=1 ):
     """
     take in auc, abundance, and sample information and output values with permanova table
     :param auc_ordering: auc ordering generated
@@ -292,6 +607,10 @@ def main( auc_ordering, abundances, sample_df, centrality_type, name, detailed=F
     :param centrality_type: used for generating detailed output ( betweenness, degree, eigenvector, closeness )
     :param name: name attached to all detailed output
     :param detailed: Output helper tables
+    :param engine: vegan, or numpy to calculate the PERMANOVA without R
+    :param search: all, or knee to only test the AUC percentiles needed to find the knee of F.model
+    :param alpha: significance level the numpy engine stops the permutations at, None runs all of them
+    :param n_jobs: number of processes the PERMANOVAs are ran in
     :return: table of all values generated during permanova calculation
     """
 
@@ -303,7 +622,8 @@ def main( auc_ordering, abundances, sample_df, centrality_type, name, detailed=F
         # Create new files for output
 
         # Call PERMANOVA calculation
-        permanova_df = perform_permanova( auc_ordering, abundances, sample_df, out_file, detailed )
+        permanova_df = perform_permanova( auc_ordering, abundances, sample_df, out_file, detailed, engine, search, alpha,
+                                          n_jobs )
         print( f"Plots generated to {out_dir}." )
 
         # Since this is detailed must generate plots
@@ -311,7 +631,8 @@ def main( auc_ordering, abundances, sample_df, centrality_type, name, detailed=F
 
     else:
         # No excess files necessary just generate dataframe to pass on
-        permanova_df = perform_permanova( auc_ordering, abundances, sample_df, None )
+        permanova_df = perform_permanova( auc_ordering, abundances, sample_df, None, engine=engine, search=search,
+                                          alpha=alpha, n_jobs=n_jobs )
 
     permanova_df.reset_index( drop=True, inplace=True ) # reset indicis as a precautionary to make sure all df's start at index 0
 
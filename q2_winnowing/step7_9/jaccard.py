@@ -4,29 +4,10 @@
 import os
 import pandas as pd
 import numpy as np
-from rpy2.robjects.packages import importr
-import rpy2.robjects.packages as rpackages
-from rpy2.robjects.vectors import StrVector
-from rpy2.robjects import pandas2ri
 
-
-# Setup R packages used
-pandas2ri.activate()
-
-utils = rpackages.importr('utils')
-utils.chooseCRANmirror(ind=1)
-
-packnames = ['irr']
-names_to_install = []
-
-for x in packnames:
-    if (rpackages.isinstalled(x)==False):
-        names_to_install.append(x)
-
-if len(names_to_install) > 0:
-    utils.install_packages(StrVector(names_to_install))
-
-rirr = importr('irr')
+_JACCARD_BUDGET_ = 1 << 26 # bytes of bit intersections held at a time, their popcount takes about as much again
+# number of set bits in each byte, for numpy without bitwise_count
+_POPCOUNT_ = np.array( [ bin( byte ).count( "1" ) for byte in range( 256 ) ], dtype=np.uint8 )
 
 
 # <><><> DEFINE FUNCTIONS <><><>
@@ -61,6 +42,147 @@ def jaccard_coefficient(x,y):
     return len(set(x) & set(y)) / len(set(x) | set(y)) # Set gets rid of duplicates
 
 
+def feature_orderings( leave_one_out_df ):
+    """
+    The ordered features of each row of a feature ordering table, the columns from 1 to the last
+    :param leave_one_out_df: result of leave one out feature ordering method
+    :return: orderings x ranks dataframe
+    """
+    try:
+        return leave_one_out_df.iloc[:, leave_one_out_df.columns.get_loc( 1 ):] # Get first OTU to last
+    except: # if the column is not an int try using a string
+        return leave_one_out_df.iloc[:, leave_one_out_df.columns.get_loc( "1" ):] # Get first OTU to last
+
+
+def intern_features( orderings ):
+    """
+    Replace the feature names of the orderings with integer ids, once for all of them
+    :param orderings: orderings x ranks array of feature names, None, NaN or "" where an ordering has no feature
+    :return: ( codes, features ) orderings x ranks id of each feature, -1 where there is none, and the name of each id
+    """
+    orderings = np.asarray( orderings, dtype=object )
+    missing = pd.isna( orderings ) | ( orderings == "" ) # empty cells of a table read back from tsv
+    codes, features = pd.factorize( np.where( missing, None, orderings.astype( str ) ).ravel() )
+    return codes.reshape( orderings.shape ), features
+
+
+def feature_bits( codes, num_features, top=None ):
+    """
+    The features of each ordering as a packed bit array
+    :param codes: orderings x ranks feature ids from intern_features()
+    :param num_features: number of feature ids
+    :param top: only the features of the first top ranks, None for all of them
+    :return: orderings x ceil( num_features / 8 ) uint8 array, bit f is set if the ordering has feature f
+    """
+    codes = codes[:, :top]
+    members = np.zeros( ( len( codes ), num_features ), dtype=bool )
+    order_index, rank_index = np.nonzero( codes >= 0 )
+    members[order_index, codes[order_index, rank_index]] = True
+    return np.packbits( members, axis=1 )
+
+
+def _popcount( bits ):
+    # number of set bits along the last axis
+    if( hasattr( np, "bitwise_count" ) ):
+        return np.bitwise_count( bits ).sum( axis=-1, dtype=np.int64 )
+    return _POPCOUNT_[bits].sum( axis=-1, dtype=np.int64 )
+
+
+def _jaccard_bits( bits, rows=None ):
+    # Jaccard coefficient of the packed feature sets of the rows with every set, NaN if both are empty
+    rows = np.arange( len( bits ) ) if rows is None else np.asarray( rows )
+    sizes = _popcount( bits )
+    intersection = np.empty( ( len( rows ), len( bits ) ), dtype=np.int64 )
+    # as many rows at a time as fit their intersections with every set in the budget
+    block_size = max( 1, _JACCARD_BUDGET_ // max( 1, len( bits ) * bits.shape[1] ) )
+    for start in range( 0, len( rows ), block_size ):
+        block = rows[start:start + block_size]
+        intersection[start:start + block_size] = _popcount( bits[block, None, :] & bits[None, :, :] )
+    union = sizes[rows, None] + sizes[None, :] - intersection
+    with np.errstate( divide="ignore", invalid="ignore" ):
+        return intersection / union
+
+
+def _condense( matrix ):
+    # upper triangle in the order of scipy.spatial.distance.squareform
+    return matrix[np.triu_indices( len( matrix ), 1 )]
+
+
+def jaccard_matrix( orderings, top=None, condensed=False ):
+    """
+    Jaccard coefficient between the feature sets of every pair of orderings, the same as jaccard_coefficient()
+    of each pair. Features are interned to ids once and every set is a packed bit array, the intersections of
+    all pairs are then counted with popcount.
+    :param orderings: orderings x ranks array of feature names, None or NaN where an ordering has no feature
+    :param top: only compare the features of the first top ranks, None for all of them
+    :param condensed: return the upper triangle as scipy's squareform does instead of the square matrix
+    :return: orderings x orderings array, or the condensed vector of it
+    """
+    codes, features = intern_features( orderings )
+    matrix = _jaccard_bits( feature_bits( codes, len( features ), top ) )
+    return _condense( matrix ) if condensed else matrix
+
+
+def jaccard_curves( orderings, tops ):
+    """
+    Jaccard coefficient of the top ranked features of every pair of orderings, for each number of top ranks
+    :param orderings: orderings x ranks array of feature names, None or NaN where an ordering has no feature
+    :param tops: numbers of top ranks ( ex. 1, 2, ..., 25 )
+    :return: len( tops ) x pairs array, each row condensed as in jaccard_matrix()
+    """
+    codes, features = intern_features( orderings )
+    return np.array( [ _condense( _jaccard_bits( feature_bits( codes, len( features ), top ) ) ) for top in tops ] )
+
+
+def _kappa_row( codes, present, row ):
+    # irr::kappa2 of one ordering with every ordering, only the features of that ordering can agree or be expected to
+    features, ranked = np.unique( codes[row][present[row]], return_inverse=True )
+    ranks = np.flatnonzero( present[row] )
+    # counts[b, f] of feature f at the ranks of row shared with ordering b, in row and in b
+    one_hot = np.zeros( ( codes.shape[1], len( features ) ) ) # counts are exact in float and use BLAS
+    one_hot[ranks, ranked] = 1
+    row_counts = present.astype( float ) @ one_hot
+    position = np.full( codes.max( initial=0 ) + 1, -1 )
+    position[features] = np.arange( len( features ) )
+    other = position[np.where( present, codes, 0 )]
+    order_index, rank_index = np.nonzero( present & present[row] & ( other >= 0 ) )
+    other_counts = np.bincount( order_index * len( features ) + other[order_index, rank_index],
+                                minlength=len( codes ) * len( features ) ).reshape( len( codes ), len( features ) )
+
+    shared = present[:, ranks].sum( axis=1 )
+    agree = ( ( codes[:, ranks] == codes[row, ranks] ) & present[:, ranks] ).sum( axis=1 )
+    with np.errstate( divide="ignore", invalid="ignore" ):
+        # kappa2 sums the expected agreement of each feature in extended precision
+        expected = ( row_counts * other_counts / shared[:, None] ).astype( np.longdouble )
+        chance = expected.sum( axis=1 ).astype( np.float64 ) / shared
+        kappa = ( agree / shared - chance ) / ( 1 - chance )
+    kappa[shared <= 0] = np.nan
+    return kappa, shared
+
+
+def pairwise_agreement( orderings, rows=None ):
+    """
+    Cohen's kappa and Jaccard coefficient between feature orderings and every other ordering.
+    Kappa is the same as irr::kappa2 of the two orderings, taking the feature at each rank as a rating and leaving
+    out ranks that either ordering is missing. The Jaccard coefficient is of the sets of features of each ordering.
+    One ordering is compared with all others at a time so memory grows with orderings x ranks, not with features.
+    :param orderings: orderings x ranks array of feature names, None or NaN where an ordering has no feature
+    :param rows: positions of the orderings to compare with every other, None for all of them
+    :return: ( kappa, agreement ) rows x orderings arrays, NaN for pairs without a rank they both have
+    """
+    codes, features = intern_features( orderings )
+    present = codes >= 0
+    rows = np.arange( len( codes ) ) if rows is None else np.asarray( rows )
+
+    kappa = np.empty( ( len( rows ), len( codes ) ) )
+    shared = np.empty( ( len( rows ), len( codes ) ), dtype=np.int64 )
+    for i, row in enumerate( rows ):
+        kappa[i], shared[i] = _kappa_row( codes, present, row )
+    agreement = np.where( shared > 0, _jaccard_bits( feature_bits( codes, len( features ) ), rows ), np.nan )
+
+    return kappa, agreement
+
+
 def main( leave_one_out_df, name, detailed=False ):
     """
     perform jaccard index on data to find most influential taxa.
@@ -73,37 +195,24 @@ def main( leave_one_out_df, name, detailed=False ):
     out_dir = f"{os.path.dirname(os.path.realpath(__file__))}/output"
     # allows for cleaner execution and use of relative paths
 
-    try:
-        leave_one_out_otu_df = leave_one_out_df.iloc[:, leave_one_out_df.columns.get_loc( 1 ):] # Get first OTU to last
-    except: # if the column is not an int try using a string
-        leave_one_out_otu_df = leave_one_out_df.iloc[:, leave_one_out_df.columns.get_loc( "1" ):] # Get first OTU to last
-    leave_one_out_otu_df = leave_one_out_otu_df.T
-    # get blank cells and replace them with NA
-    leave_one_out_otu_df = leave_one_out_otu_df.astype('str')
-    leave_one_out_otu_df = leave_one_out_otu_df.replace("nan", np.nan)
+    leave_one_out_otu_df = feature_orderings( leave_one_out_df )
+    # the table keeps the agreement of every ordering with the highest one, only its row is needed
+    j = len( leave_one_out_otu_df ) -1 # index of highest iteration selection
+    kappa_row, agreement_row = pairwise_agreement( leave_one_out_otu_df.to_numpy(), [ j ] )
 
     # create data frame in order to plot as well as pass data easier
     kappa_df = pd.DataFrame(
         columns=['conditioning', 'centrality', 'correl', 'threshold', 'select_iter', 'kappa', 'agreement'])
 
-    j = leave_one_out_otu_df.shape[1] -1 # index of highest iteration selection
-    for i in range(0, j): # iterate through columns
+    for i in range(0, j): # iterate through orderings
 
         _kConditioning = leave_one_out_df["conditioning"].iloc[i]
         _kCentrality = leave_one_out_df["centrality"].iloc[i]
         _kCorrel = leave_one_out_df["correlation"].iloc[i]
         _kThreshold = leave_one_out_df["keep threshold"].iloc[i]
         _kSelect_iter = leave_one_out_df["iteration select"].iloc[i]
-        _kKappa = None  # DEFINED LATER
-        _kAgreement = None  # DEFINED LATER
-
-        if (len( leave_one_out_otu_df.iloc[:, [i, j]].dropna()) >= 1):
-            _kKappa = (rirr.kappa2((leave_one_out_otu_df.iloc[:, [i, j]]).dropna())[4][0])
-            _kAgreement = jaccard_coefficient(leave_one_out_otu_df.iloc[:, i].dropna(), leave_one_out_otu_df.iloc[:, j].dropna())
-
-        elif (len( leave_one_out_otu_df.iloc[:, [i, j]].dropna()) <= 0):
-            _kKappa = np.nan
-            _kAgreement = np.nan
+        _kKappa = kappa_row[0, i]
+        _kAgreement = agreement_row[0, i]
 
         kappa_df.loc[i + 1] = [_kConditioning, _kCentrality, _kCorrel, _kThreshold, _kSelect_iter, _kKappa, _kAgreement]
     # It should be evident which result the kappa and agreement are being compared to
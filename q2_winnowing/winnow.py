@@ -6,18 +6,21 @@ import pandas as pd
 import os
 import shutil
 import csv
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, util as multiprocessing_util
 
 import qiime2
 from qiime2.plugin import Bool, Str, Int, Float, MetadataColumn, Set
 
 # Import different functions from each file
 from q2_winnowing.step1_3.pipeline import main as step1_3_main
+from q2_winnowing.step1_3.pipeline import prepare_data as step1_3_prepare_data, CorrelationCache
 from q2_winnowing.step4_5.decay_curve import main as step4_5_main
 from q2_winnowing.step6.permanova import main as step6_main
 from q2_winnowing.step7_9.jaccard import main as step7_9_main
 
 
-def _assemble_artifact_output( combined_metric_df, auc_df, permanova_df, jaccard_df ):
+def _assemble_artifact_output( combined_metric_df, auc_df, permanova_df, jaccard_df, iteration_outputs=None ):
     """
     This takes care of assembing a Winnowed artifact recognized by qiime2 from the different data
     generated throughout execution.
@@ -25,7 +28,10 @@ def _assemble_artifact_output( combined_metric_df, auc_df, permanova_df, jaccard
     :param auc_df: highest iteration auc selection
     :param permanova_df: highest iteration permanova selection
     :param jaccard_df: kappa and agreement values which are measures of consistency of feature ordering
-    :return: list( tuple( feature_df, AUC_df, Permanova_df ) ) Note the reasoning for this is explained in return
+    :param iteration_outputs: dict( iteration selection: ( AUC_df, Permanova_df ) ) of every iteration, only given
+        with keep_all
+    :return: list( tuple( feature_df, AUC_df, Permanova_df ) ) Note the reasoning for this is explained in return,
+        with keep_all the tuple also holds iteration_outputs
     """
 
     # Precautionary reset index of dataframes to be joined
@@ -46,6 +52,8 @@ def _assemble_artifact_output( combined_metric_df, auc_df, permanova_df, jaccard
 
     # Combine output in directory format
     artifact_winnowed = [ ( combined_metric_df, auc_df, permanova_df ) ]
+    if( iteration_outputs ):
+        artifact_winnowed = [ ( combined_metric_df, auc_df, permanova_df, iteration_outputs ) ]
         # this needs to be done since qiime2 has a check for whether len( output views ) == len( semantic types )
         # sadly this fails with tuples so as defined by qiime this is the workaround may be changed in updates
         # len( (1, 2, 3) ) = 3, len( ( (1, 2, 3) ) ) = 3, while len( [ (1, 2, 3) ] ) = 1
@@ -53,6 +61,110 @@ def _assemble_artifact_output( combined_metric_df, auc_df, permanova_df, jaccard
     return artifact_winnowed
 
 
+# data of the iteration pipelines when they run in worker processes, attached by _init_pipeline_worker
+_worker_memory = None
+_worker_data = None
+_worker_cache = None
+
+
+def _share_data( data ):
+    """
+    Copy the values of the prepared data into shared memory so worker processes can use them without each
+    receiving a pickled copy.
+    :param data: the read-only data from step1_3 prepare_data
+    :return: ( shared memory block, arguments for _init_pipeline_worker without the cache parameters )
+    """
+    values = data.to_numpy()
+    memory = shared_memory.SharedMemory( create=True, size=max( values.nbytes, 1 ) )
+    np.ndarray( values.shape, dtype=values.dtype, buffer=memory.buf )[:] = values
+    return memory, ( memory.name, values.shape, values.dtype.str, data.index, data.columns )
+
+
+def _init_pipeline_worker( memory_name, shape, dtype, index, columns, cache_params ):
+    """
+    Attach a worker process to the data shared by _share_data. Every worker keeps its own correlation cache.
+    """
+    global _worker_memory, _worker_data, _worker_cache
+    _worker_memory = shared_memory.SharedMemory( name=memory_name )
+    values = np.ndarray( shape, dtype=np.dtype( dtype ), buffer=_worker_memory.buf )
+    values.flags.writeable = False
+    _worker_data = pd.DataFrame( values, index=index, columns=columns, copy=False )
+    _worker_cache = CorrelationCache( *cache_params )
+    # workers leave through os._exit so atexit never runs, multiprocessing finalizers do when the pool shuts down
+    multiprocessing_util.Finalize( None, _close_pipeline_worker, exitpriority=10 )
+
+
+def _close_pipeline_worker():
+    """
+    Detach a worker process from the shared data when it exits, the parent unlinks the shared memory.
+    """
+    global _worker_memory, _worker_data, _worker_cache
+    _worker_data, _worker_cache = None, None # the frame views the shared buffer, it can not close while it does
+    _worker_memory.close()
+
+
+def _named_frame( name ):
+    """
+    step1_3 only reads the name of the dataframes once the data is prepared, this stands in for them in workers.
+    """
+    frame = pd.DataFrame()
+    frame.name = name
+    return frame
+
+
+def _iteration_pipeline( iteration_selected, name, pipeline_params, data=None, corr_cache=None ):
+    """
+    Run steps 1 to 3 for a single iteration selection.
+    :param iteration_selected: Number of features to select for each time the metric is called.
+    :param name: This is attached to all detailed output as a means of identification
+    :param pipeline_params: The parameters of _winnow_pipeline besides the data and iteration selection
+    :param data: The prepared data, None in a worker process to use the shared data
+    :param corr_cache: The CorrelationCache of the data, None in a worker process to use the worker's
+    :return: ( metric_result, important_features, abundances ) from _winnow_pipeline
+    """
+    if( data is None ):
+        data, corr_cache = _worker_data, _worker_cache
+
+    dataframe_1 = _named_frame( f"{name}_1_{iteration_selected}_" )
+    dataframe_2 = _named_frame( f"{name}_2_{iteration_selected}_" ) if pipeline_params["ab_comp"] else None
+
+    # <><><> Pass data to steps 1 to 3 <><><>
+    _verbose( step=1)
+    return _winnow_pipeline( dataframe_1=dataframe_1, dataframe_2=dataframe_2, iteration_select=iteration_selected,
+                             data=data, corr_cache=corr_cache, **pipeline_params )
+
+
+def _iteration_results( iteration_select, name, pipeline_params, data, corr_cache, n_jobs=1 ):
+    """
+    Run steps 1 to 3 for each iteration selection, in worker processes if n_jobs is more than 1.
+    Results always come back in the order of iteration_select.
+    :param iteration_select: The sorted iteration selections
+    :param name: This is attached to all detailed output as a means of identification
+    :param pipeline_params: The parameters of _winnow_pipeline besides the data and iteration selection
+    :param data: The prepared data from step1_3 prepare_data
+    :param corr_cache: The CorrelationCache of the data, only used when running in this process
+    :param n_jobs: Number of processes to run iteration selections in
+    :return: generator of ( iteration_selected, ( metric_result, important_features, abundances ) )
+    """
+    if( n_jobs <= 1 or len( iteration_select ) <= 1 ):
+        for iteration_selected in iteration_select:
+            yield iteration_selected, _iteration_pipeline( iteration_selected, name, pipeline_params, data, corr_cache )
+        return
+
+    memory, shared = _share_data( data )
+    cache_params = ( corr_cache.cond_type, corr_cache.corr_type, corr_cache.engine, corr_cache.jobs )
+    try:
+        with ProcessPoolExecutor( max_workers=min( n_jobs, len( iteration_select ) ),
+                                  initializer=_init_pipeline_worker, initargs=( *shared, cache_params ) ) as executor:
+            futures = [ executor.submit( _iteration_pipeline, iteration_selected, name, pipeline_params )
+                        for iteration_selected in iteration_select ]
+            for iteration_selected, future in zip( iteration_select, futures ):
+                yield iteration_selected, future.result()
+    finally:
+        memory.close()
+        memory.unlink()
+
+
 def _verify_output_folders():
     """
     Detailed methods rely on folders being available that can be written to
@@ -166,7 +278,11 @@ def process( infile1: biom.Table, sample_types: MetadataColumn, metric: Str, con
                smooth_type: Str="sliding_window", window_size: Int=3, centrality: Str=None,
                keep_threshold: Float=0.5, correlation: Str=None, weighted: Bool=False, correlation_prop: Str="both",
                evaluation: Str="kl_divergence", min_connected: Int=0,
-               detailed: Bool=False ) -> list:
+               detailed: Bool=False, correlation_engine: Str="pandas", correlation_jobs: Int=1,
+               centrality_engine: Str="networkx", centrality_pivots: Int=0, centrality_epsilon: Float=0.0,
+               centrality_confidence: Float=0.95, incremental_graph: Bool=False, n_jobs: Int=1,
+               keep_all: Bool=False, auc_engine: Str="PKNCA", permanova_engine: Str="vegan",
+               permanova_search: Str="all", permanova_alpha: Float=0.0, permanova_jobs: Int=1 ) -> list:
     """
     This is function corresponds with qiime2 function and takes care of file passing between all parts of plugin.
 
@@ -195,6 +311,26 @@ def process( infile1: biom.Table, sample_types: MetadataColumn, metric: Str, con
     :param min_connected: The minimum percentage of connectedness of the graph that should be considered before the winnowing process is aborted.
     :param detailed: Notifies plugin to output diagrams and csv files to each steps respective output folder throughout
         computation. If not enabled files will not be generated
+    :param correlation_engine: Engine used to build spearman and pearson correlations. pandas, or numpy ( BLAS ) in
+        float64 or float32 precision.
+    :param correlation_jobs: Number of processes used to build kendall and MIC correlations.
+    :param centrality_engine: Library used to find the graph centrality. networkx, or sparse ( scipy.sparse and csgraph ).
+    :param centrality_pivots: Number of sources sampled to estimate betweenness and closeness. 0 finds the exact centrality.
+    :param centrality_epsilon: If centrality_pivots is 0, the error in the estimated centrality to sample enough sources for.
+        0 finds the exact centrality.
+    :param centrality_confidence: The chance that every estimated centrality is within the error bound.
+    :param incremental_graph: Keep the correlation graph between iterations of the selection and only remove the
+        selected features from it, instead of building it again each iteration.
+    :param n_jobs: Number of processes to run steps 1 to 3 of the different iteration selections in.
+    :param keep_all: Run the AUC and PERMANOVA of every iteration selection and add them to the artifact, not only
+        those of the highest one.
+    :param auc_engine: Engine used to find the AUC percentiles. PKNCA ( R ), or numpy from a single cumulative sum.
+    :param permanova_engine: Engine used to calculate the PERMANOVA. vegan ( R adonis ), or numpy.
+    :param permanova_search: all to calculate the PERMANOVA of every AUC percentile, or knee to search for the knee of
+        F.model and only calculate those needed to find it.
+    :param permanova_alpha: If permanova_engine is numpy, stop the permutations of each PERMANOVA once the p value is
+        known to be above or below this significance level. 0 runs all 999 permutations.
+    :param permanova_jobs: Number of processes to run the PERMANOVAs of the AUC percentiles in.
     :return: return a list of single item with artifact see artifact generation for details on why this is done
     """
 
@@ -232,32 +368,37 @@ def process( infile1: biom.Table, sample_types: MetadataColumn, metric: Str, con
     metric_output = pd.DataFrame() # dataframe to write metrics new
     auc_output = pd.DataFrame() # Keep most accurate AUC
     permanova_output = pd.DataFrame() # Keep most accurate PERMANOVA value
+    successful = [] # iterations that generated a feature ordering, steps 4 to 6 are ran on these after
+    iteration_outputs = {} # AUC and PERMANOVA of each iteration when keep_all is used
+
+    # Convert input to dataframes, this is only done once and shared by every iteration selection
+    dataframe_1 = infile1.to_dataframe().to_dense()
+    dataframe_2 = None
+    if (ab_comp):
+        dataframe_2 = infile2.to_dataframe().to_dense()
+        if( len(dataframe_1) != len(dataframe_2) ):
+            raise Exception(f"Error: Dataframes must be the same size in order to correlate with sample metadata. "
+                            f"dataframe1: {len(dataframe_1)} != dataframe2: {len(dataframe_2)}")
+    # filtered by min_count and read-only, the correlations of the full data are also kept between iterations
+    data = step1_3_prepare_data( ab_comp, dataframe_1, dataframe_2, min_count )
+    corr_cache = CorrelationCache( conditioning, correlation, correlation_engine, correlation_jobs )
     _verbose( step=0.5 )
 
-    for iteration_selected in sorted( iteration_select ):
+    pipeline_params = dict( ab_comp=ab_comp, metric_name=metric, c_type=conditioning, min_count=min_count,
+                            total_select=total_select, pca_components=pca_components, smooth_type=smooth_type,
+                            window_size=window_size, centrality_type=centrality, keep_threshold=keep_threshold,
+                            correlation=correlation, weighted=weighted, corr_prop=correlation_prop,
+                            evaluation_type=evaluation, min_connected=min_connected, detailed=detailed,
+                            corr_engine=correlation_engine, corr_jobs=correlation_jobs, cent_engine=centrality_engine,
+                            cent_pivots=centrality_pivots, cent_epsilon=centrality_epsilon,
+                            cent_confidence=centrality_confidence, incremental=incremental_graph )
 
-        # Convert input to dataframes
-        dataframe_1 = infile1.to_dataframe().to_dense()
-        dataframe_1.name = f"{name}_1_{iteration_selected}_"
-        dataframe_2 = None
-        if (ab_comp):
-            dataframe_2 = infile2.to_dataframe().to_dense()
-            dataframe_2.name = f"{name}_2_{iteration_selected}_"
-            if( len(dataframe_1) != len(dataframe_2) ):
-                raise Exception(f"Error: Dataframes must be the same size in order to correlate with sample metadata. "
-                                f"dataframe1: {len(dataframe_1)} != dataframe2: {len(dataframe_2)}")
+    # steps 1 to 3 of each iteration selection are independent, their results are collected in order as they come in
+    for iteration_selected, ( metric_result, important_features, abundances ) in \
+            _iteration_results( sorted( iteration_select ), name, pipeline_params, data, corr_cache, n_jobs ):
 
         name_new = f"{name}_{iteration_selected}_" # will allow for easier iteration selection
 
-        # <><><> Pass data to steps 1 to 3 <><><>
-        _verbose( step=1)
-        metric_result, important_features, abundances = \
-            _winnow_pipeline( dataframe_1=dataframe_1, dataframe_2=dataframe_2, ab_comp=ab_comp, metric_name=metric,
-                              c_type=conditioning, min_count=min_count, total_select=total_select, iteration_select=iteration_selected,
-                              pca_components=pca_components, smooth_type=smooth_type, window_size=window_size,
-                              centrality_type=centrality, keep_threshold=keep_threshold, correlation=correlation,
-                              weighted=weighted, corr_prop=correlation_prop, evaluation_type=evaluation,
-                              min_connected=min_connected, detailed=detailed )
         # these are used in: Step7_9, Step4_5, Step6
 
         if (metric_output.empty):  # create a dataframe of import OTU's for jaccard step
@@ -273,27 +414,38 @@ def process( infile1: biom.Table, sample_types: MetadataColumn, metric: Str, con
 
         # check if a metric result was generated before attempting other steps, must be atleast 2 OTUs
         if( 1 in metric_result.columns and 2 in metric_result.columns ):
+            successful.append( ( iteration_selected, name_new, important_features, abundances ) )
+        else:
+            _verbose( step=1.5)
 
-            # <><><> Pass data to steps 4 to 5 <><><>
-            _verbose( step=4 )
-            auc_results, auc_parameters = \
-                _winnow_ordering( dataframe=important_features, name=name_new, detailed=detailed )
-            # these are used in: Step6, None
-            auc_output = auc_results
+    # Only the AUC and PERMANOVA of the last successful iteration reach the artifact, the others are only needed
+    # for their detailed output files or when all of them are kept.
+    if( not ( detailed or keep_all ) ):
+        successful = successful[-1:]
+    for iteration_selected, name_new, important_features, abundances in successful:
 
-            # Note: sample types correspond with abundances being passed
-            # print( abundances, auc_results, sample_types )
+        # <><><> Pass data to steps 4 to 5 <><><>
+        _verbose( step=4 )
+        auc_results, auc_parameters = \
+            _winnow_ordering( dataframe=important_features, name=name_new, detailed=detailed, engine=auc_engine )
+        # these are used in: Step6, None
+        auc_output = auc_results
 
-            # <><><> Pass data to step 6 <><><>
-            _verbose( step=6 )
-            permanova_results = \
-                _winnow_permanova( auc_ordering_df=auc_results, abundances_df=abundances, samples_df=sample_types,
-                                   centrality_type=centrality, name=name_new, detailed=detailed )
-            permanova_output = permanova_results
-            _verbose( step=6.5 )
+        # Note: sample types correspond with abundances being passed
+        # print( abundances, auc_results, sample_types )
 
-        else:
-            _verbose( step=1.5)
+        # <><><> Pass data to step 6 <><><>
+        _verbose( step=6 )
+        permanova_results = \
+            _winnow_permanova( auc_ordering_df=auc_results, abundances_df=abundances, samples_df=sample_types,
+                               centrality_type=centrality, name=name_new, detailed=detailed,
+                               engine=permanova_engine, search=permanova_search,
+                               alpha=( permanova_alpha if permanova_alpha > 0 else None ), n_jobs=permanova_jobs )
+        permanova_output = permanova_results
+        _verbose( step=6.5 )
+
+        if( keep_all ):
+            iteration_outputs[iteration_selected] = ( auc_results, permanova_results )
 
 
     # <><><>  Pass data to steps 7 to 9 <><><>
@@ -309,7 +461,8 @@ def process( infile1: biom.Table, sample_types: MetadataColumn, metric: Str, con
 
     # assemble output and return as artifact
     metric_output.replace(r'^\s*$', np.nan, regex=True, inplace=True) # Replace blank with Nan
-    artifact_directory = _assemble_artifact_output( metric_output, auc_output, permanova_output, jaccard_results )
+    artifact_directory = _assemble_artifact_output( metric_output, auc_output, permanova_output, jaccard_results,
+                                                    iteration_outputs if keep_all else None )
 
     return artifact_directory
 
@@ -318,8 +471,10 @@ def _winnow_pipeline( dataframe_1, dataframe_2, ab_comp: Bool=False, metric_name
                  c_type: Str=None, min_count: Int=3, total_select: Str=None, iteration_select: Str=None,
                  pca_components: Int=4, smooth_type: Str="sliding_window", window_size: Int=3, centrality_type: Str=None,
                  keep_threshold: Float=0.5, correlation: Str=None, weighted: Bool=False, corr_prop: Str="both",
-                 evaluation_type: Str=None, min_connected: Int=0, detailed: Bool=False
-                 ):
+                 evaluation_type: Str=None, min_connected: Int=0, detailed: Bool=False,
+                 corr_engine: Str="pandas", corr_jobs: Int=1, cent_engine: Str="networkx", cent_pivots: Int=0,
+                 cent_epsilon: Float=0.0, cent_confidence: Float=0.95, incremental: Bool=False,
+                 data=None, corr_cache=None ):
     """
     Note this function executes the main functionality of steps 1-3 in the pipeline of
     winnowing data.
@@ -348,6 +503,15 @@ def _winnow_pipeline( dataframe_1, dataframe_2, ab_comp: Bool=False, metric_name
     :param min_connected: The minimum percentage of connectedness of the graph that should be considered before the winnowing process is aborted.
     :param detailed: Notifies plugin to output diagrams and csv files to each steps respective output folder throughout
         computation. If not enabled files will not be generated
+    :param corr_engine: Engine used to build spearman and pearson correlations ( pandas, numpy, numpy_float32 ).
+    :param corr_jobs: Number of processes used to build kendall and MIC correlations.
+    :param cent_engine: Library used to find the graph centrality ( networkx, sparse ).
+    :param cent_pivots: Number of sources sampled to estimate betweenness and closeness, 0 for the exact centrality.
+    :param cent_epsilon: If cent_pivots is 0, the error in the estimated centrality to sample enough sources for.
+    :param cent_confidence: The chance that every estimated centrality is within the error bound.
+    :param incremental: Keep the graph between iterations of the selection and only remove the selected features.
+    :param data: The data prepared from the dataframes by a previous run, None to prepare it here.
+    :param corr_cache: The CorrelationCache shared by the runs on the same data, None for a new one.
     :return: This is the completed table of different taxa with their corresponding interactions to other taxa
          in their enviroment. This was computed through the use of methods such as: Abundance analysis, AUC analysis,
          F-Score ordering, PERMANOVA calculation, Jacobian matrices, and SEM analysis
@@ -366,7 +530,10 @@ def _winnow_pipeline( dataframe_1, dataframe_2, ab_comp: Bool=False, metric_name
                           pca_components=pca_components, smooth_type=smooth_type, window_size=window_size,
                           centrality_type=centrality_type, keep_threshold=keep_threshold, correlation=correlation,
                           weighted=weighted, corr_prop=corr_prop, evaluation_type=evaluation_type,
-                          min_connected=min_connected, detailed=detailed )
+                          min_connected=min_connected, detailed=detailed, corr_engine=corr_engine,
+                          corr_jobs=corr_jobs, cent_engine=cent_engine, cent_pivots=cent_pivots,
+                          cent_epsilon=cent_epsilon, cent_confidence=cent_confidence, incremental=incremental,
+                          data=data, corr_cache=corr_cache )
     else:
         metric_result, important_features, abundances = \
             step1_3_main( dataframe1=dataframe_1, dataframe2=None, ab_comp=False, metric_name=metric_name, c_type=c_type,
@@ -374,29 +541,34 @@ def _winnow_pipeline( dataframe_1, dataframe_2, ab_comp: Bool=False, metric_name
                           pca_components=pca_components, smooth_type=smooth_type, window_size=window_size,
                           centrality_type=centrality_type, keep_threshold=keep_threshold, correlation=correlation,
                           weighted=weighted, corr_prop=corr_prop, evaluation_type=evaluation_type,
-                          min_connected=min_connected, detailed=detailed )
+                          min_connected=min_connected, detailed=detailed, corr_engine=corr_engine,
+                          corr_jobs=corr_jobs, cent_engine=cent_engine, cent_pivots=cent_pivots,
+                          cent_epsilon=cent_epsilon, cent_confidence=cent_confidence, incremental=incremental,
+                          data=data, corr_cache=corr_cache )
 
 
     return ( metric_result, important_features, abundances )
 
 
-def _winnow_ordering( dataframe, name, detailed: Bool=False ):
+def _winnow_ordering( dataframe, name, detailed: Bool=False, engine: Str="PKNCA" ):
     """
     Each OTU is now ordered by centrality and the AUC of each is calculated.
     :param dataframe: Important features and OTUs that have been passed on to be ordered
     :param name: Each file generated by this step will be identified by this name
     :param detailed: Notifies plugin to output diagrams and csv files to each steps respective output folder throughout
         computation. If not enabled files will not be generated
+    :param engine: Engine used to find the AUC percentiles ( PKNCA, numpy ).
     :return: A dataframe representing each OTU ordered by centrality and calculated AUC
     """
 
     # Output files and Parameter files are both generated from this function
-    auc_result, auc_param = step4_5_main( dataframe , name=name, detailed=detailed )
+    auc_result, auc_param = step4_5_main( dataframe , name=name, detailed=detailed, engine=engine )
 
     return ( auc_result, auc_param )
 
 
-def _winnow_permanova( auc_ordering_df, abundances_df, samples_df, centrality_type, name, detailed=False ):
+def _winnow_permanova( auc_ordering_df, abundances_df, samples_df, centrality_type, name, detailed=False,
+                       engine="vegan", search="all", alpha=None, n_jobs=1 ):
     """
     100 Permanovas are ran, Each time adding in more OTUs at a 1% interval according to their order in step 5
     Essentially a sweet spot of additions will be reached and the most influential OTUs will be identified based off
@@ -407,12 +579,17 @@ def _winnow_permanova( auc_ordering_df, abundances_df, samples_df, centrality_ty
     :param name: Each file generated by this step will be identified by this name
     :param detailed: Notifies plugin to output diagrams and csv files to each steps respective output folder throughout
         computation. If not enabled files will not be generated
+    :param engine: Engine used to calculate the PERMANOVA ( vegan, numpy ).
+    :param search: AUC percentiles the PERMANOVA is calculated for ( all, knee ).
+    :param alpha: Significance level to stop the permutations at with the numpy engine, None runs all of them.
+    :param n_jobs: Number of processes to run the PERMANOVAs in.
     :return: a dataframe organised to represent the most influential OTUs
     """
 
     # Permanova results are generated here
     permanova_result = step6_main( auc_ordering_df, abundances_df, samples_df, centrality_type, name=name,
-                                   detailed=detailed )
+                                   detailed=detailed, engine=engine, search=search, alpha=alpha,
+                                   n_jobs=n_jobs )
 
     return permanova_result
 
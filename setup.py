@@ -18,7 +18,7 @@ setup(
     version=__version__,
     packages=find_packages(),
     package_data={"": ["auc.html","auc_ordered.tsv","feature_ordered.html","feature_ordered.tsv",
-                       "permanova.html","permanova_ordered.tsv","index.html",
+                       "permanova.html","permanova_ordered.tsv","index.html","jaccard.html",
                        "button_formatting.css","dataframe_formatting.css","frame_formatting.css","page_formatting.css"],
                   "q2_winnowing": ["citations.bib"]},
     include_package_data=True,
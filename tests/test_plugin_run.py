@@ -24,6 +24,30 @@ class PluginRunTests( TestCase ):
                        f"Raised Exception - {e}, line: {sys.exc_info()[-1].tb_lineno} - unexpectedly.")
 
 
+    def test_plugin_F_gc_kl_ao_cl_sp_bo_jobs(self):
+        try:
+            process( infile1=self.testing_data, ab_comp=False, infile2=None, sample_types=self.testing_metadata,
+                     metric="graph_centrality", evaluation="kl_divergence", min_count=3, conditioning="add_one",
+                     total_select=25, iteration_select={16,64,128}, centrality="closeness", keep_threshold=0.5,
+                     correlation="spearman", weighted=True, correlation_prop="both", detailed=False, n_jobs=2 )
+        except Exception as e:
+            self.fail( f"param ( False, graph_centrality, kl_divergence, add_one, closeness, spearman, both, n_jobs=2 ) "
+                       f"Raised Exception - {e}, line: {sys.exc_info()[-1].tb_lineno} - unexpectedly.")
+
+
+    def test_plugin_F_gc_kl_ao_dg_sp_bo_keep_all(self):
+        try:
+            artifact = process( infile1=self.testing_data, ab_comp=False, infile2=None, sample_types=self.testing_metadata,
+                                metric="graph_centrality", evaluation="kl_divergence", min_count=3, conditioning="add_one",
+                                total_select=25, iteration_select={64,128}, centrality="degree", keep_threshold=0.5,
+                                correlation="spearman", weighted=True, correlation_prop="both", detailed=False,
+                                keep_all=True )
+        except Exception as e:
+            self.fail( f"param ( False, graph_centrality, kl_divergence, add_one, degree, spearman, both, keep_all ) "
+                       f"Raised Exception - {e}, line: {sys.exc_info()[-1].tb_lineno} - unexpectedly.")
+        self.assertListEqual( sorted( artifact[0][3] ), [ 64, 128 ] )
+
+
     def test_plugin_F_gc_kl_he_ei_sp_ne(self):
         try:
             process( infile1=self.testing_data, ab_comp=False, infile2=None, sample_types=self.testing_metadata,
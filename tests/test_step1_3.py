@@ -1,10 +1,17 @@
 
 from unittest import TestCase, main as unittest_main
 import os
+import threading
 import pandas as pd
 import numpy as np
+import networkx
 
 from q2_winnowing.step1_3.pipeline import main as step1_3_main
+from q2_winnowing.step1_3.pipeline import CorrelationCache, condition, find_correlation, prepare_data
+from q2_winnowing.step1_3.correlation import engine_correlation, kendall_correlation, mic_correlation
+from q2_winnowing.step1_3.graph import GraphState, edge_adjacency, edge_graph, threshold_edges
+from q2_winnowing.step1_3.centrality import approximate_centrality, edge_structure, largest_component, pivot_count, \
+    selection_stability, sparse_centrality
 
 class Step1_3Tests( TestCase ):
     # <><><> Testing class for Step 1 to 3 <><><>
@@ -203,6 +210,190 @@ class Step1_3Tests( TestCase ):
         )
 
 
+    def test_step1_3_correlation_cache(self):
+
+        data_in = pd.read_csv( self.testing_data["degree"][0] ).iloc[:, -60:]
+
+        for c_type, expected_computed in ( ("add_one", 1), ("hellinger", 2) ):
+            corr_cache = CorrelationCache( c_type, "spearman" )
+            corr_cache.correlation( data_in )
+            remaining = data_in.drop( data_in.columns[:10], axis=1 )
+            # the cache should give the same matrix as building it from the remaining columns
+            pd.testing.assert_frame_equal(
+                corr_cache.correlation( remaining ),
+                find_correlation( condition( remaining, c_type ), "spearman" )
+            )
+            self.assertEqual( corr_cache.computed, expected_computed )
+
+
+    def test_step1_3_correlation_engine(self):
+
+        data_in = condition( pd.read_csv( self.testing_data["degree"][0] ).iloc[:, -300:], "add_one" )
+
+        for corr_type in ( "spearman", "pearson" ):
+            expected = data_in.corr( corr_type )
+            # numpy engine should agree with pandas up to rounding, float32 to single precision
+            for engine, decimal in ( ("numpy", 12), ("numpy_float32", 5) ):
+                result = engine_correlation( data_in, corr_type, engine, block_size=64 )
+                self.assertListEqual( list(result.columns), list(expected.columns) )
+                np.testing.assert_array_almost_equal( result.to_numpy(), expected.to_numpy(), decimal )
+
+
+    def test_step1_3_kendall_correlation(self):
+
+        data_in = condition( pd.read_csv( self.testing_data["degree"][0] ).iloc[:, -60:], "add_one" )
+        data_in["constant"] = 1.0
+
+        expected = data_in.corr( "kendall" )
+        # blocks spread over processes should give exactly the same matrix as pandas
+        for jobs, block_size in ( (1, 512), (2, 16) ):
+            pd.testing.assert_frame_equal( kendall_correlation( data_in, jobs, block_size ), expected )
+
+
+    def test_step1_3_mic_correlation(self):
+
+        data_in = condition( pd.read_csv( self.testing_data["degree"][0] ).iloc[:, -40:], "add_one" )
+
+        expected = mic_correlation( data_in, 1, 40 ) # a single tile is one pstats call over every feature
+        progress = []
+        result = mic_correlation( data_in, 2, 16, progress=lambda done, total: progress.append( (done, total) ) )
+        pd.testing.assert_frame_equal( result, expected )
+        self.assertEqual( progress[-1], (6, 6) )
+
+        cancel = threading.Event()
+        cancel.set()
+        with self.assertRaises( Exception ):
+            mic_correlation( data_in, 1, 16, cancel=cancel )
+
+
+
+    def test_step1_3_threshold_edges(self):
+
+        data_in = pd.read_csv( self.testing_data["degree"][0] ).iloc[:, -120:]
+        w_corr_df = find_correlation( condition( data_in, "add_one" ), "spearman" )
+
+        # the graph built from the melted matrix, as it was done before threshold_edges()
+        temp = abs( 1 - abs( w_corr_df ) )
+        temp[temp >= 0.5] = 1
+        temp.insert( 0, 'var1', list( temp.index ) )
+        df_b = pd.melt( temp, 'var1', var_name='var2', value_name='edge' )
+        df_b = df_b.loc[( (df_b['edge'] <= 0.5) & (df_b['edge'] >= 0.0) ), :]
+        expected = networkx.from_pandas_edgelist( df_b, 'var1', 'var2', 'edge' )
+
+        first, second, distance = threshold_edges( w_corr_df, 0.5, 'none' )
+        result = edge_graph( w_corr_df.index, first, second, distance, 'edge' )
+        self.assertListEqual( list( result.nodes ), list( expected.nodes ) )
+        self.assertListEqual( list( result.edges( data=True ) ), list( expected.edges( data=True ) ) )
+
+        adjacency = edge_adjacency( len( w_corr_df.index ), first, second, distance )
+        self.assertEqual( adjacency.nnz, 2 * len( first ) - np.count_nonzero( first == second ) )
+        self.assertEqual( ( adjacency != adjacency.T ).nnz, 0 )
+
+
+
+    def test_step1_3_sparse_centrality(self):
+
+        data_in = pd.read_csv( self.testing_data["degree"][0] ).iloc[:, -150:]
+        w_corr_df = find_correlation( condition( data_in, "add_one" ), "spearman" )
+        first, second, distance = threshold_edges( w_corr_df, 0.5, 'none' )
+        graph = edge_graph( w_corr_df.index, first, second, distance )
+
+        nodes, adjacency = edge_structure( first, second )
+        labels = np.asarray( w_corr_df.index, dtype=object )[nodes]
+        self.assertListEqual( list( labels ), list( graph.nodes ) )
+
+        component = largest_component( adjacency )
+        largest_subgraph = graph.subgraph( max( networkx.connected_components( graph ), key=len ) )
+        self.assertSetEqual( set( labels[component] ), set( largest_subgraph.nodes ) )
+
+        # networkx stops its eigenvector power iteration at a tolerance of 1e-6 per node
+        expected_functions = ( ("degree", networkx.degree_centrality, 15), ("closeness", networkx.closeness_centrality, 15),
+                               ("betweenness", networkx.betweenness_centrality, 15),
+                               ("eigenvector", networkx.eigenvector_centrality, 4) )
+        for cent_type, networkx_centrality, decimal in expected_functions:
+            expected = networkx_centrality( largest_subgraph )
+            result = sparse_centrality( adjacency[component][:, component], cent_type )
+            np.testing.assert_array_almost_equal( result, [ expected[node] for node in labels[component] ], decimal )
+
+
+
+    def test_step1_3_approximate_centrality(self):
+
+        data_in = pd.read_csv( self.testing_data["degree"][0] ).iloc[:, -300:]
+        w_corr_df = find_correlation( condition( data_in, "add_one" ), "spearman" )
+        first, second, distance = threshold_edges( w_corr_df, 0.5, 'none' )
+        nodes, adjacency = edge_structure( first, second )
+        component = largest_component( adjacency )
+        adjacency = adjacency[component][:, component]
+        num_nodes = adjacency.shape[0]
+
+        self.assertEqual( pivot_count( 100, 0.1, 0.95 ), 415 ) # ln( 2 * 100 / 0.05 ) / ( 2 * 0.1^2 )
+        for confidence in ( 0, 1, 1.5, -0.5 ):
+            self.assertRaises( Exception, pivot_count, 100, 0.1, confidence )
+        self.assertRaises( Exception, pivot_count, 100, -0.1, 0.95 )
+
+        for cent_type in ( "betweenness", "closeness" ):
+            exact = sparse_centrality( adjacency, cent_type )
+            # sampling every node is the exact centrality
+            np.testing.assert_array_equal( approximate_centrality( adjacency, cent_type, num_nodes )[0], exact )
+
+            estimate, lower, upper = approximate_centrality( adjacency, cent_type, num_nodes // 2 )
+            self.assertTrue( np.all( lower <= exact + 1e-12 ) and np.all( exact <= upper + 1e-12 ) )
+
+        centrality_df = pd.DataFrame( {'metric': [0.9, 0.5, 0.4, 0.1], 'lower': [0.8, 0.35, 0.3, 0.0],
+                                       'upper': [1.0, 0.6, 0.5, 0.2]}, index=['a', 'b', 'c', 'd'] )
+        self.assertEqual( selection_stability( centrality_df, 2 ), 0.5 ) # only a is above every upper bound of c and d
+
+
+
+    def test_step1_3_graph_state(self):
+
+        data_in = pd.read_csv( self.testing_data["degree"][0] ).iloc[:, -150:]
+        corr_cache = CorrelationCache( "add_one", "spearman" )
+        w_corr_df = corr_cache.correlation( data_in )
+        graph_state = GraphState()
+        graph_state.reset( w_corr_df.index, *threshold_edges( w_corr_df, 0.5, 'none' ), corr_cache.computed )
+
+        removed = list( graph_state.largest_component()[1][:20] )
+        graph_state.remove( removed )
+        remaining = data_in.drop( removed, axis=1 )
+        self.assertTrue( graph_state.is_current( corr_cache, remaining ) )
+
+        # the state left after removing the features should be the graph built from the remaining features
+        w_corr_df = find_correlation( condition( remaining, "add_one" ), "spearman" )
+        graph = edge_graph( w_corr_df.index, *threshold_edges( w_corr_df, 0.5, 'none' ) )
+        largest_subgraph = graph.subgraph( max( networkx.connected_components( graph ), key=len ) )
+
+        total_nodes, labels, first, second, distance = graph_state.largest_component()
+        self.assertEqual( total_nodes, graph.number_of_nodes() )
+        self.assertSetEqual( set( labels ), set( largest_subgraph.nodes ) )
+        self.assertSetEqual( set( map( frozenset, edge_graph( labels, first, second, distance ).edges ) ),
+                             set( map( frozenset, largest_subgraph.edges ) ) )
+
+
+
+    def test_step1_3_prepare_data(self):
+
+        data_in = pd.read_csv( self.testing_data["degree"][0] ).iloc[:, :300]
+        data_in.name = "TESTING_FRAME"
+        data = prepare_data( False, data_in, None, 3 )
+        self.assertFalse( data.to_numpy().flags.writeable )
+
+        # every iteration size shares the data and correlations, the full matrix is only built once
+        corr_cache = CorrelationCache( "add_one", "spearman" )
+        for iteration_select in [ 8, 32 ]:
+            arguments = dict( metric_name="graph_centrality", c_type="add_one", min_count=3, total_select=32,
+                              iteration_select=iteration_select, pca_components=4, smooth_type="sliding_window",
+                              window_size=3, centrality_type="degree", keep_threshold=0.5, correlation="spearman",
+                              weighted=False, corr_prop="both", evaluation_type="kl_divergence", min_connected=0 )
+            shared_result = step1_3_main( False, data_in, None, data=data, corr_cache=corr_cache, **arguments )
+            separate_in = data_in.copy()
+            separate_in.name = "TESTING_FRAME"
+            features_result = step1_3_main( False, separate_in, None, **arguments )
+
+            self.assertTrue( shared_result[0].drop( columns="run time" ).equals( features_result[0].drop( columns="run time" ) ) )
+            self.assertTrue( shared_result[1].equals( features_result[1] ) )
+        self.assertEqual( corr_cache.computed, 1 )
 
 
 if __name__ == '__main__':
@@ -116,6 +116,25 @@ class Step4_5Tests( TestCase ):
         )
 
 
+    def test_step4_5_numpy_engine(self):
+
+        for centrality in [ "degree", "closeness", "betweeness" ]:
+            important_features_path, parameter_path, auc_path = self.testing_data[centrality]
+            important_features_in = pd.read_csv( important_features_path )
+            auc_result, auc_param = step4_5_main( important_features_in, "", False, engine="numpy" )
+            parameter_out = pd.read_csv( parameter_path, index_col=0 )
+            auc_out = pd.read_csv( auc_path, index_col=0 )
+
+            np.testing.assert_array_equal(
+                auc_result.to_numpy().astype(object),
+                auc_out.to_numpy().astype(object),
+            )
+            np.testing.assert_array_almost_equal(
+                auc_param.to_numpy().astype(type(0.0)),
+                parameter_out.to_numpy().astype(type(0.0)),
+                decimal=15
+            )
+
 
 if __name__ == '__main__':
     unittest_main()
\ No newline at end of file
@@ -3,9 +3,13 @@ from unittest import TestCase, main as unittest_main
 import pandas as pd
 import numpy as np
 import os
+import glob
+from unittest import mock
+from scipy.spatial.distance import squareform
 
 from q2_winnowing.step6.permanova import main as step6_main
 from q2_winnowing.step6.permanova import _convert_to_dist_hel_matrix as array_to_hel
+from q2_winnowing.step6.permanova import adonis, hellinger_distance, HellingerDistance, knee_search
 
 class Step6Tests( TestCase ):
     # <><><> Testing class for Step 6 <><><>
@@ -78,6 +82,17 @@ class Step6Tests( TestCase ):
         np.testing.assert_array_equal( array_to_hel_output, test_hel_out )
 
 
+    def test_step6_convert_linear_to_hel_buffer(self):
+
+        test_array_in = np.random.default_rng( 0 ).random( 45 )
+        buffer = np.full( ( 10, 10 ), np.nan ) # left over values must not show
+        array_to_hel_output = array_to_hel( test_array_in, 10, out=buffer )
+
+        self.assertIs( array_to_hel_output, buffer )
+        np.testing.assert_array_equal( array_to_hel_output, squareform( test_array_in ) )
+        np.testing.assert_array_equal( array_to_hel_output, array_to_hel_output.T )
+
+
     def test_step6_convert_linear_to_hel_fail(self):
 
         test_array_in = [1,2,3,4,5,6,7]
@@ -127,5 +142,141 @@ class Step6Tests( TestCase ):
             )
 
 
+    def test_step6_main_numpy(self):
+
+        permanova_output = step6_main( self.auc_df_in, self.abundances_df_in, self.samples_df_in, "", False,
+                                       engine="numpy" )
+
+        self.assertListEqual( list( permanova_output["test"] ), list( self.permanova_df_out["test"] ) )
+        self.assertListEqual( list( permanova_output["N.taxa"].astype(int) ), list( self.permanova_df_out["N.taxa"] ) )
+        for column in [ "SumsOfSqs", "MeanSqs", "F.model", "R2", "F.model.scale" ]:
+            np.testing.assert_allclose( permanova_output[column].astype(float), self.permanova_df_out[column],
+                                        rtol=1e-13 )
+        self.assertTrue( ( ( permanova_output["Pval"] > 0 ) & ( permanova_output["Pval"] <= 1 ) ).all() )
+        self.assertTrue( ( permanova_output["N.perm"] == 999 ).all() )
+
+
+    def test_step6_main_numpy_detailed(self):
+        # the figures of the numpy engine do not start R either
+        out_dir = f"{os.path.dirname(os.path.realpath(__file__))}/../q2_winnowing/step6/output"
+        with mock.patch( "q2_winnowing._rbridge._start", side_effect=AssertionError( "R was started" ) ):
+            step6_main( self.auc_df_in, self.abundances_df_in, self.samples_df_in, "degree", "test_numpy_detailed",
+                        True, engine="numpy" )
+        self.assertTrue( os.path.exists( f"{out_dir}/test_numpy_detailed_F-Score_AUC_degree.png" ) )
+        for output in glob.glob( f"{out_dir}/test_numpy_detailed_*" ):
+            os.remove( output )
+
+
+    def test_step6_main_shared_subsets(self):
+
+        permanova_output = step6_main( self.auc_df_in, self.abundances_df_in, self.samples_df_in, "", False,
+                                       engine="numpy" )
+
+        # percentiles with the same number of taxa are only tested once, so even the p values are the same
+        for _, rows in permanova_output.groupby( "N.taxa" ):
+            self.assertEqual( len( rows[[ "SumsOfSqs", "F.model", "R2", "Pval" ]].drop_duplicates() ), 1 )
+
+
+    def test_step6_main_jobs(self):
+
+        permanova_serial = step6_main( self.auc_df_in, self.abundances_df_in, self.samples_df_in, "", False,
+                                       engine="numpy" )
+        permanova_pool = step6_main( self.auc_df_in, self.abundances_df_in, self.samples_df_in, "", False,
+                                     engine="numpy", n_jobs=2 )
+
+        # every subset has its own seed so even the p values are the same
+        pd.testing.assert_frame_equal( permanova_pool, permanova_serial )
+
+
+    def test_step6_knee_search(self):
+
+        # a drop in F.model that is steepest from row 36 to row 37
+        f_models = 1 / ( 1 + np.exp( np.arange( 100 ) - 36.5 ) )
+        tested = []
+        knee = knee_search( lambda row: tested.append( row ) or f_models[row], 100 )
+
+        self.assertEqual( knee, 37 )
+        self.assertEqual( knee, np.argmax( np.abs( np.diff( f_models ) ) ) + 1 )
+        self.assertLessEqual( len( tested ), 15 )
+
+
+    def test_step6_main_knee(self):
+
+        permanova_all = step6_main( self.auc_df_in, self.abundances_df_in, self.samples_df_in, "", False,
+                                    engine="numpy" )
+        permanova_knee = step6_main( self.auc_df_in, self.abundances_df_in, self.samples_df_in, "", False,
+                                     engine="numpy", search="knee" )
+
+        self.assertEqual( len( permanova_knee ), 100 )
+        self.assertEqual( permanova_knee["knee"].sum(), 1 )
+        self.assertListEqual( list( permanova_knee["N.taxa"] ), list( permanova_all["N.taxa"] ) )
+        # rows that were not tested are left empty, the tested ones are the same as when all are tested
+        tested = permanova_knee["F.model"].notna()
+        self.assertLess( permanova_knee.loc[ tested, "N.taxa" ].nunique(), 16 )
+        np.testing.assert_allclose( permanova_knee.loc[ tested, "F.model" ].astype(float),
+                                    permanova_all.loc[ tested, "F.model" ].astype(float), rtol=1e-13 )
+        self.assertTrue( permanova_knee.loc[ permanova_knee["knee"], "F.model" ].notna().all() )
+
+
+    def test_step6_adonis_permutations(self):
+
+        distance = hellinger_distance( self.abundances_df_in.iloc[:, :5].to_numpy() )
+        sample_types = self.samples_df_in["Type"].to_numpy()
+        num_samples = len( sample_types )
+        permutations = np.random.default_rng( 0 ).permuted( np.tile( np.arange( num_samples ), ( 99, 1 ) ), axis=1 )
+        sums_of_sqs, mean_sqs, f_model, r2, p_value, num_permutations = adonis( distance, sample_types, permutations )
+
+        # the pseudo F of each permutation straight from the permuted centred distances as adonis finds it
+        squared = distance ** 2
+        centred = -( squared - squared.mean( axis=1 )[:, None] ) / 2
+        design, _ = np.linalg.qr( np.column_stack( ( np.ones( num_samples ), sample_types == sample_types[0] ) ) )
+        hat = design @ design.T
+        f_perms = [ np.sum( centred[order][:, order] * hat ) /
+                    ( np.sum( centred[order][:, order] * ( np.eye( num_samples ) - hat ) ) / ( num_samples - 2 ) )
+                    for order in permutations ]
+
+        self.assertAlmostEqual( sums_of_sqs, np.sum( centred * hat ) )
+        self.assertAlmostEqual( r2, sums_of_sqs / np.trace( centred ) )
+        self.assertEqual( p_value, ( np.sum( np.array( f_perms ) >= f_model - np.sqrt( np.finfo( float ).eps ) ) + 1 ) / 100 )
+        self.assertEqual( num_permutations, 99 )
+
+
+    def test_step6_adonis_sequential(self):
+
+        distance = hellinger_distance( self.abundances_df_in.to_numpy() )
+        sample_types = self.samples_df_in["Type"].to_numpy()
+        shuffled_types = np.random.default_rng( 0 ).permutation( sample_types )
+
+        # the same permutations are tested until the p value is known to be below alpha
+        full = adonis( distance, sample_types, 999, seed=0 )
+        sequential = adonis( distance, sample_types, 999, seed=0, alpha=0.05 )
+        self.assertEqual( sequential[:4], full[:4] )
+        self.assertLess( full[4], 0.05 )
+        self.assertLess( sequential[4], 0.05 )
+        self.assertLess( sequential[5], 999 )
+
+        # without any difference between the types h permutations are as large quickly
+        full = adonis( distance, shuffled_types, 999, seed=0 )
+        sequential = adonis( distance, shuffled_types, 999, seed=0, alpha=0.05 )
+        self.assertGreater( full[4], 0.05 )
+        self.assertGreater( sequential[4], 0.05 )
+        self.assertLess( sequential[5], 100 )
+
+        # alpha has to be a significance level the p value can fall on either side of
+        for alpha in ( 0, 1, 1.5, -0.05 ):
+            self.assertRaises( Exception, step6_main, self.auc_df_in, self.abundances_df_in, self.samples_df_in, "",
+                               False, engine="numpy", alpha=alpha )
+
+    def test_step6_hellinger_distance_incremental(self):
+
+        data = self.abundances_df_in.to_numpy()
+        distances = HellingerDistance( data )
+        # growing subsets are updated, a smaller one starts over
+        for columns in [ 1, 5, 20, len( data[0] ), 3 ]:
+            distance = distances.distance( columns )
+            np.testing.assert_allclose( distance, hellinger_distance( data[:, :columns] ), atol=1e-7 )
+            np.testing.assert_array_equal( distance, distance.T )
+
+
 if __name__ == '__main__':
     unittest_main()
\ No newline at end of file
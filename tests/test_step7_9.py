@@ -3,9 +3,11 @@ from unittest import TestCase, main as unittest_main
 import pandas as pd
 import numpy as np
 import os
+from unittest import mock
 
 from q2_winnowing.step7_9.jaccard import main as step7_9_main
-from q2_winnowing.step7_9.jaccard import jaccard_coefficient
+from q2_winnowing.step7_9.jaccard import jaccard_coefficient, pairwise_agreement, jaccard_matrix, jaccard_curves
+from scipy.spatial.distance import squareform
 
 class Step7_9Tests( TestCase ):
     # <><><> Testing class for Step 7 to 9 <><><>
@@ -78,6 +80,48 @@ class Step7_9Tests( TestCase ):
 
 
 
+    def test_step7_9_pairwise_agreement(self):
+        orderings = [ [ "a", "b", "c", "d" ],
+                      [ "a", "c", "b", np.nan ],
+                      [ "a", "b", "c", "d" ],
+                      [ np.nan, np.nan, np.nan, np.nan ] ]
+        kappa, agreement = pairwise_agreement( orderings )
+
+        np.testing.assert_array_equal( kappa, kappa.T )
+        np.testing.assert_array_equal( agreement, agreement.T )
+        np.testing.assert_array_equal( np.diag( kappa )[:3], 1 )
+        # ranks 1 to 3 are shared, only the first agrees: ( 1/3 - 1/3 ) / ( 1 - 1/3 )
+        np.testing.assert_almost_equal( kappa[0, 1], 0.0 )
+        np.testing.assert_almost_equal( agreement[0, 1], jaccard_coefficient( "abcd", "acb" ) )
+        # nothing is shared with an empty ordering
+        self.assertTrue( np.isnan( kappa[3] ).all() and np.isnan( agreement[3] ).all() )
+        # only the rows asked for are compared with every ordering
+        kappa_rows, agreement_rows = pairwise_agreement( orderings, [ 2, 0 ] )
+        np.testing.assert_array_equal( kappa_rows, kappa[[ 2, 0 ]] )
+        np.testing.assert_array_equal( agreement_rows, agreement[[ 2, 0 ]] )
+
+
+    def test_step7_9_jaccard_matrix(self):
+        orderings = [ [ "a", "b", "c", "d", "e", "f", "g", "h", "i" ],
+                      [ "i", "a", "c", "x", "" , np.nan, None, None, None ],
+                      [ "b", "d", "f", "h", "j", "k", "l", "m", "n" ] ]
+        sets = [ "abcdefghi", "iacx", "bdfhjklmn" ]
+        matrix = jaccard_matrix( orderings )
+        for i in range( len( sets ) ):
+            for j in range( len( sets ) ):
+                np.testing.assert_almost_equal( matrix[i, j], jaccard_coefficient( sets[i], sets[j] ) )
+        np.testing.assert_array_equal( jaccard_matrix( orderings, condensed=True ), squareform( matrix, checks=False ) )
+        # a budget too small for a single row still compares one row at a time
+        with mock.patch( "q2_winnowing.step7_9.jaccard._JACCARD_BUDGET_", 1 ):
+            np.testing.assert_array_equal( jaccard_matrix( orderings ), matrix )
+
+        # prefix curves are the matrix of the top ranked features
+        curves = jaccard_curves( orderings, [ 1, 2, 9 ] )
+        np.testing.assert_array_equal( curves[0], [ 0, 0, 0 ] )
+        np.testing.assert_almost_equal( curves[1], [ 1/3, 1/3, 0 ] )
+        np.testing.assert_array_equal( curves[2], jaccard_matrix( orderings, condensed=True ) )
+
+
     def test_step7_9_main(self):
 
         for metric_results_path, jaccard_path in self.testing_data:
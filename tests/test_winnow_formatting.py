@@ -1,7 +1,9 @@
 
 import pkg_resources
+import tempfile
 import unittest
 import uuid
+import os
 
 import pandas as pd
 import qiime2.core.archive as archive
@@ -9,7 +11,8 @@ from qiime2.sdk import Artifact
 
 from q2_winnowing.plugin_setup import Winnowed
 from q2_winnowing._format import ( WinnowedDirectoryFormat, WinnowedFeatureOrderingFormat,
-                                   WinnowedAucOrderingFormat, WinnowedPermanovaOrderingFormat )
+                                   WinnowedAucOrderingFormat, WinnowedPermanovaOrderingFormat,
+                                   WinnowedTableFormat, WinnowedBinaryDirectoryFormat )
 import q2_winnowing._transformer
 import q2_winnowing._type
 
@@ -111,6 +114,29 @@ class WinnowedFormatTests(unittest.TestCase):
         # <><> END OF FUNCTION <><>
 
 
+    def test_sniff_line_count(self):
+        fp = pkg_resources.resource_filename(
+            'q2_winnowing.tests', 'sample_data/test_in_dir')
+        with open( os.path.join( fp, "auc_ordered.tsv" ) ) as f:
+            auc_text = f.read()
+
+        self.assertTrue( WinnowedAucOrderingFormat( os.path.join( fp, "auc_ordered.tsv" ), mode="r" ).sniff() )
+        self.assertTrue( WinnowedPermanovaOrderingFormat( os.path.join( fp, "permanova_ordered.tsv" ), mode="r" ).sniff() )
+        with tempfile.TemporaryDirectory() as tmp:
+            # the last line does not need a line break
+            auc_fp = os.path.join( tmp, "auc_ordered.tsv" )
+            with open( auc_fp, "w" ) as f:
+                f.write( auc_text.rstrip("\n") )
+            self.assertTrue( WinnowedAucOrderingFormat( auc_fp, mode="r" ).sniff() )
+            # anything longer than the 100 AUC percentiles is rejected without reading all of it
+            with open( auc_fp, "w" ) as f:
+                f.write( auc_text * 1000 )
+            self.assertFalse( WinnowedAucOrderingFormat( auc_fp, mode="r" ).sniff() )
+
+        # <><> END OF FUNCTION <><>
+
+
+
     def test_reader_transformer(self):
         fp = pkg_resources.resource_filename(
             'q2_winnowing.tests', 'sample_data/test_in_dir')
@@ -141,6 +167,41 @@ class WinnowedFormatTests(unittest.TestCase):
 
 
 
+    def test_reader_transformer_ragged(self):
+        # rows with fewer ordered features than the widest row are padded with NaN
+        fp = pkg_resources.resource_filename(
+            'q2_winnowing.tests', 'sample_data/test_in_dir/feature_ordered.tsv')
+        with open( fp ) as f:
+            lines = f.read().splitlines()
+        lines[2] = "\t".join( lines[2].split("\t")[:-5] )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ragged_fp = os.path.join( tmp, "feature_ordered.tsv" )
+            with open( ragged_fp, "w" ) as f:
+                f.write( "\n".join( lines ) + "\n" )
+            featureOrdering_df = q2_winnowing._transformer._1( WinnowedFeatureOrderingFormat( ragged_fp, mode="r" ) )
+
+        self.assertEqual( featureOrdering_df.shape, exp_featureOrdering.shape )
+        self.assertTrue( featureOrdering_df.iloc[1, -5:].isna().all() )
+        pd.testing.assert_frame_equal(
+            featureOrdering_df.drop( index=1 ).astype(str),
+            exp_featureOrdering.drop( index=1 ).astype(str),
+            check_dtype=False
+        )
+
+        # <><> END OF FUNCTION <><>
+
+
+
+    def test_reader_transformer_unpaired(self):
+        # every kept iteration selection needs both its AUC and PERMANOVA table
+        with self.assertRaises( ValueError ):
+            q2_winnowing._transformer._pair_iterations( { 1: exp_auc, 4: exp_auc }, { 1: exp_permanova } )
+
+        # <><> END OF FUNCTION <><>
+
+
+
     def test_writer_transformer(self):
         # `Artifact._from_view` invokes transformer that handles `dataframe` ->
         # `WinnowedFormat` with all input, because the `WinnowedDirectoryFormat` has
@@ -170,6 +231,33 @@ class WinnowedFormatTests(unittest.TestCase):
         # <><> END OF FUNCTION <><>
 
 
+    def test_binary_transformer(self):
+        # typed columns are read back as they were written, without parsing text
+        exp_knee = exp_permanova.assign( knee=[ row == 24 for row in range( len( exp_permanova ) ) ] )
+        exp_knee.loc[ 50:, "F.model" ] = float( "nan" )
+        for data in ( exp_featureOrdering, exp_auc, exp_knee ):
+            table = q2_winnowing._transformer._10( data )
+            self.assertTrue( WinnowedTableFormat( str( table.path ), mode="r" ).sniff() )
+            pd.testing.assert_frame_equal( q2_winnowing._transformer._9( table ), data )
+
+        # artifacts stay in the tsv layout, the binary one is only used when asked for
+        artifact = Artifact._from_view(Winnowed, [(exp_featureOrdering, exp_auc, exp_permanova)],
+                                       list, archive.ImportProvenanceCapture())
+        binary_dir = artifact.view( WinnowedBinaryDirectoryFormat )
+        self.assertTrue( ( binary_dir.path / "feature_ordered.npz" ).exists() )
+
+        # and a binary directory imports back to the same tables
+        imported = Artifact.import_data(Winnowed, str( binary_dir.path ), view_type=WinnowedBinaryDirectoryFormat)
+        got_featureOrdering, got_auc, got_permanova = imported.view( list )[0]
+        pd.testing.assert_frame_equal(
+            got_permanova.astype(str),
+            exp_permanova.astype(str),
+            check_dtype=False
+        )
+
+        # <><> END OF FUNCTION <><>
+
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file